@@ -6,6 +6,12 @@ load_dotenv()
 APP_PORT = 4333
 SERVER_ADDR = "http://127.0.0.1"
 
+# (connect, read) timeout in secs and retry count for the requests made to the comfy server
+COMFY_API_TIMEOUT = (5, 120)
+COMFY_API_RETRIES = 3
+# secs to wait for a newly started comfy server to respond (loading custom nodes can take a while)
+COMFY_STARTUP_TIMEOUT = int(os.getenv("COMFY_RUNNER_STARTUP_TIMEOUT", 600))
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 comfy_dir = os.path.join(os.path.dirname(current_dir), "ComfyUI/")
 COMFY_BASE_PATH = os.getenv("COMFY_BASE_PATH", comfy_dir) or comfy_dir
@@ -19,6 +25,48 @@ COMFY_MODEL_PATH_LIST = [
     "../ComfyUI/custom_nodes/ComfyUI-Manager/model-list.json",
     "./data/extra_comfy_weights.json",
 ]
+# the weight files and the comfy model lists are compiled into this catalog (rebuilt when they change)
+MODEL_CATALOG_PATH = os.getenv(
+    "COMFY_RUNNER_MODEL_CATALOG_PATH", os.path.join(current_dir, "data", ".model_catalog.pickle")
+)
+
+# model downloads run in parallel, with at most MAX_DOWNLOADS_PER_HOST at a time from a single host
+MODEL_DOWNLOAD_WORKERS = int(os.getenv("COMFY_RUNNER_MODEL_DOWNLOAD_WORKERS", 4))
+MAX_DOWNLOADS_PER_HOST = int(os.getenv("COMFY_RUNNER_MAX_DOWNLOADS_PER_HOST", 2))
+# connections open to a single host across those downloads (a segmented download uses several)
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("COMFY_RUNNER_MAX_CONNECTIONS_PER_HOST", 8))
+
+# files larger than this are fetched over several parallel range requests (if the server supports it)
+SEGMENTED_DOWNLOAD_MIN_SIZE = int(
+    os.getenv("COMFY_RUNNER_SEGMENTED_DOWNLOAD_MIN_SIZE", 256 * 1024 * 1024)
+)
+SEGMENTED_DOWNLOAD_CONNECTIONS = int(
+    os.getenv("COMFY_RUNNER_SEGMENTED_DOWNLOAD_CONNECTIONS", 8)
+)
+
+# bare mirrors of the custom node (and comfy) repos, checkouts only fetch what they are missing (empty to disable)
+GIT_MIRROR_PATH = os.getenv(
+    "COMFY_RUNNER_GIT_MIRROR_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "comfy_runner", "git_mirrors"),
+)
+
+# custom node packs cloned in parallel (their dependencies are installed one at a time)
+NODE_INSTALL_WORKERS = int(os.getenv("COMFY_RUNNER_NODE_INSTALL_WORKERS", 4))
+
+# wheels in this folder are installed without the package index (custom node requirements fall back to it)
+PIP_WHEELHOUSE_PATH = os.getenv("COMFY_RUNNER_PIP_WHEELHOUSE_PATH", "")
+
+# downloaded models are kept once per content (sha256) in this store and linked into the model folders
+MODEL_STORE_ENABLED = os.getenv("COMFY_RUNNER_MODEL_STORE_ENABLED", "true").lower() in ["true", "1"]
+MODEL_STORE_PATH = os.getenv(
+    "COMFY_RUNNER_MODEL_STORE_PATH", os.path.join(COMFY_MODELS_BASE_PATH, ".model_store")
+)
+
+# input / output folders of the servers of a ComfyServerPool (kept outside the managed ComfyUI checkout)
+SERVER_POOL_INSTANCE_PATH = os.getenv(
+    "COMFY_RUNNER_SERVER_POOL_INSTANCE_PATH",
+    os.path.join(os.path.dirname(current_dir), "comfy_runner_instances"),
+)
 
 # enable this to view comfy console logs and other debug statements
 DEBUG_LOG_ENABLED = True
@@ -1,21 +1,15 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import glob
-import importlib
+import hashlib
 import json
 import os
 import platform
 import time
 import sys
 import traceback
-import pkg_resources
-import psutil
 import subprocess
-import re
-import toml
-import websocket
+import threading
 import uuid
-import git
-from git import Repo
 
 from .utils.gen_status_tracker import GenerationStatusTracker
 
@@ -24,8 +18,10 @@ from .constants import (
     APP_PORT,
     COMFY_BASE_PATH,
     COMFY_MODELS_BASE_PATH,
+    COMFY_STARTUP_TIMEOUT,
     DEBUG_LOG_ENABLED,
     MODEL_DOWNLOAD_PATH_LIST,
+    MODEL_DOWNLOAD_WORKERS,
     MODEL_FILETYPES,
     OPTIONAL_MODELS,
     SERVER_ADDR,
@@ -33,6 +29,9 @@ from .constants import (
 )
 from .utils.comfy.api import ComfyAPI
 from .utils.comfy.methods import ComfyMethod
+from .utils.comfy.node_matcher import NodeTypeMatcher
+from .utils.comfy.restart_decision import RestartDecision
+from .utils.comfy.workflow_validator import WorkflowValidationError, validate_workflow
 from .utils.common import (
     clear_directory,
     convert_to_relative_path,
@@ -48,16 +47,104 @@ from .utils.logger import LoggingType, app_logger
 
 
 class ComfyRunner:
-    def __init__(self):
-        self.comfy_api = ComfyAPI(SERVER_ADDR, APP_PORT)
+    def __init__(self, port=APP_PORT, input_dir=None, output_dir=None, setup_lock=None):
+        """
+        port:           port of the comfy server managed by this runner
+        input_dir:      comfy input directory (defaults to ./ComfyUI/input)
+        output_dir:     comfy output directory (defaults to ./ComfyUI/output)
+        setup_lock:     lock shared by the runners of the same comfy checkout, the comfy /
+                        custom node / pip setup of their preflights runs one at a time
+        """
+        self.port = port
+        self.setup_lock = setup_lock or threading.RLock()
+        # predictions of the runner share its input / output dirs, so they run one at a time
+        self.prediction_lock = threading.Lock()
+        self.custom_io_dirs = bool(input_dir or output_dir)
+        self.input_dir = input_dir or "./ComfyUI/input"
+        self.output_dir = output_dir or "./ComfyUI/output"
+        self.server_restart_count = 0
+        self.server_process = None
+        # pid of the server started by this runner, so that it can be found by the
+        # next runner process as well without scanning every process
+        self.pid_file_path = f"./ComfyUI/.comfy_runner_{port}.pid"
+        self.server_boot_time = None  # secs the last start_server took to get ready
+        if self.custom_io_dirs:
+            os.makedirs(self.input_dir, exist_ok=True)
+            os.makedirs(self.output_dir, exist_ok=True)
+        self.comfy_api = ComfyAPI(SERVER_ADDR, port)
         self.model_downloader = ModelDownloader(MODEL_DOWNLOAD_PATH_LIST)
         self.gen_status_tracker = GenerationStatusTracker()
+        self._async_comfy_api = None
+        # (class types, registered nodes fingerprint) -> missing nodes
+        self._node_resolution_cache = {}
+        self.invalidate_node_cache()
+
+    @property
+    def async_comfy_api(self):
+        # created on first use so that aiohttp is only needed by async callers
+        if self._async_comfy_api is None:
+            from .utils.comfy.async_api import AsyncComfyAPI
+
+            self._async_comfy_api = AsyncComfyAPI(SERVER_ADDR, self.port)
+
+        return self._async_comfy_api
 
     # TODO: create mixins for these kind of methods
     def is_server_running(self):
-        pid = find_process_by_port(APP_PORT)
+        # the http probe is much cheaper than scanning the connections of every process,
+        # the scan is only needed when the port is held by something that isn't serving
+        if self.comfy_api.is_ready():
+            return True
+
+        pid = self.get_server_pid()
         return True if pid else False
 
+    def _get_tracked_pid_list(self):
+        pid_list = []
+        if self.server_process and self.server_process.poll() is None:
+            pid_list.append(self.server_process.pid)
+
+        if os.path.exists(self.pid_file_path):
+            try:
+                with open(self.pid_file_path, "r") as f:
+                    pid_list.append(int(f.read().strip()))
+            except (OSError, ValueError):
+                pass
+
+        return pid_list
+
+    def get_server_pid(self):
+        # the tracked pids are only returned if they are actually listening on the port,
+        # a server started externally is found through the slower lookup
+        return find_process_by_port(self.port, self._get_tracked_pid_list())
+
+    def _remove_pid_file(self):
+        if os.path.exists(self.pid_file_path):
+            os.remove(self.pid_file_path)
+
+    def _wait_for_server(self, timeout=COMFY_STARTUP_TIMEOUT):
+        """
+        polls the server (with exponential backoff) till it responds, raises if the
+        process exits or it doesn't respond within timeout
+        """
+        start_time = time.time()
+        delay = 0.05
+        while not self.comfy_api.is_ready():
+            return_code = self.server_process.poll()
+            if return_code is not None:
+                raise Exception(
+                    f"Comfy server exited with code {return_code} while starting"
+                )
+
+            elapsed_time = time.time() - start_time
+            if elapsed_time > timeout:
+                self.server_process.terminate()
+                self.server_process.wait()
+                raise Exception(f"Comfy server not ready after {timeout} secs")
+
+            time.sleep(min(delay, timeout - elapsed_time))
+            delay = min(delay * 2, 0.5)
+
     def start_server(self):
         # checking if comfy is already running
         if not self.is_server_running():
@@ -70,31 +157,58 @@ class ComfyRunner:
                 kwargs["stderr"] = subprocess.DEVNULL
 
             python_executable = sys.executable
-            self.server_process = subprocess.Popen(
-                [python_executable, "./ComfyUI/main.py", "--port", str(APP_PORT)],
-                **kwargs,
-            )
+            cmd = [python_executable, "./ComfyUI/main.py", "--port", str(self.port)]
+            if self.custom_io_dirs:
+                cmd += [
+                    "--input-directory",
+                    os.path.abspath(self.input_dir),
+                    "--output-directory",
+                    os.path.abspath(self.output_dir),
+                ]
+            self.invalidate_node_cache()
+            start_time = time.time()
+            self.server_process = subprocess.Popen(cmd, **kwargs)
+            with open(self.pid_file_path, "w") as f:
+                f.write(str(self.server_process.pid))
 
             # waiting for server to start accepting requests
-            while not self.is_server_running():
-                time.sleep(0.5)
+            try:
+                self._wait_for_server()
+            except Exception:
+                self._remove_pid_file()
+                raise
 
-            app_logger.log(LoggingType.DEBUG, "comfy server is running")
+            self.server_boot_time = time.time() - start_time
+            app_logger.log(
+                LoggingType.INFO,
+                f"comfy server is running (ready in {self.server_boot_time:.2f} secs)",
+            )
         else:
             try:
                 if not self.comfy_api.health_check():
-                    raise Exception(f"Port {APP_PORT} blocked")
+                    raise Exception(f"Port {self.port} blocked")
                 else:
                     app_logger.log(LoggingType.DEBUG, "Server already running")
             except Exception as e:
-                raise Exception(f"Port {APP_PORT} blocked")
+                raise Exception(f"Port {self.port} blocked")
 
     def stop_server(self):
-        pid = find_process_by_port(APP_PORT)
+        pid = self.get_server_pid()
         if pid:
-            process = psutil.Process(pid)
-            process.terminate()
-            process.wait()
+            if self.server_process and self.server_process.pid == pid:
+                # waiting through the handle also reaps the child
+                self.server_process.terminate()
+                self.server_process.wait()
+            else:
+                import psutil
+
+                process = psutil.Process(pid)
+                process.terminate()
+                process.wait()
+
+        self.server_process = None
+        self._remove_pid_file()
+        self.invalidate_node_cache()
 
     def clear_comfy_logs(self):
         log_file_list = glob.glob("comfyui*.log")
@@ -106,19 +220,64 @@ class ComfyRunner:
         prompt_id = self.comfy_api.queue_prompt(prompt, client_id)["prompt_id"]
 
         # waiting for the execution to finish
-        while True:
+        for _ in self._wait_for_prompts(ws, [prompt_id]):
+            pass
+
+        # fetching results
+        history = self.comfy_api.get_history(prompt_id)[prompt_id]
+        return self._get_history_outputs(history, output_node_ids)
+
+    def get_output_list(self, ws, prompt_dict, client_id, output_node_ids):
+        """
+        queues every prompt of prompt_dict ({key: prompt}) back to back and
+        yields (key, output) as they complete. output is None if the prompt was rejected
+        """
+        prompt_id_map = {}
+        for key, prompt in prompt_dict.items():
+            res = self.comfy_api.queue_prompt(prompt, client_id)
+            if "prompt_id" in res:
+                prompt_id_map[res["prompt_id"]] = key
+            else:
+                app_logger.log(LoggingType.ERROR, f"Prompt {key} rejected: {res}")
+                yield key, None
+
+        for prompt_id in self._wait_for_prompts(ws, list(prompt_id_map.keys())):
+            history = self.comfy_api.get_history(prompt_id)[prompt_id]
+            yield prompt_id_map[prompt_id], self._get_history_outputs(
+                history, output_node_ids
+            )
+
+    def _wait_for_prompts(self, ws, prompt_id_list):
+        # yields the prompt ids as their execution finishes
+        pending_prompt_ids = set(prompt_id_list)
+        while len(pending_prompt_ids):
             out = ws.recv()
             if isinstance(out, str):
                 message = json.loads(out)
                 if message["type"] == "executing":
                     data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break  # Execution is done
+                    if data["node"] is None and data["prompt_id"] in pending_prompt_ids:
+                        pending_prompt_ids.remove(data["prompt_id"])
+                        yield data["prompt_id"]  # Execution is done
             else:
                 continue  # previews are binary data
 
+    async def get_output_async(self, ws, prompt, client_id, output_node_ids):
+        """
+        async version of get_output, ws is the websocket returned by
+        self.async_comfy_api.connect_websocket(client_id)
+        """
+        res = await self.async_comfy_api.queue_prompt(prompt, client_id)
+        prompt_id = res["prompt_id"]
+
+        # waiting for the execution to finish
+        await self.async_comfy_api.wait_for_prompt(ws, prompt_id)
+
         # fetching results
-        history = self.comfy_api.get_history(prompt_id)[prompt_id]
+        history = (await self.async_comfy_api.get_history(prompt_id))[prompt_id]
+        return self._get_history_outputs(history, output_node_ids)
+
+    def _get_history_outputs(self, history, output_node_ids):
         output_list = {"file_list": [], "text_output": []}
         output_node_ids = [str(id) for id in output_node_ids] if output_node_ids else []
         for node_id in history["outputs"]:
@@ -140,56 +299,227 @@ class ComfyRunner:
 
         return output_list
 
-    def filter_missing_node(self, workflow):
-        mappings = self.comfy_api.get_node_mapping_list()
-        custom_node_list = self.comfy_api.get_all_custom_node_list()
-        data = custom_node_list["custom_nodes"]
-
-        # Build regex->url map
-        regex_to_url = [
-            {"regex": re.compile(item["nodename_pattern"]), "url": item["files"][0]}
-            for item in data
-            if item.get("nodename_pattern")
-        ]
-
-        # Build name->url map
-        name_to_url = {
-            name: url for url, names in mappings.items() for name in names[0]
+    # ----------- streaming -----------------
+    # websocket messages of the prompt that are passed on as events by predict_stream
+    STREAM_EVENT_TYPE_LIST = (
+        "progress",
+        "executing",
+        "executed",
+        "execution_cached",
+        "execution_error",
+        "execution_interrupted",
+    )
+
+    def _get_prompt_id(self, res):
+        if "prompt_id" not in res:
+            raise Exception(f"Prompt rejected: {res}")
+        return res["prompt_id"]
+
+    def _get_stream_state(self):
+        return {
+            "is_finished": False,
+            "error": None,
+            "cached_node_set": set(),
+            "output_node_set": set(),  # nodes whose output was yielded already
+            "file_paths": [],
+            "text_output": [],
         }
 
-        registered_nodes = self.comfy_api.get_registered_nodes()
-
-        missing_nodes = set()
-        nodes = [node for _, node in workflow.items()]
+    def _get_output_events(self, outputs, output_node_ids, output_folder, stream_state):
+        # copies the files of the node outputs ({node_id: output}) that weren't yielded yet
+        event_list = []
+        for node_id, node_output in outputs.items():
+            node_id = str(node_id)
+            if node_id in stream_state["output_node_set"]:
+                continue
 
-        for node in nodes:
-            node_type = node.get("class_type", "")
-            if node_type.startswith("workflow/"):
+            node_output = self._get_history_outputs(
+                {"outputs": {node_id: node_output}}, output_node_ids
+            )
+            if not (node_output["file_list"] or node_output["text_output"]):
                 continue
 
-            if node_type not in registered_nodes:
+            stream_state["output_node_set"].add(node_id)
+            # the graph can still be running and a later node may read the file, the
+            # originals are removed with the output dir once the prompt is done
+            output = self._collect_output_files(
+                node_output, output_folder, delete_original=False
+            )
+            stream_state["file_paths"] += output["file_paths"]
+            stream_state["text_output"] += output["text_output"]
+            event_list.append({"type": "output", "node": node_id, **output})
+
+        return event_list
+
+    def _get_stream_events(
+        self, message, prompt_id, output_node_ids, output_folder, stream_state
+    ):
+        """
+        events of a websocket message, empty if it isn't about the prompt. an "output"
+        event follows the "executed" one of every output node
+        """
+        message_type = message.get("type")
+        data = message.get("data") or {}
+        # older servers don't send the prompt id with the progress
+        if (
+            message_type not in self.STREAM_EVENT_TYPE_LIST
+            or data.get("prompt_id", prompt_id) != prompt_id
+        ):
+            return []
+
+        event_list = [dict(data, type=message_type)]
+        if message_type == "executed":
+            event_list += self._get_output_events(
+                {data["node"]: data.get("output") or {}},
+                output_node_ids,
+                output_folder,
+                stream_state,
+            )
+        elif message_type == "execution_cached":
+            stream_state["cached_node_set"].update(
+                str(n) for n in data.get("nodes", [])
+            )
+        elif message_type in ("execution_error", "execution_interrupted"):
+            app_logger.log(
+                LoggingType.ERROR,
+                f"Prompt {message_type.replace('_', ' ')}: {data.get('exception_message', '')}",
+            )
+            stream_state["error"] = event_list[0]
+            stream_state["is_finished"] = True
+        elif message_type == "executing" and data.get("node") is None:
+            stream_state["is_finished"] = True  # Execution is done
+
+        return event_list
+
+    # ----------- missing node resolution -----------------
+    # the registered nodes and the manager catalog only change when the server restarts or
+    # nodes are installed, so they are fetched once per server build and the result is
+    # cached per set of class types
+    MAX_NODE_RESOLUTION_CACHE_SIZE = 256
+
+    def invalidate_node_cache(self):
+        self._registered_nodes = None
+        self._registered_node_fingerprint = None
+        self._node_catalog = None
+
+    def _get_registered_nodes(self, refresh=False):
+        # this is the /object_info of the server, versioned by its fingerprint
+        if self._registered_nodes is None or refresh:
+            registered_nodes = self.comfy_api.get_registered_nodes()
+            self._registered_node_fingerprint = hashlib.sha1(
+                "\n".join(sorted(registered_nodes)).encode()
+            ).hexdigest()
+            self._registered_nodes = registered_nodes
+
+        return self._registered_nodes
+
+    def _get_node_catalog(self):
+        if self._node_catalog is None:
+            mappings = self.comfy_api.get_node_mapping_list()
+            data = self.comfy_api.get_all_custom_node_list()["custom_nodes"]
+            self._node_catalog = {
+                "custom_nodes": data,
+                # name -> url
+                "name_to_url": {
+                    name: url for url, names in mappings.items() for name in names[0]
+                },
+                # nodename_pattern -> url
+                "node_matcher": NodeTypeMatcher(
+                    [
+                        (item["nodename_pattern"], item["files"][0])
+                        for item in data
+                        if item.get("nodename_pattern")
+                    ]
+                ),
+            }
+
+        return self._node_catalog
+
+    def validate_workflow(
+        self, workflow, check_unknown_nodes=True, check_model_values=True
+    ):
+        """
+        checks the workflow locally against the cached /object_info of the running
+        server, returns the list of errors and warnings (empty if it is valid)
+        """
+        return validate_workflow(
+            workflow,
+            self._get_registered_nodes(),
+            check_unknown_nodes=check_unknown_nodes,
+            check_model_values=check_model_values,
+        )
+
+    def _get_workflow_errors(self, workflow_dict, log_warnings=True, **kwargs):
+        # idx -> errors of the invalid workflows, the warnings are only logged
+        error_dict = {}
+        for idx, workflow in workflow_dict.items():
+            error_list = []
+            for error in self.validate_workflow(workflow, **kwargs):
+                if error["severity"] == "warning":
+                    if log_warnings:
+                        app_logger.log(LoggingType.WARNING, error["message"])
+                else:
+                    error_list.append(error)
+            if len(error_list):
+                error_dict[idx] = error_list
+
+        return error_dict
+
+    def _check_workflow_dict(self, workflow_dict, **kwargs):
+        # raises WorkflowValidationError with the errors of each workflow (idx -> workflow)
+        error_dict = self._get_workflow_errors(workflow_dict, **kwargs)
+        if len(error_dict):
+            raise WorkflowValidationError(error_dict)
+
+    def filter_missing_node(self, workflow):
+        registered_nodes = self._get_registered_nodes()
+        node_type_set = frozenset(
+            node.get("class_type", "") for node in workflow.values()
+        )
+        cache_key = (node_type_set, self._registered_node_fingerprint)
+        if cache_key in self._node_resolution_cache:
+            return list(self._node_resolution_cache[cache_key])
+
+        unregistered_node_type_list = [
+            node_type
+            for node_type in node_type_set
+            if not node_type.startswith("workflow/")
+            and node_type not in registered_nodes
+        ]
+
+        ans = []
+        # the manager catalog is only needed when something is missing
+        if len(unregistered_node_type_list):
+            node_catalog = self._get_node_catalog()
+            name_to_url = node_catalog["name_to_url"]
+
+            missing_nodes = set()
+            for node_type in unregistered_node_type_list:
                 url = name_to_url.get(node_type.strip(), "")
                 if url:
                     missing_nodes.add(url)
                 else:
-                    for regex_item in regex_to_url:
-                        if regex_item["regex"].search(node_type):
-                            missing_nodes.add(regex_item["url"])
+                    missing_nodes.update(node_catalog["node_matcher"].match(node_type))
 
-        unresolved_nodes = []  # not yet implemented in comfy
+            unresolved_nodes = []  # not yet implemented in comfy
 
-        for node_type in unresolved_nodes:
-            url = name_to_url.get(node_type, "")
-            if url:
-                missing_nodes.add(url)
+            for node_type in unresolved_nodes:
+                url = name_to_url.get(node_type, "")
+                if url:
+                    missing_nodes.add(url)
 
-        ans = [
-            node
-            for node in data
-            if any(file in missing_nodes for file in node.get("files", []))
-        ]
+            ans = [
+                node
+                for node in node_catalog["custom_nodes"]
+                if any(file in missing_nodes for file in node.get("files", []))
+            ]
+
+        if len(self._node_resolution_cache) >= self.MAX_NODE_RESOLUTION_CACHE_SIZE:
+            # dropping the oldest entry
+            self._node_resolution_cache.pop(next(iter(self._node_resolution_cache)))
+        self._node_resolution_cache[cache_key] = ans
         # print("********* missing nodes found: ", ans)
-        return ans
+        return list(ans)
 
     def download_models(
         self,
@@ -248,47 +578,83 @@ class ComfyRunner:
                 m_l.append(model)
         models_to_download = m_l
 
-        for model in models_to_download:
-            if self.gen_status_tracker.is_generation_cancelled(client_id):
-                break
+        # catalog models and extra models are downloaded concurrently, the results
+        # are merged back in submission order so that the report stays deterministic
+        is_cancelled = lambda: self.gen_status_tracker.is_generation_cancelled(
+            client_id
+        )
 
-            status, similar_models, file_status = self.model_downloader.download_model(
-                model
-            )
-            if not status:
-                models_not_found.append(
-                    {
-                        "model": model,
-                        "similar_models": similar_models,
-                    }
-                )
-            elif file_status == FileStatus.NEW_DOWNLOAD.value:
-                models_downloaded = True
+        def _download(task):
+            task_type, model = task
+            if is_cancelled():
+                return None
 
-        # downloading extra models
-        for model in extra_models_list:
-            if self.gen_status_tracker.is_generation_cancelled(client_id):
-                break
+            if task_type == "model":
+                return self.model_downloader.download_model(
+                    model, cancel_check=is_cancelled
+                )
 
-            status, file_status = self.model_downloader.download_file(
+            return self.model_downloader.download_file(
                 model["filename"],
                 model["url"],
                 model["dest"],
+                cancel_check=is_cancelled,
             )
 
-            if status:
-                models_downloaded = (
-                    True if file_status == FileStatus.NEW_DOWNLOAD.value else False
-                )
-                for m in models_not_found:
-                    if m["model"] == model["filename"]:
-                        models_not_found.remove(m)
-                        break
+        task_list = [("model", model) for model in models_to_download] + [
+            ("extra", model) for model in extra_models_list
+        ]
+        result_list = [None] * len(task_list)
+        if len(task_list):
+            with ThreadPoolExecutor(
+                max_workers=min(MODEL_DOWNLOAD_WORKERS, len(task_list))
+            ) as executor:
+                future_to_idx = {
+                    executor.submit(_download, task): idx
+                    for idx, task in enumerate(task_list)
+                }
+                for future in as_completed(future_to_idx):
+                    try:
+                        result_list[future_to_idx[future]] = future.result()
+                    except Exception as e:
+                        app_logger.log(
+                            LoggingType.ERROR, f"Error downloading model: {str(e)}"
+                        )
+
+                    if is_cancelled():
+                        for pending_future in future_to_idx:
+                            pending_future.cancel()
+
+        for (task_type, model), result in zip(task_list, result_list):
+            if result is None:
+                continue
+
+            if task_type == "model":
+                status, similar_models, file_status = result
+                if not status:
+                    models_not_found.append(
+                        {
+                            "model": model,
+                            "similar_models": similar_models,
+                        }
+                    )
+                elif file_status == FileStatus.NEW_DOWNLOAD.value:
+                    models_downloaded = True
+            else:
+                status, file_status = result
+                if status:
+                    if file_status == FileStatus.NEW_DOWNLOAD.value:
+                        models_downloaded = True
+                    models_not_found = [
+                        m for m in models_not_found if m["model"] != model["filename"]
+                    ]
 
         # checking if models_not_found are already inside comfy
-        for model in models_not_found:
-            if search_file(model["model"].split("/")[-1], COMFY_BASE_PATH):
-                models_not_found.remove(model)
+        models_not_found = [
+            model
+            for model in models_not_found
+            if not search_file(model["model"].split("/")[-1], COMFY_BASE_PATH)
+        ]
 
         return {
             "data": {
@@ -306,6 +672,9 @@ class ComfyRunner:
         client_id=None,
     ) -> dict:
         nodes_installed = False
+        is_cancelled = lambda: self.gen_status_tracker.is_generation_cancelled(
+            client_id
+        )
 
         # installing missing nodes
         missing_nodes = self.filter_missing_node(workflow)
@@ -316,6 +685,19 @@ class ComfyRunner:
 
         provided_node_url_dict = {node["url"]: node for node in extra_node_urls}
         extra_node_url_dict = {}
+        # git node packs are cloned in parallel by the node installer, the rest (copy /
+        # unzip installs) go through the manager
+        clone_node_list = []
+        manager_node_list = []
+
+        def _add_node(node):
+            if node.get("install_type") == "git-clone":
+                for url in node["files"]:
+                    clone_node_list.append(
+                        {"title": node["title"], "url": url, "pip": node.get("pip", [])}
+                    )
+            else:
+                manager_node_list.append(node)
 
         for node in missing_nodes:
             if node["files"][0] in provided_node_url_dict and provided_node_url_dict[
@@ -326,26 +708,12 @@ class ComfyRunner:
                 ]
                 continue
 
-            if self.gen_status_tracker.is_generation_cancelled(client_id):
-                break
-
-            app_logger.log(LoggingType.DEBUG, f"Installing {node['title']}")
             if node["installed"] in ["False", False]:
-                nodes_installed = True
-                status = self.comfy_api.install_custom_node(node)
-                if status != {}:
-                    app_logger.log(
-                        LoggingType.ERROR,
-                        "Failed to install custom node ",
-                        node["title"],
-                    )
+                _add_node(node)
 
         # installing custom git repos
-        nodes_to_install_with_commit_hash = []
-        nodes_to_install = []
         if len(extra_node_url_dict.keys()):
-            custom_node_list = self.comfy_api.get_all_custom_node_list()
-            custom_node_list = custom_node_list["custom_nodes"]
+            custom_node_list = self._get_node_catalog()["custom_nodes"]
             url_node_map = {}
             for node in custom_node_list:
                 if node["reference"] not in url_node_map:
@@ -356,54 +724,61 @@ class ComfyRunner:
             for git_url, node_info in extra_node_url_dict.items():
 
                 if node_info.get("commit_hash", None):
-                    nodes_to_install_with_commit_hash.append(node_info)
+                    clone_node_list.append(
+                        {
+                            "title": node_info["title"],
+                            "url": node_info["url"],
+                            "commit_hash": node_info["commit_hash"],
+                        }
+                    )
                 elif git_url in url_node_map:
                     for node in url_node_map[git_url]:
-                        nodes_to_install.append(node)
+                        _add_node(node)
                 else:
-                    node = {
-                        "author": "",
-                        "title": "",
-                        "reference": git_url,
-                        "files": [git_url],
-                        "install_type": "git-clone",
-                        "description": "",
-                        "installed": "False",
-                    }
-                    nodes_to_install.append(node)
-
-            for n in nodes_to_install:
-                if self.gen_status_tracker.is_generation_cancelled(client_id):
-                    break
-
-                nodes_installed = True
-                app_logger.log(LoggingType.DEBUG, f"Installing {n['reference']}")
-                status = self.comfy_api.install_custom_node(n)
-                if status != {}:
-                    app_logger.log(
-                        LoggingType.ERROR, "Failed to install custom node ", n["title"]
-                    )
+                    clone_node_list.append({"title": "", "url": git_url})
 
-            custom_node_installer = get_node_installer()
-            for n in nodes_to_install_with_commit_hash:
-                if self.gen_status_tracker.is_generation_cancelled(client_id):
-                    break
+        node_status_dict = {}  # title / url -> installed
+        for n in manager_node_list:
+            if is_cancelled():
+                break
 
-                app_logger.log(LoggingType.DEBUG, f"Installing {n['title']}")
-                nodes_installed = True
-                json_data = {
-                    "files": [n["url"]],
-                    "install_type": "git-clone",
-                    "commit_hash": [n["commit_hash"]],
-                }
-                status = custom_node_installer.install_node(json_data)
-                if not status:
+            nodes_installed = True
+            app_logger.log(LoggingType.DEBUG, f"Installing {n['title']}")
+            status = self.comfy_api.install_custom_node(n)
+            node_status_dict[n["title"]] = status == {}
+            if status != {}:
+                app_logger.log(
+                    LoggingType.ERROR, "Failed to install custom node ", n["title"]
+                )
+
+        if clone_node_list and not is_cancelled():
+            nodes_installed = True
+            custom_node_installer = get_node_installer()
+            start_time = time.time()
+            result_dict = custom_node_installer.install_nodes(
+                clone_node_list, cancel_check=is_cancelled
+            )
+            for url, result in result_dict.items():
+                node_status_dict[result["title"] or url] = result["status"]
+                if not result["status"]:
                     app_logger.log(
-                        LoggingType.ERROR, "Failed to install custom node ", n["title"]
+                        LoggingType.ERROR,
+                        f"Failed to install custom node {result['title'] or url}: {result['error']}",
                     )
+            app_logger.log(
+                LoggingType.INFO,
+                f"Installed {sum(r['status'] for r in result_dict.values())}/{len(result_dict)} "
+                f"node packs in {time.time() - start_time:.1f}s",
+            )
+
+        if nodes_installed:
+            self.invalidate_node_cache()
 
         return {
-            "data": {"nodes_installed": nodes_installed},
+            "data": {
+                "nodes_installed": nodes_installed,
+                "node_status": node_status_dict,
+            },
             "message": "",
             "status": True,
         }
@@ -424,7 +799,7 @@ class ComfyRunner:
 
     def stop_current_generation(self, client_id=None, retry_window=3):
         """
-        CAUTION: This stops any running generation on active comfyui APP_PORT (default 8188)
+        CAUTION: This stops any running generation on the comfyui port of this runner (default 8188)
         client_id: tag used to identify generations
         retry_window: the amount of time (in secs) it will try to find the process (as it takes a while for comfy to start the generation)
         """
@@ -480,31 +855,13 @@ class ComfyRunner:
 
     def quick_requirements_check(self, requirements_file):
         """
-        this method only checks for package name and not their version.
-        potential issue - if the installed pkg name is different from the requirements.txt
-        then this will always return the pkg as missing
+        returns the requirements (with their version specifiers) of the file that are
+        not satisfied by the installed packages. the result is cached till the file or
+        the installed packages change
         """
-        with open(requirements_file, "r") as f:
-            requirements = []
-            for line in f:
-                if line.strip() and not line.startswith("#"):
-                    delimeter = "=="
-                    if ">=" in line.strip():
-                        delimeter = ">="
-                    elif "<=" in line.strip():
-                        delimeter = "<="
-
-                    requirements.append(line.strip().lower().split(delimeter)[0])
-
-        missing = []
-        installed_pkg_list = sorted(
-            [dist.project_name.lower() for dist in pkg_resources.working_set]
-        )
-        for package in requirements:
-            if package not in installed_pkg_list:
-                missing.append(package)
+        from .utils.requirements_verifier import requirements_verifier
 
-        return missing
+        return requirements_verifier.check_file(requirements_file)
 
     def process_file(self, item):
         source, dest_path, filename = item
@@ -514,6 +871,366 @@ class ComfyRunner:
         else:
             return copy_files(source, dest_path, overwrite=True, filename=filename)
 
+    def _prepare_comfy(
+        self, comfy_commit_hash, extra_node_urls, strict_dep_list, restart_decision
+    ):
+        # the packages pip changes are recorded in restart_decision
+        from .utils.comfy.provisioner import comfy_provisioner
+        from .utils.pip_installer import install_requirements
+        from .utils.requirements_verifier import (
+            get_requirement_name,
+            requirements_verifier,
+        )
+
+        custom_manager_hash = None
+        for n in extra_node_urls:
+            if n["title"] == "ComfyUI-Mananger":
+                custom_manager_hash = n["commit_hash"]
+
+        # cloning comfy repo / moving it to the commit (a no-op when it's already there)
+        try:
+            comfy_provisioner.ensure_comfy(comfy_commit_hash)
+            comfy_provisioner.ensure_manager(custom_manager_hash)
+        except Exception as e:
+            app_logger.log(LoggingType.ERROR, f"Unable to checkout ComfyUI: {str(e)}")
+            return False
+
+        # installing requirements
+        app_logger.log(
+            LoggingType.DEBUG,
+            "Checking comfy requirements, please wait...",
+        )
+        requirements_file = os.path.join(COMFY_BASE_PATH, "requirements.txt")
+        missing_pkg_list = self.quick_requirements_check(requirements_file)
+        # the pinned packages are left to _enforce_strict_deps, otherwise a pin that
+        # conflicts with comfy's requirements is upgraded and downgraded on every predict
+        strict_name_list = [
+            get_requirement_name(package) for package in (strict_dep_list or {})
+        ]
+        missing_pkg_list = [
+            p
+            for p in missing_pkg_list
+            if get_requirement_name(p) not in strict_name_list
+        ]
+        if missing_pkg_list and len(missing_pkg_list):
+            app_logger.log(LoggingType.INFO, f"Missing packages: {missing_pkg_list}")
+            # only the unsatisfied requirements are installed (not the whole file)
+            report = install_requirements(missing_pkg_list, cwd=COMFY_BASE_PATH)
+            # a running server keeps the old modules loaded
+            for name, (_, version) in sorted(report["changed"].items()):
+                restart_decision.record(
+                    RestartDecision.PIP_PACKAGES, f"{name}=={version}"
+                )
+            if not report["status"]:
+                app_logger.log(
+                    LoggingType.ERROR,
+                    f"Unable to install the comfy requirements: {report['failed']}",
+                )
+                return False
+            requirements_verifier.mark_installed(requirements_file, missing_pkg_list)
+
+        return True
+
+    def _setup_checkpointing(self, checkpointing_data, restart_decision):
+        # enabling checkpointing, the node install / config change is recorded in restart_decision
+        checkpoint_node_path = os.path.join(
+            COMFY_BASE_PATH, "custom_nodes", "comfy-checkpointing"
+        )
+        checkpoint_config_path = os.path.join(checkpoint_node_path, "config.toml")
+        import toml
+
+        if checkpointing_data:
+            status = True
+            if not os.path.exists(checkpoint_node_path):
+                custom_node_installer = get_node_installer()
+                json_data = {
+                    "files": ["https://github.com/piyushK52/comfy-checkpointing"],
+                    "install_type": "git-clone",
+                }
+                status = custom_node_installer.install_node(json_data)
+                if status:
+                    restart_decision.record(RestartDecision.CHECKPOINT_NODE)
+
+            if not status:
+                app_logger.log(LoggingType.ERROR, "Unable to enable checkpoint node")
+            else:
+                if not os.path.exists(checkpoint_config_path):
+                    with open(checkpoint_config_path, "w") as config_file:
+                        toml.dump({}, config_file)
+
+                if toml.load(checkpoint_config_path) != checkpointing_data:
+                    update_toml_config(checkpoint_config_path, checkpointing_data)
+                    restart_decision.record(RestartDecision.CHECKPOINT_CONFIG)
+                app_logger.log(LoggingType.INFO, "Checkpointing enabled")
+        else:
+            if (
+                os.path.exists(checkpoint_node_path)
+                and os.path.exists(checkpoint_config_path)
+                and toml.load(checkpoint_config_path)
+            ):
+                update_toml_config(checkpoint_config_path, {})
+                restart_decision.record(RestartDecision.CHECKPOINT_CONFIG)
+
+    def _stage_input_files(self, file_path_list):
+        task_list = []
+        clear_directory(self.input_dir)
+        for filepath in file_path_list:
+            if isinstance(filepath, str):
+                source, dest_path = filepath, self.input_dir + "/"
+                filename = None
+            else:
+                source, dest_path = (
+                    filepath["filepath"],
+                    self.input_dir + "/" + filepath["dest_folder"] + "/",
+                )
+                filename = filepath.get("filename", None)
+
+            task_list.append((source, dest_path, filename))
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(self.process_file, task) for task in task_list]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    app_logger.log(
+                        LoggingType.ERROR, f"Failed to stage the input file: {exc}"
+                    )
+
+    def _run_preflight(
+        self,
+        workflow,
+        file_path_list,
+        extra_models_list,
+        extra_node_urls,
+        ignore_model_list,
+        client_id,
+        comfy_commit_hash,
+        strict_dep_list,
+        checkpointing_data,
+        validation_workflow_dict=None,
+        validation_error_dict=None,
+    ):
+        """
+        everything that needs to happen before a workflow can be queued: comfy setup,
+        server start, custom nodes, models and the input files.
+        returns the RestartDecision, False if the workflow can't be run. raises
+        WorkflowValidationError if workflow (or validation_workflow_dict) is invalid,
+        unless validation_error_dict is passed: the invalid workflows are then moved
+        from validation_workflow_dict to it (idx -> errors) and the rest is set up
+        """
+        restart_decision = RestartDecision()
+        # the checkout is shared by every runner of a server pool, two setups at the same
+        # time would clone into the same node folders and run pip concurrently
+        with self.setup_lock:
+            if not self._prepare_comfy(
+                comfy_commit_hash, extra_node_urls, strict_dep_list, restart_decision
+            ):
+                return False
+
+            # clearing the previous logs
+            if not self.is_server_running():
+                self.clear_comfy_logs()
+
+            # start the comfy server if not already running
+            self.start_server()
+
+            # the nodes / models still have to be installed at this point, so only the
+            # structure and values of the registered nodes are checked
+            error_dict = self._get_workflow_errors(
+                validation_workflow_dict or {0: workflow},
+                # logged by the full check once the nodes / models are installed
+                log_warnings=False,
+                check_unknown_nodes=False,
+                check_model_values=False,
+            )
+            if len(error_dict) and validation_error_dict is None:
+                raise WorkflowValidationError(error_dict)
+            if len(error_dict):
+                validation_error_dict.update(error_dict)
+                for idx in error_dict:
+                    validation_workflow_dict.pop(idx)
+                if not len(validation_workflow_dict):
+                    return False
+
+            self._setup_checkpointing(checkpointing_data, restart_decision)
+
+            # download custom nodes
+            res_custom_nodes = self.download_custom_nodes(
+                workflow,
+                extra_node_urls,
+                client_id,
+            )
+            if not res_custom_nodes["status"]:
+                app_logger.log(LoggingType.ERROR, res_custom_nodes["message"])
+                return False
+
+        # download models if not already present
+        res_models = self.download_models(
+            workflow,
+            extra_models_list,
+            ignore_model_list,
+            client_id,
+        )
+        if not res_models[
+            "status"
+        ] and not self.gen_status_tracker.is_generation_cancelled(client_id):
+            app_logger.log(LoggingType.ERROR, res_models["message"])
+            if len(res_models["data"]["models_not_found"]):
+                app_logger.log(
+                    LoggingType.INFO,
+                    "Please provide custom model urls for the models listed below or modify the workflow json to one of the alternative models listed",
+                )
+                for model in res_models["data"]["models_not_found"]:
+                    print("Model: ", model["model"])
+                    print("Alternatives: ")
+                    if len(model["similar_models"]):
+                        for alternative in model["similar_models"]:
+                            print(" - ", alternative)
+                    else:
+                        print(" - None")
+                    print("---------------------------")
+            return False
+
+        if res_custom_nodes["data"]["nodes_installed"]:
+            restart_decision.record(RestartDecision.CUSTOM_NODES)
+        if res_models["data"]["models_downloaded"]:
+            restart_decision.record(RestartDecision.MODELS)
+        with self.setup_lock:
+            self._enforce_strict_deps(strict_dep_list, restart_decision)
+
+            # the server is only restarted if the python state changed, comfy lists the
+            # model folders again when the registered nodes are fetched
+            if restart_decision.restart_required:
+                app_logger.log(
+                    LoggingType.INFO,
+                    f"Restarting the server ({restart_decision.get_reason()})",
+                )
+                self.stop_server()
+                self.start_server()
+                self.server_restart_count += 1
+                restart_decision.restarted = True
+            elif restart_decision.refresh_model_list:
+                try:
+                    self._get_registered_nodes(refresh=True)
+                except Exception as e:
+                    app_logger.log(
+                        LoggingType.ERROR, f"Unable to refresh the model list: {str(e)}"
+                    )
+
+        if len(file_path_list):
+            self._stage_input_files(file_path_list)
+
+        return restart_decision
+
+    def _enforce_strict_deps(self, strict_dep_list, restart_decision):
+        # moves the packages back to the pinned versions (if a node install changed them)
+        from .utils.requirements_verifier import requirements_verifier
+
+        for package, version in (strict_dep_list or {}).items():
+            if requirements_verifier.is_satisfied(f"{package}=={version}"):
+                continue
+
+            cmd = [sys.executable, "-m", "pip", "install", f"{package}=={version}"]
+            try:
+                subprocess.check_call(cmd)
+                app_logger.log(LoggingType.DEBUG, f"Moved {package} to {version}")
+                restart_decision.record(
+                    RestartDecision.PIP_PACKAGES, f"{package}=={version}"
+                )
+            except subprocess.CalledProcessError as e:
+                app_logger.log(
+                    LoggingType.ERROR, f"Failed to move {package} {version}. Error: {e}"
+                )
+
+    def _update_model_paths(self, workflow):
+        # checkpoints, lora, default etc..
+        comfy_directory = COMFY_MODELS_BASE_PATH + "models/"
+        comfy_model_folders = [
+            folder
+            for folder in os.listdir(comfy_directory)
+            if os.path.isdir(os.path.join(comfy_directory, folder))
+        ]
+        # update model paths e.g. 'v3_sd15_sparsectrl_rgb.ckpt' --> 'SD1.5/animatediff/v3_sd15_sparsectrl_rgb.ckpt'
+        for node in workflow:
+            if "inputs" in workflow[node]:
+                for key, input in workflow[node]["inputs"].items():
+                    if (
+                        isinstance(input, str)
+                        and any(input.endswith(ft) for ft in MODEL_FILETYPES)
+                        and not any(input.endswith(m) for m in OPTIONAL_MODELS)
+                    ):
+                        base = None
+                        # if os.path.sep in input:
+                        base, input = os.path.split(input)
+                        model_path_list = find_file_in_directory(comfy_directory, input)
+                        if len(model_path_list):
+                            print(model_path_list)
+                            # selecting the model_path which has the base, if neither has the base then selecting the first one or the one in the 'checkpoints' folder
+                            model_path = next(
+                                (
+                                    path
+                                    for path in model_path_list
+                                    if "checkpoints" in path
+                                ),
+                                model_path_list[0],
+                            )  # preferring the "checkpoints" folder
+                            if base:
+                                matching_text_seq = (
+                                    ["SD1.5"]
+                                    if base in ["SD1.5", "SD1.x"]
+                                    else ["SDXL"]
+                                )
+                                for txt in matching_text_seq:
+                                    for p in model_path_list:
+                                        if txt in p:
+                                            model_path = p
+                                            break
+
+                            model_path = model_path.replace(comfy_directory, "")
+                            if any(
+                                model_path.startswith(folder)
+                                for folder in comfy_model_folders
+                            ):
+                                model_path = model_path.split(os.path.sep, 1)[-1]
+                            app_logger.log(
+                                LoggingType.DEBUG,
+                                f"Updating {input} to {model_path}",
+                            )
+                            workflow[node]["inputs"][key] = model_path
+
+    def _connect_websocket(self, client_id):
+        import websocket
+
+        ws = websocket.WebSocket()
+        host = SERVER_ADDR + ":" + str(self.port)
+        host = host.replace("http://", "").replace("https://", "")
+        ws.connect("ws://{}/ws?clientId={}".format(host, client_id))
+        return ws
+
+    def _collect_output_files(self, node_output, output_folder, delete_original=True):
+        output_list = []
+        for file in node_output["file_list"]:
+            path = find_file_in_directory(self.output_dir, file)
+            # some intermediary temp files are deleted at this point
+            if path:
+                output_list.append(
+                    copy_files(
+                        path[0],
+                        output_folder,
+                        overwrite=False,
+                        delete_original=delete_original,
+                    )
+                )
+        # print("node output: ", node_output)
+        # print("output_list: ", output_list)
+        app_logger.log(LoggingType.DEBUG, f"output file list len: {len(output_list)}")
+
+        return {
+            "file_paths": output_list,
+            "text_output": node_output["text_output"],
+        }
+
     def predict(
         self,
         workflow_input,
@@ -546,312 +1263,468 @@ class ComfyRunner:
         checkpointing_data:             config to enable sampler latent checkpointing
         """
         output_list = {}
-        try:
-            # TODO: add support for image and normal json files
-            client_id = client_id or str(uuid.uuid4())
-            workflow = self.load_workflow(workflow_input)
-            if not workflow:
-                app_logger.log(LoggingType.ERROR, "Invalid workflow file")
-                return
+        # the outputs are collected by predict_stream as the nodes finish
+        for event in self.predict_stream(
+            workflow_input,
+            file_path_list,
+            extra_models_list,
+            extra_node_urls,
+            stop_server_after_completion,
+            clear_comfy_logs,
+            output_folder,
+            output_node_ids,
+            ignore_model_list,
+            client_id,
+            comfy_commit_hash,
+            strict_dep_list,
+            checkpointing_data,
+        ):
+            if event["type"] == "done":
+                output_list = event["output"]
 
-            # cloning comfy repo
-            comfy_repo_url = "https://github.com/comfyanonymous/ComfyUI"
-            comfy_manager_url = "https://github.com/ltdrdata/ComfyUI-Manager"
-            if not os.path.exists(COMFY_BASE_PATH):
-                app_logger.log(LoggingType.DEBUG, "cloning comfy repo")
-                comfy_repo = Repo.clone_from(comfy_repo_url, COMFY_BASE_PATH)
+        return output_list
 
-            if comfy_commit_hash is not None:
-                try:
-                    comfy_repo = Repo(COMFY_BASE_PATH)
-                    current_hash = comfy_repo.rev_parse("HEAD")
-
-                    if str(current_hash) == comfy_commit_hash:
-                        # app_logger.log(
-                        #     LoggingType.DEBUG,
-                        #     "ComfyUI already at specified commit hash",
-                        # )
-                        pass
-                    else:
-                        app_logger.log(
-                            LoggingType.DEBUG,
-                            f"Attempting to move ComfyUI to commit {comfy_commit_hash}",
-                        )
-                        comfy_repo.remotes.origin.fetch()
-                        comfy_repo.git.checkout(comfy_commit_hash)
-                        app_logger.log(
-                            LoggingType.DEBUG,
-                            f"Successfully moved ComfyUI to commit {comfy_commit_hash}",
-                        )
-                except Exception as e:
-                    app_logger.log(
-                        LoggingType.ERROR, f"Unable to checkout ComfyUI: {str(e)}"
-                    )
-                    return None
-
-            if not os.path.exists(COMFY_BASE_PATH + "custom_nodes/ComfyUI-Manager"):
-                custom_manager_hash = None
-                for n in extra_node_urls:
-                    if n["title"] == "ComfyUI-Mananger":
-                        custom_manager_hash = n["commit_hash"]
-                os.chdir(COMFY_BASE_PATH + "custom_nodes/")
-                manager_repo = Repo.clone_from(comfy_manager_url, "ComfyUI-Manager")
-                if custom_manager_hash:
-                    manager_repo.git.checkout(custom_manager_hash)
-                os.chdir("../../")
-
-            # installing requirements
-            app_logger.log(
-                LoggingType.DEBUG,
-                "Checking comfy requirements, please wait...",
-            )
-            missing_pkg_list = self.quick_requirements_check(
-                os.path.join(COMFY_BASE_PATH, "requirements.txt")
-            )
-            if missing_pkg_list and len(missing_pkg_list):
-                print("missing packages: ", missing_pkg_list)
-                subprocess.run(
-                    ["pip", "install", "-r", COMFY_BASE_PATH + "requirements.txt"],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    check=True,
-                )
+    def _prepare_prediction(
+        self,
+        workflow_input,
+        file_path_list,
+        extra_models_list,
+        extra_node_urls,
+        ignore_model_list,
+        client_id,
+        comfy_commit_hash,
+        strict_dep_list,
+        checkpointing_data,
+    ):
+        """
+        loads the workflow and runs the preflight. returns (workflow, RestartDecision),
+        None if the workflow can't be run
+        """
+        # TODO: add support for image and normal json files
+        workflow = self.load_workflow(workflow_input)
+        if not workflow:
+            app_logger.log(LoggingType.ERROR, "Invalid workflow file")
+            return None
+
+        restart_decision = self._run_preflight(
+            workflow,
+            file_path_list,
+            extra_models_list,
+            extra_node_urls,
+            ignore_model_list,
+            client_id,
+            comfy_commit_hash,
+            strict_dep_list,
+            checkpointing_data,
+        )
+        if not restart_decision:
+            return None
 
-            # clearing the previous logs
-            if not self.is_server_running():
-                self.clear_comfy_logs()
+        self._update_model_paths(workflow)
+        self._check_workflow_dict({0: workflow})
 
-            # start the comfy server if not already running
-            self.start_server()
+        # get the result
+        app_logger.log(LoggingType.INFO, "Generating output please wait")
+        if self.gen_status_tracker.is_generation_cancelled(client_id):
+            app_logger.log(LoggingType.INFO, "Generation cancelled by the user")
+            return None
 
-            # enabling checkpointing
-            checkpoint_node_added = False
-            checkpoint_node_path = os.path.join(
-                COMFY_BASE_PATH, "custom_nodes", "comfy-checkpointing"
-            )
-            checkpoint_config_path = os.path.join(checkpoint_node_path, "config.toml")
-            if checkpointing_data:
-                status = True
-                if not os.path.exists(checkpoint_node_path):
-                    custom_node_installer = get_node_installer()
-                    json_data = {
-                        "files": ["https://github.com/piyushK52/comfy-checkpointing"],
-                        "install_type": "git-clone",
-                    }
-                    status = custom_node_installer.install_node(json_data)
-                    checkpoint_node_added = status
+        return workflow, restart_decision
 
-                if not status:
-                    app_logger.log(
-                        LoggingType.ERROR, "Unable to enable checkpoint node"
-                    )
-                else:
-                    if not os.path.exists(checkpoint_config_path):
-                        with open(checkpoint_config_path, "w") as config_file:
-                            toml.dump({}, config_file)
+    def _finish_prediction(self, stop_server_after_completion, clear_comfy_logs):
+        # stopping the server
+        if stop_server_after_completion:
+            self.stop_server()
 
-                    update_toml_config(checkpoint_config_path, checkpointing_data)
-                    app_logger.log(LoggingType.INFO, "Checkpointing enabled")
-            else:
-                if os.path.exists(checkpoint_node_path) and os.path.exists(
-                    checkpoint_config_path
-                ):
-                    update_toml_config(checkpoint_config_path, {})
+        # TODO: implement a proper way to remove the logs
+        if not self.is_server_running() and clear_comfy_logs:
+            self.clear_comfy_logs()
 
-            # download custom nodes
-            res_custom_nodes = self.download_custom_nodes(
-                workflow,
-                extra_node_urls,
-                client_id,
-            )
-            if not res_custom_nodes["status"]:
-                app_logger.log(LoggingType.ERROR, res_custom_nodes["message"])
-                return
+    def _get_stream_output(self, stream_state, restart_decision):
+        output_list = {
+            "file_paths": stream_state["file_paths"],
+            "text_output": stream_state["text_output"],
+            "server_restart": restart_decision.to_dict(),
+        }
+        if stream_state["error"]:
+            output_list["execution_error"] = stream_state["error"]
+        return output_list
 
-            # download models if not already present
-            res_models = self.download_models(
-                workflow,
+    def predict_stream(
+        self,
+        workflow_input,
+        file_path_list=[],
+        extra_models_list=[],
+        extra_node_urls=[],
+        stop_server_after_completion=False,
+        clear_comfy_logs=True,
+        output_folder="./output",
+        output_node_ids=None,
+        ignore_model_list=[],
+        client_id=None,
+        comfy_commit_hash=None,
+        strict_dep_list=None,
+        checkpointing_data=None,
+    ):
+        """
+        same params as predict, yields the execution events of the workflow as they arrive
+        instead of waiting for the whole graph:
+            progress / executing / executed / execution_cached / execution_error /
+            execution_interrupted:      the comfy websocket message ({"type": ..., **data})
+            output:                     {"type", "node", "file_paths", "text_output"}, the files of an
+                                        output node, copied to output_folder as soon as it is executed
+            done:                       {"type", "output"}, always the last one. output is what
+                                        predict returns
+        """
+        output_list = {}
+        ws = None
+        # the input / output dirs are cleared by every prediction of the runner
+        self.prediction_lock.acquire()
+        try:
+            client_id = client_id or str(uuid.uuid4())
+            prepared = self._prepare_prediction(
+                workflow_input,
+                file_path_list,
                 extra_models_list,
+                extra_node_urls,
                 ignore_model_list,
                 client_id,
+                comfy_commit_hash,
+                strict_dep_list,
+                checkpointing_data,
             )
-            if not res_models[
-                "status"
-            ] and not self.gen_status_tracker.is_generation_cancelled(client_id):
-                app_logger.log(LoggingType.ERROR, res_models["message"])
-                if len(res_models["data"]["models_not_found"]):
-                    app_logger.log(
-                        LoggingType.INFO,
-                        "Please provide custom model urls for the models listed below or modify the workflow json to one of the alternative models listed",
+            if not prepared:
+                output_list = None
+            else:
+                workflow, restart_decision = prepared
+                # connected before queueing, so that no message of the prompt is missed
+                ws = self._connect_websocket(client_id)
+                prompt_id = self._get_prompt_id(
+                    self.comfy_api.queue_prompt(workflow, client_id)
+                )
+
+                stream_state = self._get_stream_state()
+                while not stream_state["is_finished"]:
+                    out = ws.recv()
+                    if not isinstance(out, str):
+                        continue  # previews are binary data
+                    yield from self._get_stream_events(
+                        json.loads(out),
+                        prompt_id,
+                        output_node_ids,
+                        output_folder,
+                        stream_state,
                     )
-                    for model in res_models["data"]["models_not_found"]:
-                        print("Model: ", model["model"])
-                        print("Alternatives: ")
-                        if len(model["similar_models"]):
-                            for alternative in model["similar_models"]:
-                                print(" - ", alternative)
-                        else:
-                            print(" - None")
-                        print("---------------------------")
-                return
 
-            # restart the server if custom nodes or models are installed
-            # also check for the strict dependencies (strict_dep_list)
-            if (
-                res_custom_nodes["data"]["nodes_installed"]
-                or res_models["data"]["models_downloaded"]
-                or checkpoint_node_added
-            ):
-                if strict_dep_list and len(strict_dep_list):
-                    for package, version in strict_dep_list.items():
-                        cmd = [
-                            sys.executable,
-                            "-m",
-                            "pip",
-                            "install",
-                            f"{package}=={version}",
-                        ]
-
-                        try:
-                            subprocess.check_call(cmd)
-                            app_logger.log(
-                                LoggingType.DEBUG, f"Moved {package} to {version}"
-                            )
-                        except subprocess.CalledProcessError as e:
-                            print(f"Failed to move {package} {version}. Error: {e}")
+                # the cached nodes are not executed again, their outputs are only in the history
+                if stream_state["cached_node_set"] and not stream_state["error"]:
+                    history = self.comfy_api.get_history(prompt_id)[prompt_id]
+                    yield from self._get_output_events(
+                        history["outputs"], output_node_ids, output_folder, stream_state
+                    )
 
-                app_logger.log(LoggingType.INFO, "Restarting the server")
-                self.stop_server()
-                self.start_server()
+                output_list = self._get_stream_output(stream_state, restart_decision)
+                clear_directory(self.output_dir)
+        except WorkflowValidationError as e:
+            app_logger.log(LoggingType.ERROR, str(e))
+            output_list = {
+                "file_paths": [],
+                "text_output": [],
+                "validation_errors": e.error_list,
+            }
+        except Exception as e:
+            app_logger.log(LoggingType.INFO, "Error generating output " + str(e))
+            print(traceback.format_exc())
+        finally:
+            try:
+                if ws:
+                    ws.close()
 
-            if len(file_path_list):
-                task_list = []
-                clear_directory("./ComfyUI/input")
-                for filepath in file_path_list:
-                    if isinstance(filepath, str):
-                        source, dest_path = filepath, "./ComfyUI/input/"
-                        filename = None
-                    else:
-                        source, dest_path = (
-                            filepath["filepath"],
-                            "./ComfyUI/input/" + filepath["dest_folder"] + "/",
-                        )
-                        filename = filepath.get("filename", None)
+                self._finish_prediction(stop_server_after_completion, clear_comfy_logs)
+            finally:
+                self.prediction_lock.release()
 
-                    task_list.append((source, dest_path, filename))
+        yield {"type": "done", "output": output_list}
 
-                with ThreadPoolExecutor(max_workers=5) as executor:
-                    futures = [
-                        executor.submit(self.process_file, task) for task in task_list
-                    ]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as exc:
-                            print(f"An error occurred: {exc}")
-
-            # checkpoints, lora, default etc..
-            comfy_directory = COMFY_MODELS_BASE_PATH + "models/"
-            comfy_model_folders = [
-                folder
-                for folder in os.listdir(comfy_directory)
-                if os.path.isdir(os.path.join(comfy_directory, folder))
-            ]
-            # update model paths e.g. 'v3_sd15_sparsectrl_rgb.ckpt' --> 'SD1.5/animatediff/v3_sd15_sparsectrl_rgb.ckpt'
-            for node in workflow:
-                if "inputs" in workflow[node]:
-                    for key, input in workflow[node]["inputs"].items():
-                        if (
-                            isinstance(input, str)
-                            and any(input.endswith(ft) for ft in MODEL_FILETYPES)
-                            and not any(input.endswith(m) for m in OPTIONAL_MODELS)
-                        ):
-                            base = None
-                            # if os.path.sep in input:
-                            base, input = os.path.split(input)
-                            model_path_list = find_file_in_directory(
-                                comfy_directory, input
-                            )
-                            if len(model_path_list):
-                                print(model_path_list)
-                                # selecting the model_path which has the base, if neither has the base then selecting the first one or the one in the 'checkpoints' folder
-                                model_path = next(
-                                    (
-                                        path
-                                        for path in model_path_list
-                                        if "checkpoints" in path
-                                    ),
-                                    model_path_list[0],
-                                )  # preferring the "checkpoints" folder
-                                if base:
-                                    matching_text_seq = (
-                                        ["SD1.5"]
-                                        if base in ["SD1.5", "SD1.x"]
-                                        else ["SDXL"]
-                                    )
-                                    for txt in matching_text_seq:
-                                        for p in model_path_list:
-                                            if txt in p:
-                                                model_path = p
-                                                break
-
-                                model_path = model_path.replace(comfy_directory, "")
-                                if any(
-                                    model_path.startswith(folder)
-                                    for folder in comfy_model_folders
-                                ):
-                                    model_path = model_path.split(os.path.sep, 1)[-1]
-                                app_logger.log(
-                                    LoggingType.DEBUG,
-                                    f"Updating {input} to {model_path}",
-                                )
-                                workflow[node]["inputs"][key] = model_path
+    async def predict_stream_async(
+        self,
+        workflow_input,
+        file_path_list=[],
+        extra_models_list=[],
+        extra_node_urls=[],
+        stop_server_after_completion=False,
+        clear_comfy_logs=True,
+        output_folder="./output",
+        output_node_ids=None,
+        ignore_model_list=[],
+        client_id=None,
+        comfy_commit_hash=None,
+        strict_dep_list=None,
+        checkpointing_data=None,
+    ):
+        """
+        async version of predict_stream (async for event in runner.predict_stream_async(...)).
+        the preflight (installs, server start) runs in a thread, the events are read with
+        self.async_comfy_api
+        """
+        import asyncio
+        import aiohttp
 
-            # get the result
-            app_logger.log(LoggingType.INFO, "Generating output please wait")
-            if self.gen_status_tracker.is_generation_cancelled(client_id):
-                app_logger.log(LoggingType.INFO, "Generation cancelled by the user")
-                return None
+        loop = asyncio.get_running_loop()
 
-            ws = websocket.WebSocket()
-            host = SERVER_ADDR + ":" + str(APP_PORT)
-            host = host.replace("http://", "").replace("https://", "")
-            ws.connect("ws://{}/ws?clientId={}".format(host, client_id))
-            node_output = self.get_output(ws, workflow, client_id, output_node_ids)
-            output_list = []
-            for file in node_output["file_list"]:
-                path = find_file_in_directory("./ComfyUI/output", file)
-                # some intermediary temp files are deleted at this point
-                if path:
-                    output_list.append(
-                        copy_files(
-                            path[0],
-                            output_folder,
-                            overwrite=False,
-                            delete_original=True,
-                        )
-                    )
-            # print("node output: ", node_output)
-            # print("output_list: ", output_list)
-            app_logger.log(
-                LoggingType.DEBUG, f"output file list len: {len(output_list)}"
+        async def run_in_thread(fn, *args):
+            # a cancelled stream still waits for the thread, the lock can't be released
+            # (and the dirs cleared by the next prediction) while it's running
+            future = loop.run_in_executor(None, fn, *args)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                await asyncio.wait([future])
+                raise
+
+        output_list = {}
+        ws = None
+        # polled, so that a cancelled stream never leaves the lock taken by a thread
+        while not self.prediction_lock.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        try:
+            client_id = client_id or str(uuid.uuid4())
+            prepared = await run_in_thread(
+                lambda: self._prepare_prediction(
+                    workflow_input,
+                    file_path_list,
+                    extra_models_list,
+                    extra_node_urls,
+                    ignore_model_list,
+                    client_id,
+                    comfy_commit_hash,
+                    strict_dep_list,
+                    checkpointing_data,
+                ),
             )
-            clear_directory("./ComfyUI/output")
+            if not prepared:
+                output_list = None
+            else:
+                workflow, restart_decision = prepared
+                ws = await self.async_comfy_api.connect_websocket(client_id)
+                prompt_id = self._get_prompt_id(
+                    await self.async_comfy_api.queue_prompt(workflow, client_id)
+                )
 
+                stream_state = self._get_stream_state()
+                async for msg in ws:
+                    if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        continue  # previews are binary data
+
+                    message = json.loads(msg.data)
+                    get_events = lambda: self._get_stream_events(
+                        message, prompt_id, output_node_ids, output_folder, stream_state
+                    )
+                    # the files of an executed node are copied in a thread
+                    if message.get("type") == "executed":
+                        event_list = await run_in_thread(get_events)
+                    else:
+                        event_list = get_events()
+                    for event in event_list:
+                        yield event
+                    if stream_state["is_finished"]:
+                        break
+
+                if not stream_state["is_finished"]:
+                    raise ConnectionError("Websocket closed before the prompt finished")
+
+                if stream_state["cached_node_set"] and not stream_state["error"]:
+                    history = await self.async_comfy_api.get_history(prompt_id)
+                    for event in await run_in_thread(
+                        self._get_output_events,
+                        history[prompt_id]["outputs"],
+                        output_node_ids,
+                        output_folder,
+                        stream_state,
+                    ):
+                        yield event
+
+                output_list = self._get_stream_output(stream_state, restart_decision)
+                await run_in_thread(clear_directory, self.output_dir)
+        except WorkflowValidationError as e:
+            app_logger.log(LoggingType.ERROR, str(e))
             output_list = {
-                "file_paths": output_list,
-                "text_output": node_output["text_output"],
+                "file_paths": [],
+                "text_output": [],
+                "validation_errors": e.error_list,
             }
         except Exception as e:
             app_logger.log(LoggingType.INFO, "Error generating output " + str(e))
             print(traceback.format_exc())
+        finally:
+            try:
+                if ws is not None:
+                    await ws.close()
 
-        # stopping the server
-        if stop_server_after_completion:
-            self.stop_server()
+                await run_in_thread(
+                    self._finish_prediction,
+                    stop_server_after_completion,
+                    clear_comfy_logs,
+                )
+            finally:
+                self.prediction_lock.release()
 
-        # TODO: implement a proper way to remove the logs
-        if not self.is_server_running() and clear_comfy_logs:
-            self.clear_comfy_logs()
+        yield {"type": "done", "output": output_list}
+
+    def predict_many(
+        self,
+        workflow_input_list,
+        file_path_list=[],
+        extra_models_list=[],
+        extra_node_urls=[],
+        stop_server_after_completion=False,
+        clear_comfy_logs=True,
+        output_folder="./output",
+        output_node_ids=None,
+        ignore_model_list=[],
+        client_id=None,
+        comfy_commit_hash=None,
+        strict_dep_list=None,
+        checkpointing_data=None,
+        stream=False,
+    ):
+        """
+        runs several workflows with a single preflight: the nodes and models needed by all of
+        them are resolved once, the inputs are staged once and every prompt is queued back to
+        back so that the comfy queue never goes idle.
+        workflow_input_list:            list of workflow_input (API json or filepath)
+        stream:                         if True, returns a generator yielding (index, output) as the
+                                        prompts complete. otherwise the list of outputs in submission
+                                        order (None for the workflows that couldn't be run)
+        the other params are the same as predict and apply to every workflow
+        """
+        output_generator = self._predict_many(
+            workflow_input_list,
+            file_path_list,
+            extra_models_list,
+            extra_node_urls,
+            stop_server_after_completion,
+            clear_comfy_logs,
+            output_folder,
+            output_node_ids,
+            ignore_model_list,
+            client_id,
+            comfy_commit_hash,
+            strict_dep_list,
+            checkpointing_data,
+        )
+        if stream:
+            return output_generator
+
+        output_list = [None] * len(workflow_input_list)
+        for idx, output in output_generator:
+            output_list[idx] = output
 
         return output_list
+
+    def _predict_many(
+        self,
+        workflow_input_list,
+        file_path_list,
+        extra_models_list,
+        extra_node_urls,
+        stop_server_after_completion,
+        clear_comfy_logs,
+        output_folder,
+        output_node_ids,
+        ignore_model_list,
+        client_id,
+        comfy_commit_hash,
+        strict_dep_list,
+        checkpointing_data,
+    ):
+        # the input / output dirs are cleared by every prediction of the runner
+        self.prediction_lock.acquire()
+        try:
+            client_id = client_id or str(uuid.uuid4())
+            workflow_dict = {}
+            for idx, workflow_input in enumerate(workflow_input_list):
+                try:
+                    workflow = self.load_workflow(workflow_input)
+                except Exception as e:
+                    workflow = None
+                if workflow:
+                    workflow_dict[idx] = workflow
+                else:
+                    app_logger.log(LoggingType.ERROR, f"Invalid workflow file ({idx})")
+
+            if not len(workflow_dict):
+                return
+
+            # an invalid workflow is reported on its own, the rest of them are still run
+            validation_error_dict = {}
+
+            # a single workflow containing the nodes of all of them, for the node / model setup
+            combined_workflow = {
+                f"{idx}:{node_id}": node
+                for idx, workflow in workflow_dict.items()
+                for node_id, node in workflow.items()
+            }
+            restart_decision = self._run_preflight(
+                combined_workflow,
+                file_path_list,
+                extra_models_list,
+                extra_node_urls,
+                ignore_model_list,
+                client_id,
+                comfy_commit_hash,
+                strict_dep_list,
+                checkpointing_data,
+                validation_workflow_dict=workflow_dict,
+                validation_error_dict=validation_error_dict,
+            )
+            if restart_decision:
+                for workflow in workflow_dict.values():
+                    self._update_model_paths(workflow)
+                validation_error_dict.update(self._get_workflow_errors(workflow_dict))
+
+            for idx, error_list in validation_error_dict.items():
+                workflow_dict.pop(idx, None)
+                app_logger.log(
+                    LoggingType.ERROR,
+                    f"Invalid workflow ({idx}): {len(error_list)} errors",
+                )
+                yield idx, {
+                    "file_paths": [],
+                    "text_output": [],
+                    "validation_errors": error_list,
+                }
+            if not restart_decision or not len(workflow_dict):
+                return
+
+            app_logger.log(
+                LoggingType.INFO, f"Generating {len(workflow_dict)} outputs please wait"
+            )
+            if self.gen_status_tracker.is_generation_cancelled(client_id):
+                app_logger.log(LoggingType.INFO, "Generation cancelled by the user")
+                return
+
+            ws = self._connect_websocket(client_id)
+            try:
+                for idx, node_output in self.get_output_list(
+                    ws, workflow_dict, client_id, output_node_ids
+                ):
+                    output = None
+                    if node_output:
+                        output = self._collect_output_files(node_output, output_folder)
+                        output["server_restart"] = restart_decision.to_dict()
+                    yield idx, output
+            finally:
+                ws.close()
+
+            clear_directory(self.output_dir)
+        except Exception as e:
+            app_logger.log(LoggingType.INFO, "Error generating output " + str(e))
+            print(traceback.format_exc())
+        finally:
+            try:
+                self._finish_prediction(stop_server_after_completion, clear_comfy_logs)
+            finally:
+                self.prediction_lock.release()
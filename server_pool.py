@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from .constants import APP_PORT, SERVER_POOL_INSTANCE_PATH
+from .inf import ComfyRunner
+from .utils.logger import LoggingType, app_logger
+
+
+class ComfyServerPool:
+    """
+    runs several comfy servers (one per port, each with its own input / output
+    directory) and sends every predict to the least loaded one
+    """
+
+    def __init__(self, size=2, base_port=APP_PORT, instance_dir=SERVER_POOL_INSTANCE_PATH):
+        self.runner_list = []
+        # every server runs from the same comfy checkout, so the node / pip setup of the
+        # jobs runs one at a time (model downloads and the prompts still run in parallel)
+        self.setup_lock = threading.RLock()
+        for idx in range(size):
+            port = base_port + idx
+            self.runner_list.append(
+                ComfyRunner(
+                    port=port,
+                    input_dir=os.path.join(instance_dir, str(port), "input"),
+                    output_dir=os.path.join(instance_dir, str(port), "output"),
+                    setup_lock=self.setup_lock,
+                )
+            )
+
+        self.lock = threading.Lock()
+        self.active_job_count = {runner.port: 0 for runner in self.runner_list}
+        # servers that have to be restarted (once idle) to pick up nodes installed through
+        # another one, the mark is kept until the restart succeeds
+        self.stale_port_list = set()
+
+    def start(self):
+        with ThreadPoolExecutor(max_workers=len(self.runner_list)) as executor:
+            list(executor.map(lambda runner: runner.start_server(), self.runner_list))
+
+    def stop(self):
+        with ThreadPoolExecutor(max_workers=len(self.runner_list)) as executor:
+            list(executor.map(lambda runner: runner.stop_server(), self.runner_list))
+
+    def health_check(self):
+        status = {}
+        for runner in self.runner_list:
+            try:
+                status[runner.port] = runner.comfy_api.health_check()
+            except Exception as e:
+                status[runner.port] = False
+
+        return status
+
+    def get_load(self, runner):
+        """
+        jobs running / queued on the server, None if it is unreachable. jobs routed to
+        it that are still in their preflight are not in the server queue yet, so the
+        local count is used when it's higher
+        """
+        try:
+            queue = runner.comfy_api.get_queue()
+        except Exception as e:
+            return None
+
+        queue_depth = len(queue.get("queue_running", [])) + len(
+            queue.get("queue_pending", [])
+        )
+        return max(queue_depth, self.active_job_count[runner.port])
+
+    def get_least_loaded_runner(self):
+        runner_load_list = [(self.get_load(runner), runner) for runner in self.runner_list]
+        runner_load_list = [(load, r) for load, r in runner_load_list if load is not None]
+        if not len(runner_load_list):
+            raise Exception("No comfy server available in the pool")
+
+        return min(runner_load_list, key=lambda x: x[0])[1]
+
+    def _acquire_runner(self):
+        with self.lock:
+            runner = self.get_least_loaded_runner()
+            self.active_job_count[runner.port] += 1
+            restart = (
+                runner.port in self.stale_port_list
+                and self.active_job_count[runner.port] == 1
+            )
+
+        if restart:
+            try:
+                self._restart_stale_runner(runner)
+            except Exception:
+                with self.lock:
+                    self.active_job_count[runner.port] -= 1
+                raise
+
+        return runner
+
+    def _restart_stale_runner(self, runner):
+        # the prediction lock keeps the jobs routed to the runner meanwhile from queueing
+        # on the old server, the setup lock keeps other jobs from installing nodes mid restart
+        with runner.prediction_lock, runner.setup_lock:
+            with self.lock:
+                if runner.port not in self.stale_port_list:
+                    return
+                self.stale_port_list.discard(runner.port)
+
+            app_logger.log(LoggingType.INFO, f"Restarting stale server {runner.port}")
+            try:
+                runner.stop_server()
+                runner.start_server()
+            except Exception:
+                with self.lock:
+                    self.stale_port_list.add(runner.port)
+                raise
+            finally:
+                runner.invalidate_node_cache()
+
+    def _restart_stale_runner_in_background(self, runner):
+        def _restart():
+            try:
+                self._restart_stale_runner(runner)
+            except Exception as e:
+                app_logger.log(
+                    LoggingType.ERROR, f"Unable to restart server {runner.port}: {e}"
+                )
+
+        threading.Thread(target=_restart, daemon=True).start()
+
+    def _release_runner(self, runner, restart_count):
+        with self.lock:
+            self.active_job_count[runner.port] -= 1
+            if runner.server_restart_count != restart_count:
+                # nodes / packages changed, the other servers have to reload as well
+                self.stale_port_list.update(
+                    r.port for r in self.runner_list if r.port != runner.port
+                )
+            # a busy server is never idle on acquire, so it's restarted once its last job is done
+            restart = (
+                runner.port in self.stale_port_list
+                and self.active_job_count[runner.port] == 0
+            )
+
+        if restart:
+            self._restart_stale_runner_in_background(runner)
+
+    def predict(self, workflow_input, **kwargs):
+        """same params as ComfyRunner.predict, the servers are kept running"""
+        kwargs["stop_server_after_completion"] = False
+        runner = self._acquire_runner()
+        restart_count = runner.server_restart_count
+        try:
+            app_logger.log(LoggingType.DEBUG, f"Routing job to server {runner.port}")
+            return runner.predict(workflow_input, **kwargs)
+        finally:
+            self._release_runner(runner, restart_count)
+
+    def stop_current_generation(self, client_id=None, retry_window=3):
+        # the generation can be on any of the servers
+        with ThreadPoolExecutor(max_workers=len(self.runner_list)) as executor:
+            list(
+                executor.map(
+                    lambda runner: runner.stop_current_generation(client_id, retry_window),
+                    self.runner_list,
+                )
+            )
+        return True
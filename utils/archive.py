@@ -0,0 +1,115 @@
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import zipfile
+
+from .logger import LoggingType, app_logger
+
+# zip archives are spooled to disk once they are larger than this
+ZIP_SPOOL_MAX_MEMORY = 64 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ArchiveExtractionError(Exception):
+    pass
+
+
+def get_archive_type(url):
+    if url.endswith(".zip"):
+        return "zip"
+    if url.endswith(".tar"):
+        return "tar"
+    return None
+
+
+def get_safe_path(dest, member_name):
+    """returns the path the member should be extracted to, raises if it escapes dest"""
+    dest = os.path.abspath(dest)
+    name = member_name.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        raise ArchiveExtractionError(f"Absolute path in archive: {member_name}")
+
+    target_path = os.path.abspath(os.path.join(dest, name))
+    if os.path.commonpath([dest, target_path]) != dest:
+        raise ArchiveExtractionError(f"Path outside the destination: {member_name}")
+
+    return target_path
+
+
+def _write_member(fileobj, target_path):
+    # written next to the target and renamed when complete, so an interrupted
+    # extraction never leaves a truncated file under the final name
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = target_path + ".part"
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(fileobj, f, COPY_CHUNK_SIZE)
+    os.replace(tmp_path, target_path)
+
+
+def extract_tar_stream(stream, dest):
+    """extracts a tar archive while it is being read (the stream is never seeked)"""
+    extracted_files = []
+    with tarfile.open(fileobj=stream, mode="r|*") as tar_ref:
+        for member in tar_ref:
+            target_path = get_safe_path(dest, member.name)
+            if member.isdir():
+                os.makedirs(target_path, exist_ok=True)
+            elif member.isfile():
+                _write_member(tar_ref.extractfile(member), target_path)
+                extracted_files.append(target_path)
+            else:
+                # links and special files are not needed for models / nodes
+                app_logger.log(LoggingType.DEBUG, f"Skipping {member.name}")
+
+    return extracted_files
+
+
+def _is_special_zip_member(member):
+    # zips made on unix keep the file mode in the high bits of external_attr
+    mode = member.external_attr >> 16
+    return bool(mode) and not stat.S_ISREG(mode) and not stat.S_ISDIR(mode)
+
+
+def extract_zip_stream(stream, dest, spool_dir=None):
+    """
+    zip keeps its index at the end of the file, so the stream is spooled
+    (in memory up to ZIP_SPOOL_MAX_MEMORY, then on disk) before extracting
+    """
+    extracted_files = []
+    with tempfile.SpooledTemporaryFile(
+        max_size=ZIP_SPOOL_MAX_MEMORY, dir=spool_dir or dest
+    ) as spool:
+        shutil.copyfileobj(stream, spool, COPY_CHUNK_SIZE)
+        spool.seek(0)
+        with zipfile.ZipFile(spool, "r") as zip_ref:
+            for member in zip_ref.infolist():
+                target_path = get_safe_path(dest, member.filename)
+                if member.is_dir():
+                    os.makedirs(target_path, exist_ok=True)
+                elif _is_special_zip_member(member):
+                    # a symlink is stored as a file with the link target as its content,
+                    # links are skipped like in the tar archives
+                    app_logger.log(LoggingType.DEBUG, f"Skipping {member.filename}")
+                else:
+                    with zip_ref.open(member) as fileobj:
+                        _write_member(fileobj, target_path)
+                    extracted_files.append(target_path)
+
+    return extracted_files
+
+
+def extract_archive_stream(stream, dest, archive_type):
+    """
+    stream:         file like object (only read() is used)
+    archive_type:   'zip' or 'tar'
+    returns the list of extracted files
+    """
+    os.makedirs(dest, exist_ok=True)
+    if archive_type == "tar":
+        return extract_tar_stream(stream, dest)
+    if archive_type == "zip":
+        return extract_zip_stream(stream, dest)
+
+    raise ArchiveExtractionError(f"Unsupported archive type: {archive_type}")
@@ -1,10 +1,36 @@
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ...constants import COMFY_API_RETRIES, COMFY_API_TIMEOUT
 
 
 class BaseAPI:
-    def __init__(self, base_url):
+    def __init__(self, base_url, timeout=COMFY_API_TIMEOUT, retries=COMFY_API_RETRIES):
         self.base_url = base_url
+        self.timeout = timeout
+        self.session = self._create_session(retries)
+
+    def _create_session(self, retries):
+        # a single keep-alive session is reused for every request. connection errors
+        # are always retried, POST requests are not retried once they reach the server
+        # as they are not idempotent (e.g. queueing a prompt)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=("GET", "HEAD", "PUT", "DELETE", "OPTIONS"),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def _get_headers(self, content_type="application/json"):
         headers = {}
@@ -14,40 +40,65 @@ class BaseAPI:
 
         return headers
 
-    def http_get(self, url, params=None):
-        res = requests.get(
-            self.base_url + url, params=params, headers=self._get_headers()
+    def http_get(self, url, params=None, timeout=None):
+        res = self.session.get(
+            self.base_url + url,
+            params=params,
+            headers=self._get_headers(),
+            timeout=timeout or self.timeout,
         )
         return res.json()
 
-    def http_post(self, url, data={}, file_content=None, json_output=True):
+    def http_post(self, url, data={}, file_content=None, json_output=True, timeout=None):
         if file_content:
             files = {"file": file_content}
-            res = requests.post(
+            res = self.session.post(
                 self.base_url + url,
                 data=data,
                 files=files,
                 headers=self._get_headers(None),
+                timeout=timeout or self.timeout,
             )
         else:
-            res = requests.post(
-                self.base_url + url, json=data, headers=self._get_headers()
+            res = self.session.post(
+                self.base_url + url,
+                json=data,
+                headers=self._get_headers(),
+                timeout=timeout or self.timeout,
             )
 
         return res.json() if json_output else res
 
-    def http_put(self, url, data=None):
-        res = requests.put(self.base_url + url, json=data, headers=self._get_headers())
+    def http_put(self, url, data=None, timeout=None):
+        res = self.session.put(
+            self.base_url + url,
+            json=data,
+            headers=self._get_headers(),
+            timeout=timeout or self.timeout,
+        )
         return res.json()
 
-    def http_delete(self, url, params=None):
-        res = requests.delete(
-            self.base_url + url, params=params, headers=self._get_headers()
+    def http_delete(self, url, params=None, timeout=None):
+        res = self.session.delete(
+            self.base_url + url,
+            params=params,
+            headers=self._get_headers(),
+            timeout=timeout or self.timeout,
         )
         return res.json()
 
+    def close(self):
+        self.session.close()
+
 
 class ComfyAPI(BaseAPI):
+    # node installs through the manager only respond once the install is complete
+    INSTALL_TIMEOUT = (5, 1800)
+    HEALTH_CHECK_TIMEOUT = (2, 5)
+    # the status endpoints (/queue, /history, /object_info) answer in a few secs, a
+    # short read timeout keeps a wedged server from blocking every retry for minutes
+    STATUS_TIMEOUT = (5, 20)
+
     def __init__(self, server_addr, port):
         super().__init__(base_url=f"{server_addr}:{port}")
         self.server_addr = server_addr
@@ -80,23 +131,43 @@ class ComfyAPI(BaseAPI):
 
     # TODO: add health check api
     def health_check(self):
-        res = requests.get(self.SERVER_URL + self.HISTORY_URL + "/123")
+        res = self.session.get(
+            self.SERVER_URL + self.HISTORY_URL + "/123",
+            timeout=self.HEALTH_CHECK_TIMEOUT,
+        )
         return True if res.status_code == 200 else False
 
+    def is_ready(self, timeout=1):
+        # used while polling a starting server, so it is a single attempt outside the
+        # retrying session. comfy only serves http once all the custom nodes are loaded
+        try:
+            res = requests.get(self.SERVER_URL + self.QUEUE_URL, timeout=timeout)
+            return res.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
     def get_history(self, prompt_id):
-        return self.http_get(self.HISTORY_URL + "/" + str(prompt_id))
+        return self.http_get(
+            self.HISTORY_URL + "/" + str(prompt_id), timeout=self.STATUS_TIMEOUT
+        )
 
     def install_custom_node(self, node):
-        return self.http_post(self.CUSTOM_NODE_URL + "install", data=node)
+        return self.http_post(
+            self.CUSTOM_NODE_URL + "install", data=node, timeout=self.INSTALL_TIMEOUT
+        )
 
     def install_custom_model(self, model):
-        return self.http_post(self.CUSTOM_MODEL_URL + "install", data=model)
+        return self.http_post(
+            self.CUSTOM_MODEL_URL + "install", data=model, timeout=self.INSTALL_TIMEOUT
+        )
 
     def get_node_mapping_list(self):
         return self.http_get(self.NODE_MAPPING_LIST_URL + "?mode=local")
 
     def get_registered_nodes(self):
-        return self.http_get(self.REGISTERED_NODE_LIST_URL)
+        return self.http_get(
+            self.REGISTERED_NODE_LIST_URL, timeout=self.STATUS_TIMEOUT
+        )
 
     def queue_prompt(self, prompt, client_id):
         p = {"prompt": prompt, "client_id": client_id}
@@ -107,4 +178,4 @@ class ComfyAPI(BaseAPI):
         return self.http_post(self.INTERRUPT_URL, data={}, json_output=False)
 
     def get_queue(self):
-        return self.http_get(self.QUEUE_URL)
+        return self.http_get(self.QUEUE_URL, timeout=self.STATUS_TIMEOUT)
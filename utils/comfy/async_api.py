@@ -0,0 +1,228 @@
+import asyncio
+import json
+
+import aiohttp
+
+from ...constants import COMFY_API_RETRIES, COMFY_API_TIMEOUT
+from .api import ComfyAPI
+
+
+class AsyncBaseAPI:
+    """
+    asyncio counterpart of BaseAPI. a single aiohttp session (keep-alive pool) is
+    created lazily inside the running event loop and shared by every request.
+    max_connections also counts open websockets, 0 means no limit
+    """
+
+    RETRY_STATUS_LIST = (502, 503, 504)
+
+    def __init__(
+        self,
+        base_url,
+        timeout=COMFY_API_TIMEOUT,
+        retries=COMFY_API_RETRIES,
+        max_connections=0,
+    ):
+        self.base_url = base_url
+        self.timeout = self._get_client_timeout(timeout)
+        self.retries = retries
+        self.max_connections = max_connections
+        self._session = None
+        self._session_loop = None
+
+    @staticmethod
+    def _get_client_timeout(timeout):
+        connect_timeout, read_timeout = (
+            timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        )
+        return aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+    async def get_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._release_stale_session()
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=self.timeout,
+            )
+            self._session_loop = loop
+
+        return self._session
+
+    def _release_stale_session(self):
+        """
+        the session belongs to an earlier event loop (e.g. another asyncio.run), it
+        can only be closed from that loop. if it is gone the session is detached so
+        that it isn't reported as unclosed
+        """
+        session, session_loop = self._session, self._session_loop
+        self._session = None
+        if session is None or session.closed:
+            return
+
+        if session_loop is not None and session_loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+        else:
+            session.detach()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def _get_headers(self, content_type="application/json"):
+        headers = {}
+        if content_type:
+            headers["Content-Type"] = content_type
+
+        return headers
+
+    async def _request(self, method, url, timeout=None, **kwargs):
+        # same policy as BaseAPI: connection errors are always retried, bad gateway
+        # style responses only for the idempotent methods
+        session = await self.get_session()
+        timeout = self._get_client_timeout(timeout) if timeout else None
+        for attempt in range(self.retries + 1):
+            try:
+                res = await session.request(
+                    method, self.base_url + url, timeout=timeout, **kwargs
+                )
+            except aiohttp.ClientConnectorError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if (
+                    method == "POST"
+                    or res.status not in self.RETRY_STATUS_LIST
+                    or attempt == self.retries
+                ):
+                    await res.read()
+                    return res
+                res.release()
+
+            await asyncio.sleep(0.2 * 2**attempt)
+
+    async def http_get(self, url, params=None, timeout=None):
+        res = await self._request(
+            "GET", url, params=params, headers=self._get_headers(), timeout=timeout
+        )
+        return await res.json(content_type=None)
+
+    async def http_post(self, url, data={}, file_content=None, json_output=True, timeout=None):
+        if file_content:
+            form = aiohttp.FormData(data)
+            form.add_field("file", file_content)
+            res = await self._request("POST", url, data=form, timeout=timeout)
+        else:
+            res = await self._request(
+                "POST", url, json=data, headers=self._get_headers(), timeout=timeout
+            )
+
+        return await res.json(content_type=None) if json_output else res
+
+    async def http_put(self, url, data=None, timeout=None):
+        res = await self._request(
+            "PUT", url, json=data, headers=self._get_headers(), timeout=timeout
+        )
+        return await res.json(content_type=None)
+
+    async def http_delete(self, url, params=None, timeout=None):
+        res = await self._request(
+            "DELETE", url, params=params, headers=self._get_headers(), timeout=timeout
+        )
+        return await res.json(content_type=None)
+
+
+class AsyncComfyAPI(AsyncBaseAPI):
+    """mirrors ComfyAPI, every method is a coroutine"""
+
+    INSTALL_TIMEOUT = ComfyAPI.INSTALL_TIMEOUT
+    HEALTH_CHECK_TIMEOUT = ComfyAPI.HEALTH_CHECK_TIMEOUT
+    STATUS_TIMEOUT = ComfyAPI.STATUS_TIMEOUT
+
+    def __init__(self, server_addr, port, **kwargs):
+        super().__init__(base_url=f"{server_addr}:{port}", **kwargs)
+        self.server_addr = server_addr
+        self.port = port
+
+        self._set_urls()
+
+    _set_urls = ComfyAPI._set_urls
+
+    async def get_all_custom_node_list(self):
+        return await self.http_get(self.CUSTOM_NODE_LIST_URL + "?mode=local")
+
+    async def get_all_model_list(self):
+        res = await self.http_get(self.MODEL_LIST_URL + "?mode=local")
+        return res["models"] if "models" in res else []
+
+    async def health_check(self):
+        res = await self._request(
+            "GET", self.HISTORY_URL + "/123", timeout=self.HEALTH_CHECK_TIMEOUT
+        )
+        return True if res.status == 200 else False
+
+    async def get_history(self, prompt_id):
+        return await self.http_get(
+            self.HISTORY_URL + "/" + str(prompt_id), timeout=self.STATUS_TIMEOUT
+        )
+
+    async def install_custom_node(self, node):
+        return await self.http_post(
+            self.CUSTOM_NODE_URL + "install", data=node, timeout=self.INSTALL_TIMEOUT
+        )
+
+    async def install_custom_model(self, model):
+        return await self.http_post(
+            self.CUSTOM_MODEL_URL + "install", data=model, timeout=self.INSTALL_TIMEOUT
+        )
+
+    async def get_node_mapping_list(self):
+        return await self.http_get(self.NODE_MAPPING_LIST_URL + "?mode=local")
+
+    async def get_registered_nodes(self):
+        return await self.http_get(
+            self.REGISTERED_NODE_LIST_URL, timeout=self.STATUS_TIMEOUT
+        )
+
+    async def queue_prompt(self, prompt, client_id):
+        p = {"prompt": prompt, "client_id": client_id}
+        return await self.http_post(self.QUEUE_PROMPT_URL, data=p)
+
+    # NOTE: stops the current generation in progress
+    async def interrupt_prompt(self):
+        return await self.http_post(self.INTERRUPT_URL, data={}, json_output=False)
+
+    async def get_queue(self):
+        return await self.http_get(self.QUEUE_URL, timeout=self.STATUS_TIMEOUT)
+
+    async def connect_websocket(self, client_id):
+        session = await self.get_session()
+        host = self.SERVER_URL.replace("http://", "").replace("https://", "")
+        # max_msg_size=0 as the binary preview messages can be large
+        return await session.ws_connect(
+            "ws://{}/ws?clientId={}".format(host, client_id),
+            max_msg_size=0,
+            heartbeat=30,
+        )
+
+    async def wait_for_prompt(self, ws, prompt_id):
+        """waits on the websocket till the prompt has finished executing"""
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                message = json.loads(msg.data)
+                if message["type"] == "executing":
+                    data = message["data"]
+                    if data["node"] is None and data["prompt_id"] == prompt_id:
+                        return True
+            elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                break
+            # binary messages are previews
+
+        raise ConnectionError("Websocket closed before the prompt finished")
@@ -0,0 +1,167 @@
+import re
+
+# characters that have a meaning in a regex (outside of a class) when not escaped
+REGEX_META_CHARS = set(".^$*+?{}[]()|\\")
+
+
+def _split_alternation(pattern):
+    """splits the pattern on the top level |, None if it can't be split safely"""
+    if pattern.startswith("(?") and not pattern.startswith(("(?:", "(?P", "(?=", "(?!", "(?<")):
+        return None  # global inline flags apply to every alternative
+
+    part_list = []
+    depth = 0
+    in_class = False
+    start = 0
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == "\\":
+            idx += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            # a ] right after [ or [^ is part of the class
+            if pattern[idx + 1 : idx + 2] == "^":
+                idx += 1
+            if pattern[idx + 1 : idx + 2] == "]":
+                idx += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            part_list.append(pattern[start:idx])
+            start = idx + 1
+        idx += 1
+
+    part_list.append(pattern[start:])
+    return part_list
+
+
+def _unescape_literal(pattern):
+    """returns the literal text the pattern matches, None if it isn't a plain literal"""
+    literal = ""
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == "\\":
+            if idx + 1 >= len(pattern) or pattern[idx + 1].isalnum():
+                return None  # \d, \w, \b ... are classes / assertions
+            literal += pattern[idx + 1]
+            idx += 2
+            continue
+        if char in REGEX_META_CHARS:
+            return None
+        literal += char
+        idx += 1
+
+    return literal
+
+
+class NodeTypeMatcher:
+    """
+    finds the node packs whose nodename_pattern matches a node type. the top level
+    alternatives of the patterns are split into exact names (hash map), literal
+    suffixes / prefixes (bucketed by their length) and the rest, which are indexed by
+    the first trigram of the literal they start with, so only a handful of regexes
+    are run per node type. every matching pattern is returned, same as testing them
+    one by one with re.search
+    """
+
+    TRIGRAM_LEN = 3
+
+    def __init__(self, pattern_list):
+        """pattern_list: list of (nodename_pattern, url)"""
+        self.exact_dict = {}  # name -> url list
+        self.suffix_dict = {}  # suffix len -> {suffix: url list}
+        self.prefix_dict = {}  # prefix len -> {prefix: [(regex, url)]}
+        self.trigram_dict = {}  # trigram -> [(regex, url)]
+        self.regex_list = []  # (regex, url) of the patterns without a literal to index
+
+        for pattern, url in pattern_list:
+            part_list = _split_alternation(pattern) or [pattern]
+            for part in part_list:
+                self._add(part, url)
+
+    def _add(self, pattern, url):
+        try:
+            regex = re.compile(pattern)
+        except re.error:
+            return
+
+        anchored_start = pattern.startswith("^")
+        anchored_end = pattern.endswith("$") and not pattern.endswith("\\$")
+        body = pattern[1 if anchored_start else 0 : -1 if anchored_end else None]
+        literal = _unescape_literal(body) if body else None
+        literal_prefix = _unescape_literal(self._get_literal_prefix(body))
+
+        if literal is not None and anchored_start and anchored_end:
+            self.exact_dict.setdefault(literal, []).append(url)
+        elif literal is not None and anchored_end:
+            self.suffix_dict.setdefault(len(literal), {}).setdefault(literal, []).append(
+                url
+            )
+        elif anchored_start and literal_prefix:
+            # the rest of the pattern is only tested for the types with this prefix
+            self.prefix_dict.setdefault(len(literal_prefix), {}).setdefault(
+                literal_prefix, []
+            ).append((regex, url))
+        elif len(literal_prefix) >= self.TRIGRAM_LEN:
+            # the type has to contain the literal the pattern starts with
+            self.trigram_dict.setdefault(literal_prefix[: self.TRIGRAM_LEN], []).append(
+                (regex, url)
+            )
+        else:
+            self.regex_list.append((regex, url))
+
+    @staticmethod
+    def _get_literal_prefix(body):
+        # longest leading part of the pattern that is a literal (a char before a
+        # quantifier is not part of it)
+        idx = 0
+        prefix_end = 0
+        while idx < len(body):
+            char = body[idx]
+            if char == "\\":
+                if idx + 1 >= len(body) or body[idx + 1].isalnum():
+                    break
+                step = 2
+            elif char in REGEX_META_CHARS:
+                break
+            else:
+                step = 1
+            if idx + step < len(body) and body[idx + step] in "*+?{":
+                break
+            idx += step
+            prefix_end = idx
+
+        return body[:prefix_end]
+
+    def match(self, node_type):
+        """returns the set of urls whose pattern matches node_type"""
+        url_set = set(self.exact_dict.get(node_type, []))
+
+        for suffix_len, suffix_dict in self.suffix_dict.items():
+            if suffix_len <= len(node_type):
+                url_set.update(suffix_dict.get(node_type[len(node_type) - suffix_len :], []))
+
+        candidate_list = []
+        for prefix_len, prefix_dict in self.prefix_dict.items():
+            candidate_list.extend(prefix_dict.get(node_type[:prefix_len], []))
+
+        trigram_set = {
+            node_type[idx : idx + self.TRIGRAM_LEN]
+            for idx in range(len(node_type) - self.TRIGRAM_LEN + 1)
+        }
+        for trigram in trigram_set:
+            candidate_list.extend(self.trigram_dict.get(trigram, []))
+
+        for regex, url in candidate_list + self.regex_list:
+            if url not in url_set and regex.search(node_type):
+                url_set.add(url)
+
+        return url_set
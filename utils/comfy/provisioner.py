@@ -0,0 +1,113 @@
+import os
+import threading
+
+from ...constants import COMFY_BASE_PATH
+from ..git_mirror import git_mirror_cache, run_git
+from ..logger import LoggingType, app_logger
+
+COMFY_REPO_URL = "https://github.com/comfyanonymous/ComfyUI"
+COMFY_MANAGER_REPO_URL = "https://github.com/ltdrdata/ComfyUI-Manager"
+
+
+class ComfyProvisioner:
+    """
+    gets ComfyUI and ComfyUI-Manager to the requested commits. the HEAD of a checkout is
+    cached against the stat of its HEAD / ref files, so when nothing moved (every predict
+    after the first) the repo isn't opened at all. a commit is only fetched if it isn't in
+    the checkout already, and new checkouts / fetches go through the shared git mirror
+    """
+
+    def __init__(self, comfy_path=COMFY_BASE_PATH, mirror_cache=git_mirror_cache):
+        self.comfy_path = os.path.abspath(comfy_path)
+        self.manager_path = os.path.join(self.comfy_path, "custom_nodes", "ComfyUI-Manager")
+        self.mirror_cache = mirror_cache
+        self.lock = threading.Lock()
+        self._head_cache = {}  # repo path -> (HEAD / ref files stat, commit)
+
+    # ----------- HEAD -----------------
+    def _get_head_fingerprint(self, repo_path):
+        git_dir = os.path.join(repo_path, ".git")
+        head_path = os.path.join(git_dir, "HEAD")
+        if not os.path.isfile(head_path):
+            return None
+
+        path_list = [head_path, os.path.join(git_dir, "packed-refs")]
+        with open(head_path, "r") as f:
+            head = f.read().strip()
+        if head.startswith("ref: "):
+            path_list.append(os.path.join(git_dir, head[len("ref: ") :]))
+
+        fingerprint = []
+        for path in path_list:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def get_head(self, repo_path):
+        """commit the checkout is at (only runs git if its HEAD / refs changed)"""
+        fingerprint = self._get_head_fingerprint(repo_path)
+        cached = self._head_cache.get(repo_path)
+        if fingerprint and cached and cached[0] == fingerprint:
+            return cached[1]
+
+        head = run_git("rev-parse", "HEAD", cwd=repo_path)
+        if fingerprint:
+            self._head_cache[repo_path] = (fingerprint, head)
+        return head
+
+    def is_at_commit(self, repo_path, commit):
+        head = self.get_head(repo_path)
+        # the commit can be given as a short hash
+        return head == commit or (len(commit) >= 7 and head.startswith(commit))
+
+    # ----------- checkout -----------------
+    def _clone(self, url, repo_path, commit=None):
+        app_logger.log(LoggingType.DEBUG, f"cloning {url}")
+        if self.mirror_cache.enabled:
+            self.mirror_cache.checkout(url, repo_path, commit)
+            return
+
+        run_git("clone", "--quiet", url, repo_path)
+        if commit:
+            run_git("checkout", "--quiet", commit, cwd=repo_path)
+
+    def _move_to_commit(self, url, repo_path, commit):
+        app_logger.log(LoggingType.DEBUG, f"Attempting to move {repo_path} to commit {commit}")
+        try:
+            resolved = run_git("rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}", cwd=repo_path)
+        except Exception:
+            resolved = None
+
+        if not resolved:
+            # only fetched if the checkout doesn't have it already
+            if self.mirror_cache.enabled:
+                mirror_path, resolved = self.mirror_cache.update(url, commit)
+                run_git("fetch", "--quiet", mirror_path, resolved, cwd=repo_path)
+            else:
+                run_git("fetch", "--quiet", "origin", cwd=repo_path)
+                resolved = commit
+
+        run_git("checkout", "--quiet", resolved, cwd=repo_path)
+        app_logger.log(LoggingType.DEBUG, f"Successfully moved {repo_path} to commit {commit}")
+
+    def ensure(self, url, repo_path, commit=None):
+        """clones the repo if it isn't there and moves it to the commit (if given)"""
+        with self.lock:
+            if not os.path.exists(repo_path):
+                self._clone(url, repo_path, commit)
+            elif commit and not self.is_at_commit(repo_path, commit):
+                self._move_to_commit(url, repo_path, commit)
+
+    def ensure_comfy(self, comfy_commit_hash=None):
+        self.ensure(COMFY_REPO_URL, self.comfy_path, comfy_commit_hash)
+
+    def ensure_manager(self, manager_commit_hash=None):
+        # the manager is only pinned when it is installed
+        if not os.path.exists(self.manager_path):
+            self.ensure(COMFY_MANAGER_REPO_URL, self.manager_path, manager_commit_hash)
+
+
+comfy_provisioner = ComfyProvisioner()
@@ -0,0 +1,49 @@
+class RestartDecision:
+    """
+    records what the preflight changed and decides if the comfy server has to be
+    restarted. only changes to the python state (node modules, packages) need a
+    restart, comfy picks up new model files when the model lists are refreshed
+    """
+
+    CUSTOM_NODES = "custom_nodes"
+    PIP_PACKAGES = "pip_packages"
+    CHECKPOINT_NODE = "checkpoint_node"
+    CHECKPOINT_CONFIG = "checkpoint_config"
+    MODELS = "models"
+
+    RESTART_CHANGE_LIST = [CUSTOM_NODES, PIP_PACKAGES, CHECKPOINT_NODE]
+
+    def __init__(self):
+        self.change_dict = {}  # change type -> list of details
+        self.restarted = False
+
+    def record(self, change_type, detail=None):
+        detail_list = self.change_dict.setdefault(change_type, [])
+        if detail is not None:
+            detail_list.append(detail)
+
+    def has_change(self, change_type):
+        return change_type in self.change_dict
+
+    @property
+    def restart_required(self):
+        return any(self.has_change(c) for c in self.RESTART_CHANGE_LIST)
+
+    @property
+    def refresh_model_list(self):
+        return self.has_change(self.MODELS) and not self.restart_required
+
+    def get_reason(self):
+        if self.restart_required:
+            change_list = [c for c in self.RESTART_CHANGE_LIST if self.has_change(c)]
+            return "changed: " + ", ".join(change_list)
+        if self.has_change(self.MODELS):
+            return "only models changed, refreshed the model lists"
+        return "nothing changed"
+
+    def to_dict(self):
+        return {
+            "restarted": self.restarted,
+            "reason": self.get_reason(),
+            "changes": {c: list(d) for c, d in self.change_dict.items()},
+        }
@@ -0,0 +1,233 @@
+import os
+
+from ...constants import MODEL_FILETYPES
+
+
+class WorkflowValidationError(Exception):
+    def __init__(self, error_dict):
+        # workflow idx -> list of errors
+        self.error_dict = error_dict
+        self.error_list = [e for error_list in error_dict.values() for e in error_list]
+        super().__init__(
+            f"Invalid workflow ({len(self.error_list)} errors): "
+            + "; ".join(e["message"] for e in self.error_list[:5])
+        )
+
+
+# the values a node accepts can't be known for certain (enum lists change with the files
+# on disk, nodes with VALIDATE_INPUTS skip the checks of comfy), these are only reported
+# as warnings and comfy gets the final say
+WARNING_TYPE_LIST = ("value_not_in_list", "value_out_of_range", "invalid_value")
+
+
+def _error(error_type, message, node_id=None, class_type=None, input_name=None):
+    return {
+        "type": error_type,
+        "severity": "warning" if error_type in WARNING_TYPE_LIST else "error",
+        "message": message,
+        "node_id": node_id,
+        "class_type": class_type,
+        "input": input_name,
+    }
+
+
+def _is_link(value):
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def _is_model_file(value):
+    return isinstance(value, str) and os.path.splitext(value)[1] in MODEL_FILETYPES
+
+
+def _get_input_spec(node_info):
+    """name -> (type or list of values, options) of the required and optional inputs"""
+    input_spec = {}
+    for group in ("required", "optional"):
+        for name, spec in node_info.get("input", {}).get(group, {}).items():
+            input_type = spec[0] if len(spec) else None
+            options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+            # newer comfy versions send enums as ("COMBO", {"options": [...]})
+            if input_type == "COMBO":
+                input_type = options.get("options", [])
+            input_spec[name] = (input_type, options)
+
+    return input_spec
+
+
+def _types_match(expected_type, output_type):
+    if not isinstance(expected_type, str) or not isinstance(output_type, str):
+        return True
+    if "*" in (expected_type, output_type):
+        return True
+
+    return bool(set(expected_type.split(",")) & set(output_type.split(",")))
+
+
+def _is_upload_input(options):
+    # LoadImage / LoadVideo style inputs ({"image_upload": True}) list the files of the
+    # input dir, which are staged (and cleared) on every predict after /object_info was cached
+    return any(
+        value and (key == "upload" or key.endswith("_upload"))
+        for key, value in options.items()
+    )
+
+
+def _validate_value(value, input_type, options, check_model_values):
+    """returns an (error type, message) or None"""
+    if isinstance(input_type, list):
+        if value in input_type or _is_upload_input(options):
+            return None
+        # model files are downloaded / their paths updated later in the preflight
+        if not check_model_values and _is_model_file(value):
+            return None
+        return "value_not_in_list", f"'{value}' is not one of the allowed values"
+
+    if input_type in ("INT", "FLOAT"):
+        if isinstance(value, bool):
+            return "invalid_value", f"'{value}' is not a number"
+        try:
+            number = int(value) if input_type == "INT" else float(value)
+        except (TypeError, ValueError):
+            return "invalid_value", f"'{value}' is not a valid {input_type}"
+
+        if "min" in options and number < options["min"]:
+            return "value_out_of_range", f"{value} is smaller than {options['min']}"
+        if "max" in options and number > options["max"]:
+            return "value_out_of_range", f"{value} is bigger than {options['max']}"
+
+    # strings and booleans are converted by comfy (str(), bool()) so anything goes
+    return None
+
+
+def validate_workflow(
+    workflow, object_info, check_unknown_nodes=True, check_model_values=True
+):
+    """
+    checks the API json of a workflow against the /object_info of the server, returns
+    a list of errors (empty if it is valid) with the type, severity, message, node_id,
+    class_type and input of each. only the errors with the "error" severity make the
+    workflow invalid
+
+    check_unknown_nodes:    report nodes that are not registered (disable while the
+                            missing nodes are still to be installed)
+    check_model_values:     report model files that are not in the list of the input
+                            (disable while the models are still to be downloaded)
+    """
+    error_list = []
+    if not isinstance(workflow, dict) or not len(workflow):
+        return [_error("invalid_workflow", "Workflow is empty or not an API json")]
+
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or "class_type" not in node:
+            error_list.append(
+                _error("invalid_node", f"Node {node_id} has no class_type", node_id)
+            )
+            continue
+
+        class_type = node["class_type"]
+        inputs = node.get("inputs", {})
+        if not isinstance(inputs, dict):
+            error_list.append(
+                _error(
+                    "invalid_node",
+                    f"Inputs of node {node_id} are not a dict",
+                    node_id,
+                    class_type,
+                )
+            )
+            continue
+
+        # links are checked even for the nodes that are not registered yet
+        for name, value in inputs.items():
+            if _is_link(value) and value[0] not in workflow:
+                error_list.append(
+                    _error(
+                        "dangling_link",
+                        f"{class_type}.{name} is linked to node {value[0]} which doesn't exist",
+                        node_id,
+                        class_type,
+                        name,
+                    )
+                )
+
+        if class_type.startswith("workflow/"):
+            continue
+        if class_type not in object_info:
+            if check_unknown_nodes:
+                error_list.append(
+                    _error(
+                        "unknown_node",
+                        f"Node type {class_type} is not registered",
+                        node_id,
+                        class_type,
+                    )
+                )
+            continue
+
+        node_info = object_info[class_type]
+        required_input_dict = node_info.get("input", {}).get("required", {})
+        for name, (input_type, options) in _get_input_spec(node_info).items():
+            if name not in inputs:
+                if name in required_input_dict:
+                    error_list.append(
+                        _error(
+                            "missing_input",
+                            f"{class_type}.{name} is required",
+                            node_id,
+                            class_type,
+                            name,
+                        )
+                    )
+                continue
+
+            value = inputs[name]
+            if _is_link(value):
+                linked_node = workflow.get(value[0])
+                if not isinstance(linked_node, dict):
+                    continue  # dangling, reported above
+                linked_info = object_info.get(linked_node.get("class_type"))
+                if linked_info is None:
+                    continue
+                output_list = linked_info.get("output", [])
+                if not 0 <= value[1] < len(output_list):
+                    error_list.append(
+                        _error(
+                            "invalid_link",
+                            f"{class_type}.{name} is linked to output {value[1]} of node {value[0]} which has {len(output_list)} outputs",
+                            node_id,
+                            class_type,
+                            name,
+                        )
+                    )
+                elif not isinstance(input_type, list) and not _types_match(
+                    input_type, output_list[value[1]]
+                ):
+                    error_list.append(
+                        _error(
+                            "type_mismatch",
+                            f"{class_type}.{name} expects {input_type} but node {value[0]} outputs {output_list[value[1]]}",
+                            node_id,
+                            class_type,
+                            name,
+                        )
+                    )
+                continue
+
+            res = _validate_value(value, input_type, options, check_model_values)
+            if res:
+                error_list.append(
+                    _error(
+                        res[0],
+                        f"{class_type}.{name}: {res[1]}",
+                        node_id,
+                        class_type,
+                        name,
+                    )
+                )
+
+    return error_list
@@ -1,14 +1,12 @@
 from urllib.parse import urlparse
 import requests
-from fuzzywuzzy import process
 import os
 import shutil
-import psutil
-import toml
 
 from ..constants import COMFY_BASE_PATH
 
 from .logger import app_logger
+from .model_index import get_model_index
 
 from .logger import LoggingType
 
@@ -23,6 +21,8 @@ def get_file_size(url):
 
 
 def fuzzy_text_match(text_list, query, limit=2):
+    from fuzzywuzzy import process
+
     matches = process.extract(query, text_list, limit=limit)
     return [match for match, score in matches if score > 90]
 
@@ -79,7 +79,57 @@ def copy_files(
         return unique_name
 
 
-def find_process_by_port(port):
+# ----------- port lookups -----------------
+TCP_LISTEN_STATE = "0A"
+
+
+def get_listening_socket_inodes(port):
+    """
+    inodes of the sockets listening on port (from /proc/net/tcp and tcp6), None
+    if /proc is not available (non linux)
+    """
+    inode_set = set()
+    table_found = False
+    for table_path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table_path, "r") as f:
+                line_list = f.readlines()[1:]
+        except OSError:
+            continue
+
+        table_found = True
+        for line in line_list:
+            # sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode
+            field_list = line.split()
+            if len(field_list) < 10 or field_list[3] != TCP_LISTEN_STATE:
+                continue
+            if int(field_list[1].rsplit(":", 1)[1], 16) == port:
+                inode_set.add(field_list[9])
+
+    return inode_set if table_found else None
+
+
+def _pid_owns_socket(pid, inode_set):
+    fd_dir = f"/proc/{pid}/fd"
+    try:
+        fd_list = os.listdir(fd_dir)
+    except OSError:
+        return False
+
+    for fd in fd_list:
+        try:
+            link = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        if link.startswith("socket:[") and link[8:-1] in inode_set:
+            return True
+
+    return False
+
+
+def _find_process_by_port_scan(port):
+    import psutil
+
     pid = None
     for proc in psutil.process_iter(attrs=["pid", "name", "connections"]):
         try:
@@ -98,13 +148,37 @@ def find_process_by_port(port):
     return pid
 
 
-def find_file_in_directory(directory, target_file):
-    file_list = []
-    for root, dirs, files in os.walk(directory, followlinks=True):
-        if target_file in files:
-            file_list.append(os.path.join(root, target_file))
+def find_process_by_port(port, candidate_pid_list=None):
+    """
+    pid of the process listening on port. on linux the listening socket is looked up
+    in /proc/net/tcp and only the fds of candidate_pid_list (e.g. the server this
+    process started) are checked, the other processes are only walked if none of
+    them owns it. falls back to the psutil scan elsewhere
+    """
+    inode_set = get_listening_socket_inodes(port)
+    if inode_set is None:
+        return _find_process_by_port_scan(port)
+    if not inode_set:
+        return None
+
+    for pid in candidate_pid_list or []:
+        if pid and _pid_owns_socket(pid, inode_set):
+            return pid
+
+    for pid in os.listdir("/proc"):
+        if pid.isdigit() and _pid_owns_socket(pid, inode_set):
+            app_logger.log(LoggingType.DEBUG, f"Process {pid} (Port {port})")
+            return int(pid)
 
-    return file_list
+    # the socket belongs to a process we can't inspect (e.g. another user)
+    return _find_process_by_port_scan(port)
+
+
+def find_file_in_directory(directory, target_file):
+    return [
+        os.path.join(directory, path)
+        for path in get_model_index(directory).find(target_file)
+    ]
 
 
 def clear_directory(directory):
@@ -130,18 +204,7 @@ def find_git_root(path):
 # 1. a different file of same name can be present in some other directory
 # 2. file may be corrupted
 def search_file(filename, directory, parent_folder=None):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file == filename and (
-                not parent_folder
-                or (parent_folder and os.path.basename(root) == parent_folder)
-            ):
-                return True
-        for subdir in dirs:
-            subdir_path = os.path.join(root, subdir)
-            if search_file(filename, subdir_path, parent_folder):
-                return True  # File found in subdirectory
-    return False
+    return get_model_index(directory).contains(filename, parent_folder)
 
 
 def convert_to_relative_path(path, base_comfy=COMFY_BASE_PATH):
@@ -186,6 +249,8 @@ def update_toml_config(toml_config_path, toml_dict):
     if not toml_config_path or not os.path.exists(toml_config_path):
         raise Exception("Invalid toml file path: ", toml_config_path)
 
+    import toml
+
     with open(toml_config_path, "wb") as f:
         toml_content = toml.dumps(toml_dict)
         f.write(toml_content.encode())
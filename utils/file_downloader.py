@@ -1,30 +1,32 @@
+from contextlib import contextmanager
 from enum import Enum
 import os
+import threading
 import time
 from urllib.parse import urlparse
 
 import requests
-import tarfile
-import zipfile
 import json
-from tqdm import tqdm
 from ..constants import (
     APP_PORT,
-    COMFY_MODELS_BASE_PATH,
     COMFY_MODEL_PATH_LIST,
+    MAX_CONNECTIONS_PER_HOST,
+    MAX_DOWNLOADS_PER_HOST,
+    MODEL_STORE_ENABLED,
     SERVER_ADDR,
 )
+from .archive import extract_archive_stream, get_archive_type
 from .comfy.api import ComfyAPI
 
 from .common import (
-    find_git_root,
-    convert_to_relative_path,
-    fuzzy_text_match,
-    get_default_save_path,
     get_file_size,
     search_file,
 )
 from .logger import LoggingType, app_logger
+from .model_catalog import get_model_catalog
+from .model_index import invalidate_model_index
+from .model_store import ModelStore
+from .segmented_download import segmented_downloader
 
 
 class FileStatus(Enum):
@@ -34,9 +36,102 @@ class FileStatus(Enum):
     FAILED = "failed"  # not proper
 
 
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadLimiter:
+    """
+    bounds the number of concurrent downloads and open connections (a segmented
+    download uses several) per host and makes sure that a single destination file
+    is only written by one download at a time
+    """
+
+    def __init__(
+        self,
+        max_per_host=MAX_DOWNLOADS_PER_HOST,
+        max_connections_per_host=MAX_CONNECTIONS_PER_HOST,
+    ):
+        self.max_per_host = max(1, max_per_host)
+        self.max_connections_per_host = max(1, max_connections_per_host)
+        self.lock = threading.Lock()
+        self.connection_condition = threading.Condition(self.lock)
+        self.host_semaphores = {}
+        self.host_connections = {}  # host -> connections in use
+        self.path_locks = {}
+
+    def _get_host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(
+                    self.max_per_host
+                )
+            return self.host_semaphores[host]
+
+    def _get_path_lock(self, path):
+        path = os.path.abspath(path)
+        with self.lock:
+            if path not in self.path_locks:
+                self.path_locks[path] = threading.Lock()
+            return self.path_locks[path]
+
+    @contextmanager
+    def path(self, path):
+        with self._get_path_lock(path):
+            yield
+
+    @contextmanager
+    def host(self, url):
+        with self._get_host_semaphore(url):
+            yield
+
+    @contextmanager
+    def connections(self, url, count=1):
+        """
+        waits till a connection to the host is free and takes up to count of them,
+        yields the number taken
+        """
+        host = urlparse(url).netloc.lower()
+        in_use = lambda: self.host_connections.get(host, 0)
+        with self.connection_condition:
+            self.connection_condition.wait_for(
+                lambda: in_use() < self.max_connections_per_host
+            )
+            count = min(max(1, count), self.max_connections_per_host - in_use())
+            self.host_connections[host] = in_use() + count
+
+        try:
+            yield count
+        finally:
+            with self.connection_condition:
+                self.host_connections[host] -= count
+                self.connection_condition.notify_all()
+
+
+download_limiter = DownloadLimiter()
+
+
+class ProgressReader:
+    # file like wrapper that reports progress and checks for cancellation while a stream is consumed
+    def __init__(self, fileobj, progress_bar, cancel_check=None):
+        self.fileobj = fileobj
+        self.progress_bar = progress_bar
+        self.cancel_check = cancel_check
+
+    def read(self, size=-1):
+        if self.cancel_check and self.cancel_check():
+            raise DownloadCancelled()
+
+        data = self.fileobj.read(size)
+        self.progress_bar.update(len(data))
+        return data
+
+
 class FileDownloader:
-    def __init__(self):
-        pass
+    def __init__(self, model_store=None):
+        # downloaded (non archive) files are kept in the model store when provided
+        self.model_store = model_store
 
     def is_file_downloaded(self, filename, url, dest):
         zip_file = False
@@ -69,47 +164,69 @@ class FileDownloader:
                 f.write(chunk)
         return filepath
 
-    def download_file(self, filename, url, dest):
+    def download_file(self, filename, url, dest, cancel_check=None):
+        """
+        cancel_check: optional callable, the download is abandoned (and not retried)
+                      as soon as it returns True
+        """
         os.makedirs(dest, exist_ok=True)
+        with download_limiter.path(f"{dest}/{filename}"):
+            return self._download_file(filename, url, dest, cancel_check)
 
+    def _download_file(self, filename, url, dest, cancel_check=None):
         # checking if the file is already downloaded
         if self.is_file_downloaded(filename, url, dest):
             app_logger.log(LoggingType.DEBUG, f"{filename} already present")
             return True, FileStatus.ALREADY_PRESENT.value
-        else:
-            # deleting partial downloads
-            if os.path.exists(f"{dest}/{filename}"):
-                os.remove(f"{dest}/{filename}")
 
+        archive_type = get_archive_type(url)
+        if self.model_store and not archive_type:
+            sha256 = self.model_store.lookup_url(url)
+            if sha256:
+                try:
+                    self.model_store.link(sha256, f"{dest}/{filename}")
+                    invalidate_model_index(dest)
+                    app_logger.log(
+                        LoggingType.INFO, f"Linked {filename} from the model store"
+                    )
+                    return True, FileStatus.NEW_DOWNLOAD.value
+                except OSError as e:
+                    # downloaded again below
+                    app_logger.log(
+                        LoggingType.ERROR, f"Unable to link {filename} from the store: {e}"
+                    )
+
+        # the data is written to a .part file which is only renamed once complete,
+        # so an interrupted download is resumed (by a retry or a new process)
+        part_path = f"{dest}/{filename}.part"
         max_retries = 3
         retry_delay = 3
         for _ in range(max_retries):
             try:
-                # download progress bar
-                app_logger.log(LoggingType.INFO, f"Downloading {filename}")
-                response = requests.get(url, stream=True)
-                total_size = int(response.headers.get("content-length", 0))
-                progress_bar = tqdm(total=total_size, unit="B", unit_scale=True)
-                with open(f"{dest}/{filename}", "wb") as handle:
-                    for data in tqdm(response.iter_content(chunk_size=1024)):
-                        handle.write(data)
-                        progress_bar.update(len(data))
-
-                # extract files if the downloaded file is a .zip or .tar
-                if url.endswith(".zip") or url.endswith(".tar"):
-                    new_filename = filename + (
-                        ".zip" if url.endswith(".zip") else ".tar"
-                    )
-                    os.rename(f"{dest}/{filename}", f"{dest}/{new_filename}")
-                    if url.endswith(".zip"):
-                        with zipfile.ZipFile(f"{dest}/{new_filename}", "r") as zip_ref:
-                            zip_ref.extractall(dest)
+                with download_limiter.host(url):
+                    app_logger.log(LoggingType.INFO, f"Downloading {filename}")
+                    if archive_type:
+                        # .zip / .tar files are extracted while they are downloaded
+                        with download_limiter.connections(url):
+                            self._download_and_extract(
+                                url, dest, archive_type, cancel_check
+                            )
                     else:
-                        with tarfile.open(f"{dest}/{new_filename}", "r") as tar_ref:
-                            tar_ref.extractall(dest)
-                    os.remove(f"{dest}/{new_filename}")
+                        self._download_to_part_file(url, part_path, cancel_check)
 
+                if not archive_type:
+                    if self.model_store:
+                        self.model_store.add_file(part_path, f"{dest}/{filename}", url)
+                    else:
+                        os.replace(part_path, f"{dest}/{filename}")
+                    self._remove_part_metadata(part_path)
+
+                invalidate_model_index(dest)
                 return True, FileStatus.NEW_DOWNLOAD.value
+            except DownloadCancelled:
+                # the .part file is kept so that the next attempt can resume it
+                app_logger.log(LoggingType.INFO, f"Download of {filename} cancelled")
+                return False, FileStatus.FAILED.value
             except Exception as e:
                 app_logger.log(
                     LoggingType.ERROR,
@@ -123,74 +240,194 @@ class FileDownloader:
         )
         return False, FileStatus.FAILED.value
 
+    def _download_and_extract(self, url, dest, archive_type, cancel_check=None):
+        response = requests.get(url, stream=True, timeout=60)
+        response.raise_for_status()
+        response.raw.decode_content = True
 
-class ModelDownloader(FileDownloader):
-    def __init__(self, model_weights_file_path_list, download_similar_model=False):
-        super().__init__()
-        self.model_download_dict = self.comfy_model_dict = {}
-        self.download_similar_model = download_similar_model
-        self.comfy_api = ComfyAPI(SERVER_ADDR, APP_PORT)
+        total_size = int(response.headers.get("content-length", 0)) or None
+        from tqdm import tqdm
 
-        # loading local data
-        for model_weights_file_path in model_weights_file_path_list:
-            current_dir = find_git_root(os.path.dirname(__file__))  # finding root
-            file_path = os.path.abspath(
-                os.path.join(current_dir, model_weights_file_path)
+        progress_bar = tqdm(total=total_size, unit="B", unit_scale=True)
+        try:
+            extract_archive_stream(
+                ProgressReader(response.raw, progress_bar, cancel_check),
+                dest,
+                archive_type,
             )
-            # print("------- opening file path: ", file_path)
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                for model_name in data:
-                    # weight files with lower index have preference
-                    if model_name not in self.model_download_dict:
-                        self.model_download_dict[model_name] = {
-                            "url": data[model_name]["url"],
-                            "dest": convert_to_relative_path(
-                                data[model_name]["dest"],
-                                base_comfy=COMFY_MODELS_BASE_PATH,
-                            ),
-                        }
+        finally:
+            progress_bar.close()
+            response.close()
 
-    def _get_similar_models(self, model_name):
-        app_logger.log(LoggingType.DEBUG, "matching model: ", model_name)
-        # matching with local data
-        model_list = self.model_download_dict.keys()
-        similar_models = fuzzy_text_match(model_list, model_name)
+    # ----------- resumable downloads -----------------
+    def _load_part_metadata(self, part_path, url):
+        """
+        returns the validators saved for the .part file, partial data that
+        can't be validated (different url, missing metadata) is discarded
+        """
+        meta = None
+        if os.path.exists(part_path + ".json"):
+            try:
+                with open(part_path + ".json", "r") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+
+        if not meta or meta.get("url") != url or not os.path.exists(part_path):
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return None
+
+        return meta
+
+    def _save_part_metadata(self, part_path, meta):
+        with open(part_path + ".json", "w") as f:
+            json.dump(meta, f)
+
+    def _remove_part_metadata(self, part_path):
+        if os.path.exists(part_path + ".json"):
+            os.remove(part_path + ".json")
+
+    def _download_to_part_file(self, url, part_path, cancel_check=None):
+        meta = self._load_part_metadata(part_path, url)
+
+        # large files are fetched over several connections when the server supports ranges
+        if not meta or meta.get("segments"):
+            remote_file = segmented_downloader.probe(url)
+            if meta and remote_file is not None and (
+                not remote_file.get("segmented")
+                or remote_file["total_size"] != meta.get("total_size")
+                or remote_file["etag"] != meta.get("etag")
+            ):
+                # the file on the server changed (or can't be fetched in ranges anymore)
+                os.remove(part_path)
+                meta = None
+
+            if meta and remote_file is None:
+                # the HEAD request failed (timeout, 5xx, a CDN that rejects HEAD), the
+                # segments fetched so far are kept and resumed from the original url,
+                # If-Range still guards against a changed file
+                app_logger.log(LoggingType.DEBUG, "Resuming the segments without a probe")
+                meta["resolved_url"] = url
+            elif remote_file and remote_file.get("segmented"):
+                meta = meta or {"url": url, **remote_file}
+                meta["resolved_url"] = remote_file["resolved_url"]
+            else:
+                meta = None
+
+            if meta:
+                meta.pop("segmented", None)
+                save_meta = lambda m: self._save_part_metadata(part_path, m)
+                pending_count = sum(
+                    1 for s in meta.get("segments") or [] if s[0] + s[2] <= s[1]
+                )
+                with download_limiter.connections(
+                    url, pending_count or segmented_downloader.connections
+                ) as connection_count:
+                    if not segmented_downloader.download(
+                        part_path,
+                        meta,
+                        save_meta,
+                        cancel_check,
+                        max_connections=connection_count,
+                    ):
+                        raise DownloadCancelled()
+                return
+
+        with download_limiter.connections(url):
+            self._download_single_stream(url, part_path, meta, cancel_check)
+
+    def _download_single_stream(self, url, part_path, meta, cancel_check=None):
+        offset = os.path.getsize(part_path) if meta else 0
+
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            # If-Range makes the server send the whole file if it changed in the meantime
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator and not validator.startswith("W/"):
+                headers["If-Range"] = validator
+
+        # same read timeout as the segments, so a stalled host doesn't hold its connection slot
+        response = requests.get(url, stream=True, headers=headers, timeout=60)
+        if response.status_code == 416 and meta:
+            # nothing left to fetch, unless the file on the server has changed
+            if meta.get("total_size") == offset:
+                return
+            os.remove(part_path)
+            raise Exception("Partial download does not match the remote file")
+        response.raise_for_status()
 
-        # matching with comfy data
-        model_list = self.comfy_model_dict.keys()
-        similar_models += fuzzy_text_match(model_list, model_name)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 206:
+            content_range = response.headers.get("Content-Range", "")
+            range_start = content_range.split(" ")[-1].split("-")[0]
+            if range_start != str(offset) or (
+                etag and meta.get("etag") and etag != meta["etag"]
+            ):
+                os.remove(part_path)
+                raise Exception("Invalid partial response, restarting the download")
+            total_size = content_range.split("/")[-1]
+            total_size = int(total_size) if total_size.isdigit() else None
+            mode = "ab"
+        else:
+            offset = 0
+            total_size = int(response.headers.get("content-length", 0)) or None
+            mode = "wb"
+
+        self._save_part_metadata(
+            part_path,
+            {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "total_size": total_size,
+            },
+        )
 
-        return similar_models
+        # download progress bar
+        from tqdm import tqdm
 
-    def load_comfy_models(self):
-        self.comfy_model_dict = {}
-        # these models have incorrect details in the Comfy Manager data json
-        # and should be ignored here
-        ignore_manager_models = ["sd_xl_base_1.0.safetensors", "sd_xl_refiner_1.0_0.9vae.safetensors"]
-        for model_list_path in COMFY_MODEL_PATH_LIST:
-            current_dir = find_git_root(os.path.dirname(__file__))  # finding root
-            model_list_path = os.path.abspath(
-                os.path.join(current_dir, model_list_path)
+        progress_bar = tqdm(
+            total=total_size, initial=offset, unit="B", unit_scale=True
+        )
+        with open(part_path, mode) as handle:
+            for data in response.iter_content(chunk_size=1024 * 64):
+                if cancel_check and cancel_check():
+                    raise DownloadCancelled()
+                handle.write(data)
+                progress_bar.update(len(data))
+        progress_bar.close()
+
+        if total_size and os.path.getsize(part_path) != total_size:
+            raise Exception(
+                f"Incomplete download ({os.path.getsize(part_path)}/{total_size} bytes)"
             )
-            if not os.path.exists(model_list_path):
-                app_logger.log(
-                    LoggingType.DEBUG, f"model list path not found - {model_list_path}"
-                )
-                continue
 
-            with open(model_list_path, "rb") as file:
-                model_list = json.load(file)["models"]
 
-            # loading comfy data
-            for model in model_list:
-                if model_list_path.endswith("ComfyUI-Manager/model-list.json") and model["filename"] in ignore_manager_models:     # comfy manager liser
-                    continue
-                
-                if model["filename"] not in self.comfy_model_dict:
-                    self.comfy_model_dict[model["filename"]] = [model]
-                else:
-                    self.comfy_model_dict[model["filename"]].append(model)
+class ModelDownloader(FileDownloader):
+    def __init__(
+        self,
+        model_weights_file_path_list,
+        download_similar_model=False,
+        comfy_model_path_list=COMFY_MODEL_PATH_LIST,
+    ):
+        super().__init__(model_store=ModelStore() if MODEL_STORE_ENABLED else None)
+        self.download_similar_model = download_similar_model
+        self.comfy_api = ComfyAPI(SERVER_ADDR, APP_PORT)
+        # the catalog is only loaded on the first lookup
+        self.model_catalog = get_model_catalog(
+            model_weights_file_path_list, comfy_model_path_list
+        )
+
+    def _get_similar_models(self, model_name):
+        app_logger.log(LoggingType.DEBUG, "matching model: ", model_name)
+        return self.model_catalog.get_similar_models(model_name)
+
+    def load_comfy_models(self):
+        # picks up the changes in the model lists (e.g. comfy manager updated)
+        self.model_catalog.refresh()
 
     def get_model_details(self, model_name):
         """
@@ -199,30 +436,14 @@ class ModelDownloader(FileDownloader):
         url:      it's download url
         dest:     where this file needs to be downloaded
         """
-        if model_name in self.comfy_model_dict:
-            for model in self.comfy_model_dict[model_name]:
-                if model["save_path"] and model["save_path"].endswith("default"):
-                    model["save_path"] = get_default_save_path(model["type"])
-
-                return (
-                    model["filename"],
-                    model["url"],
-                    os.path.join(COMFY_MODELS_BASE_PATH, "models", model["save_path"]),
-                )
+        model = self.model_catalog.get(model_name)
+        if model is None:
+            return None, None, None
 
-        elif model_name in self.model_download_dict:
-            return (
-                model_name,
-                self.model_download_dict[model_name]["url"],
-                convert_to_relative_path(
-                    self.model_download_dict[model_name]["dest"],
-                    base_comfy=COMFY_MODELS_BASE_PATH,
-                ),
-            )
-
-        return None, None, None
+        url, dest, _ = model
+        return model_name, url, dest
 
-    def download_model(self, model_name):
+    def download_model(self, model_name, cancel_check=None):
         # handling nomenclature like "SD1.5/pytorch_model.bin"
         base, model_name = (
             (model_name.split("/")[0], model_name.split("/")[-1])
@@ -233,7 +454,12 @@ class ModelDownloader(FileDownloader):
         filename, url, dest = self.get_model_details(model_name)
 
         if filename and url and dest:
-            _, file_status = self.download_file(filename=filename, url=url, dest=dest)
+            status, file_status = self.download_file(
+                filename=filename, url=url, dest=dest, cancel_check=cancel_check
+            )
+            if not status:
+                # failed or cancelled, the model is reported as not found
+                return (False, [], file_status)
 
         else:
             app_logger.log(
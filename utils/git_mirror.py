@@ -0,0 +1,157 @@
+import hashlib
+import os
+import re
+import shutil
+
+import portalocker
+
+from ..constants import GIT_MIRROR_PATH
+from .logger import LoggingType, app_logger
+
+
+def run_git(*args, cwd=None):
+    import git
+
+    return git.Git(cwd).execute(["git", *args])
+
+
+class GitMirrorCache:
+    """
+    bare mirrors of the git repos (custom nodes, comfy) shared by every checkout on the
+    machine. the first checkout of a repo fetches it into its mirror, after that only the
+    missing commits are fetched (a pinned commit that is already in the mirror needs no
+    network at all, a new one is fetched on its own and shallow). checkouts are local
+    clones of the mirror, so a failed one can be retried without downloading again
+    """
+
+    def __init__(self, root=GIT_MIRROR_PATH, lock_timeout=600):
+        self.root = os.path.abspath(root) if root else None
+        self.lock_timeout = lock_timeout
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def get_mirror_path(self, url):
+        url = url.rstrip("/")
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(url))
+        if name.endswith(".git"):
+            name = name[: -len(".git")]
+        return os.path.join(self.root, f"{name}-{hashlib.sha1(url.encode()).hexdigest()[:12]}.git")
+
+    # ----------- mirror -----------------
+    def _is_shallow(self, mirror_path):
+        return os.path.exists(os.path.join(mirror_path, "shallow"))
+
+    def _resolve_commit(self, mirror_path, commit):
+        """full hash of the commit if the mirror has it"""
+        try:
+            return run_git("rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}", cwd=mirror_path)
+        except Exception:
+            return None
+
+    def _fetch_all(self, mirror_path):
+        # the history of the branches is needed (not just the pinned commits)
+        args = ["fetch", "--prune", "origin", "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+        if self._is_shallow(mirror_path):
+            args.insert(1, "--unshallow")
+        run_git(*args, cwd=mirror_path)
+        # HEAD follows the default branch of the remote
+        for line in run_git("ls-remote", "--symref", "origin", "HEAD", cwd=mirror_path).splitlines():
+            if line.startswith("ref: ") and line.endswith("\tHEAD"):
+                run_git("symbolic-ref", "HEAD", line[len("ref: ") : -len("\tHEAD")], cwd=mirror_path)
+
+    def _fetch_commit(self, mirror_path, commit):
+        """fetches only the pinned commit (shallow if the mirror has no history yet), returns its full hash"""
+        resolved = self._resolve_commit(mirror_path, commit)
+        if resolved:
+            return resolved
+
+        is_new = not run_git("for-each-ref", "--count=1", cwd=mirror_path)
+        try:
+            args = ["fetch", "origin", commit]
+            if is_new or self._is_shallow(mirror_path):
+                args.insert(1, "--depth=1")
+            run_git(*args, cwd=mirror_path)
+            resolved = self._resolve_commit(mirror_path, "FETCH_HEAD")
+        except Exception as e:
+            # short hashes can't be fetched and some servers only serve the branch tips
+            app_logger.log(LoggingType.DEBUG, f"Unable to fetch {commit} on its own: {e}")
+            self._fetch_all(mirror_path)
+            resolved = self._resolve_commit(mirror_path, commit)
+
+        if not resolved:
+            raise Exception(f"Commit {commit} not found in {mirror_path}")
+        # the ref keeps the commit from being pruned
+        run_git("update-ref", f"refs/pinned/{resolved}", resolved, cwd=mirror_path)
+        return resolved
+
+    def update(self, url, commit=None):
+        """
+        makes sure the mirror of url has the commit (or the latest branches if commit
+        is None), returns (mirror path, full hash of the commit or None)
+        """
+        mirror_path = self.get_mirror_path(url)
+        os.makedirs(self.root, exist_ok=True)
+        # several runners / threads can share the mirror
+        with portalocker.Lock(mirror_path + ".lock", "a", timeout=self.lock_timeout):
+            if not os.path.exists(os.path.join(mirror_path, "HEAD")):
+                run_git("init", "--bare", "--quiet", mirror_path)
+                run_git("remote", "add", "origin", url, cwd=mirror_path)
+
+            if commit:
+                return mirror_path, self._fetch_commit(mirror_path, commit)
+
+            self._fetch_all(mirror_path)
+            return mirror_path, None
+
+    # ----------- checkout -----------------
+    def checkout(self, url, dest, commit=None):
+        """
+        checks out the repo at dest (at the commit or the default branch), fetching only
+        what the mirror is missing. the origin of the checkout is url
+        """
+        mirror_path, resolved = self.update(url, commit)
+        try:
+            # left by an earlier attempt (or install) at the same commit
+            is_checked_out = (
+                bool(resolved)
+                and os.path.exists(os.path.join(dest, ".git"))
+                and run_git("rev-parse", "HEAD", cwd=dest) == resolved
+            )
+        except Exception:
+            is_checked_out = False
+
+        if not is_checked_out:
+            self._clone_from_mirror(mirror_path, url, dest, resolved)
+
+        if os.path.exists(os.path.join(dest, ".gitmodules")):
+            run_git("submodule", "update", "--init", "--recursive", cwd=dest)
+
+        return resolved or run_git("rev-parse", "HEAD", cwd=dest)
+
+    def _clone_from_mirror(self, mirror_path, url, dest, resolved):
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+
+        if not self._is_shallow(mirror_path):
+            # local clones hardlink the objects of the mirror
+            run_git("clone", "--quiet", "--no-checkout", mirror_path, dest)
+        else:
+            # shallow repos can't be cloned locally, the commit is fetched from the mirror
+            run_git("init", "--quiet", dest)
+            run_git("fetch", "--quiet", mirror_path, resolved, cwd=dest)
+
+        if "origin" in run_git("remote", cwd=dest).split():
+            run_git("remote", "set-url", "origin", url, cwd=dest)
+        else:
+            run_git("remote", "add", "origin", url, cwd=dest)
+
+        if resolved:
+            run_git("checkout", "--quiet", "--force", "--detach", resolved, cwd=dest)
+        else:
+            # the clone is on the default branch already, only the files are missing
+            run_git("checkout", "--quiet", "--force", "HEAD", cwd=dest)
+
+
+git_mirror_cache = GitMirrorCache()
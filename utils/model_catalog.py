@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+from ..constants import COMFY_MODELS_BASE_PATH, MODEL_CATALOG_PATH
+from .common import convert_to_relative_path, find_git_root, get_default_save_path
+from .logger import LoggingType, app_logger
+
+# bump this when the compiled format changes, so that old catalogs are rebuilt
+CATALOG_VERSION = 1
+
+# these models have incorrect details in the Comfy Manager data json
+# and should be ignored here
+IGNORE_MANAGER_MODEL_LIST = [
+    "sd_xl_base_1.0.safetensors",
+    "sd_xl_refiner_1.0_0.9vae.safetensors",
+]
+
+
+def _get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ModelCatalog:
+    """
+    filename -> (url, dest, type) of every model in the weight files (local) and
+    the comfy model lists (these have preference). the sources are parsed and their
+    paths normalized once, the result is stored in a pickle at catalog_path and
+    reused until the mtime / size and then the hash of a source changes
+    """
+
+    def __init__(self, local_path_list, comfy_path_list, catalog_path=MODEL_CATALOG_PATH):
+        self.local_path_list = list(local_path_list)
+        self.comfy_path_list = list(comfy_path_list)
+        self.catalog_path = catalog_path
+        self.lock = threading.RLock()
+        self._source_list = None  # (abs path, is comfy list)
+        self._source_state = None  # abs path -> (mtime_ns, size, sha1), None if missing
+        self._model_dict = None  # filename -> (url, dest, type)
+        self._name_list_dict = {}  # "local" / "comfy" -> filenames of that source
+        self._similar_index_dict = {}  # "local" / "comfy" -> SimilarTextIndex
+
+    # ----------- lookups -----------------
+    def get(self, model_name):
+        """returns (url, dest, type) of the model or None"""
+        self._ensure_loaded()
+        return self._model_dict.get(model_name)
+
+    def __contains__(self, model_name):
+        self._ensure_loaded()
+        return model_name in self._model_dict
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._model_dict)
+
+    def get_similar_models(self, model_name):
+        """names similar to model_name, from the weight files first and then the comfy lists"""
+        from .similarity_index import SimilarTextIndex
+
+        self._ensure_loaded()
+        similar_model_list = []
+        for source in ("local", "comfy"):
+            with self.lock:
+                if source not in self._similar_index_dict:
+                    self._similar_index_dict[source] = SimilarTextIndex(
+                        self._name_list_dict[source]
+                    )
+                index = self._similar_index_dict[source]
+            similar_model_list += index.search(model_name)
+
+        return similar_model_list
+
+    # ----------- maintenance -----------------
+    def refresh(self):
+        """reloads the catalog if a source file was changed / added / removed"""
+        with self.lock:
+            if self._model_dict is None:
+                self._ensure_loaded()
+                return
+
+            source_state, changed = self._get_source_state(self._source_state)
+            if changed:
+                self._compile(source_state)
+            elif source_state != self._source_state:
+                # only touched, the compiled data is still valid
+                self._source_state = source_state
+                self._save()
+
+    def _ensure_loaded(self):
+        if self._model_dict is not None:
+            return
+
+        with self.lock:
+            if self._model_dict is not None:
+                return
+
+            stored = self._load()
+            source_state, changed = self._get_source_state(
+                stored["source_state"] if stored else None
+            )
+            if stored and not changed:
+                self._model_dict = stored["model_dict"]
+                self._name_list_dict = stored["name_list_dict"]
+                self._source_state = source_state
+                if source_state != stored["source_state"]:
+                    self._save()
+                return
+
+            self._compile(source_state)
+
+    def _get_sources(self):
+        if self._source_list is None:
+            root = find_git_root(os.path.dirname(__file__))
+            self._source_list = [
+                (os.path.abspath(os.path.join(root, path)), False)
+                for path in self.local_path_list
+            ] + [
+                (os.path.abspath(os.path.join(root, path)), True)
+                for path in self.comfy_path_list
+            ]
+
+        return self._source_list
+
+    def _get_source_state(self, previous_state):
+        """returns the (mtime_ns, size, sha1) of every source and if any of them changed"""
+        previous_state = previous_state or {}
+        source_state = {}
+        changed = set(previous_state.keys()) != {p for p, _ in self._get_sources()}
+        for path, _ in self._get_sources():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                source_state[path] = None
+                changed = changed or previous_state.get(path) is not None
+                continue
+
+            previous = previous_state.get(path)
+            if previous and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+                source_state[path] = previous
+                continue
+
+            # the hash is only computed when the mtime / size differ
+            sha1 = _get_file_hash(path)
+            source_state[path] = (stat.st_mtime_ns, stat.st_size, sha1)
+            changed = changed or not previous or previous[2] != sha1
+
+        return source_state, changed
+
+    def _compile(self, source_state):
+        start_time = time.time()
+        local_model_dict = {}
+        comfy_model_dict = {}
+        for path, is_comfy_list in self._get_sources():
+            if source_state.get(path) is None:
+                app_logger.log(LoggingType.DEBUG, f"model list path not found - {path}")
+                continue
+
+            with open(path, "rb") as f:
+                data = json.load(f)
+
+            if is_comfy_list:
+                is_manager_list = path.endswith("ComfyUI-Manager/model-list.json")
+                for model in data["models"]:
+                    if is_manager_list and model["filename"] in IGNORE_MANAGER_MODEL_LIST:
+                        continue
+                    # the first entry of a filename is the one that's used
+                    if model["filename"] not in comfy_model_dict:
+                        comfy_model_dict[model["filename"]] = self._compile_comfy_model(model)
+            else:
+                for model_name, model in data.items():
+                    # weight files with lower index have preference
+                    if model_name not in local_model_dict:
+                        dest = convert_to_relative_path(
+                            model["dest"], base_comfy=COMFY_MODELS_BASE_PATH
+                        )
+                        local_model_dict[model_name] = (
+                            model["url"],
+                            dest,
+                            os.path.basename(os.path.normpath(dest)),
+                        )
+
+        model_dict = dict(local_model_dict)
+        model_dict.update(comfy_model_dict)
+
+        self._model_dict = model_dict
+        self._name_list_dict = {
+            "local": list(local_model_dict.keys()),
+            "comfy": list(comfy_model_dict.keys()),
+        }
+        self._similar_index_dict = {}
+        self._source_state = source_state
+        self._save()
+        app_logger.log(
+            LoggingType.DEBUG,
+            f"Compiled model catalog ({len(model_dict)} models) in {time.time() - start_time:.2f}s",
+        )
+
+    @staticmethod
+    def _compile_comfy_model(model):
+        save_path = model.get("save_path") or ""
+        if save_path.endswith("default"):
+            save_path = get_default_save_path(model["type"])
+
+        return (
+            model["url"],
+            os.path.join(COMFY_MODELS_BASE_PATH, "models", save_path),
+            model["type"],
+        )
+
+    # ----------- storage -----------------
+    def _get_header(self):
+        # the compiled paths depend on the models base path as well
+        return {"version": CATALOG_VERSION, "models_base_path": COMFY_MODELS_BASE_PATH}
+
+    def _load(self):
+        if not self.catalog_path or not os.path.exists(self.catalog_path):
+            return None
+
+        try:
+            with open(self.catalog_path, "rb") as f:
+                stored = pickle.load(f)
+        except Exception as e:
+            app_logger.log(LoggingType.DEBUG, f"Unable to load the model catalog: {e}")
+            return None
+
+        if not isinstance(stored, dict) or stored.get("header") != self._get_header():
+            return None
+
+        return stored
+
+    def _save(self):
+        if not self.catalog_path:
+            return
+
+        stored = {
+            "header": self._get_header(),
+            "source_state": self._source_state,
+            "model_dict": self._model_dict,
+            "name_list_dict": self._name_list_dict,
+        }
+        tmp_path = f"{self.catalog_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.catalog_path)), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.catalog_path)
+        except OSError as e:
+            # the in memory catalog still works, it is just compiled again next time
+            app_logger.log(LoggingType.DEBUG, f"Unable to save the model catalog: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_catalog_list = {}
+_catalog_lock = threading.Lock()
+
+
+def get_model_catalog(local_path_list, comfy_path_list):
+    """returns the shared catalog of these sources, creating it (not loading it) on first use"""
+    key = (tuple(local_path_list), tuple(comfy_path_list))
+    with _catalog_lock:
+        if key not in _catalog_list:
+            _catalog_list[key] = ModelCatalog(local_path_list, comfy_path_list)
+
+        return _catalog_list[key]
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+
+from .logger import LoggingType, app_logger
+
+
+class ModelFileIndex:
+    """
+    filename -> paths index of a directory tree (symlinks are followed).
+    the tree is walked once and after that only the directories whose mtime
+    has changed are re-listed, so lookups don't have to walk the disk again
+    """
+
+    # directories modified this close to the scan are re-listed on the next refresh,
+    # as coarse mtime resolution can hide a change made in the same tick
+    HOT_DIR_WINDOW = 2
+    # a miss re-checks the directory mtimes (the file may have been created since the
+    # last refresh) at most this often, so a workflow with several missing models costs
+    # a single pass. downloads invalidate the index, so their files are seen right away
+    MISS_REFRESH_INTERVAL = 0.5
+
+    def __init__(self, root, refresh_interval=1):
+        self.root = os.path.abspath(root)
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self._dir_mtimes = {}  # rel dir -> mtime_ns at the time of listing
+        self._dir_entries = {}  # rel dir -> (files, subdirs)
+        self._hot_dirs = set()
+        self._files = {}  # filename -> {rel path: None} (insertion ordered)
+        self._last_refresh = 0
+        self._built = False
+
+    # ----------- lookups -----------------
+    def find(self, filename):
+        """returns paths (relative to the root) of every file named filename"""
+        self.refresh()
+        with self.lock:
+            if (
+                filename not in self._files
+                and time.time() - self._last_refresh >= self.MISS_REFRESH_INTERVAL
+            ):
+                # a miss might be a file created after the last refresh
+                self.refresh(force=True)
+
+            return list(self._files.get(filename, {}).keys())
+
+    def contains(self, filename, parent_folder=None):
+        for path in self.find(filename):
+            if not parent_folder:
+                return True
+
+            parent_dir = os.path.dirname(os.path.join(self.root, path))
+            if os.path.basename(parent_dir) == parent_folder:
+                return True
+
+        return False
+
+    # ----------- maintenance -----------------
+    def invalidate(self):
+        with self.lock:
+            self._last_refresh = 0
+
+    def refresh(self, force=False):
+        with self.lock:
+            if not self._built:
+                start_time = time.time()
+                self._scan_tree("")
+                self._built = True
+                self._last_refresh = time.time()
+                app_logger.log(
+                    LoggingType.DEBUG,
+                    f"Indexed {len(self._files)} filenames under {self.root} "
+                    f"in {time.time() - start_time:.2f}s",
+                )
+                return
+
+            if not force and time.time() - self._last_refresh < self.refresh_interval:
+                return
+
+            for rel_dir in list(self._dir_mtimes.keys()):
+                if rel_dir not in self._dir_mtimes:
+                    continue  # dropped along with a removed parent
+
+                mtime = self._get_mtime(rel_dir)
+                if mtime is None:
+                    self._drop_tree(rel_dir)
+                elif mtime != self._dir_mtimes[rel_dir] or rel_dir in self._hot_dirs:
+                    self._rescan_dir(rel_dir)
+
+            self._last_refresh = time.time()
+
+    def _abs(self, rel_path):
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+    def _get_mtime(self, rel_dir):
+        try:
+            return os.stat(self._abs(rel_dir)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _list_dir(self, rel_dir):
+        files, subdirs = [], []
+        try:
+            with os.scandir(self._abs(rel_dir)) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()  # follows symlinks
+                    except OSError:
+                        is_dir = False
+                    (subdirs if is_dir else files).append(entry.name)
+        except OSError:
+            return None
+
+        return files, subdirs
+
+    def _record_dir(self, rel_dir, mtime, listing):
+        self._dir_mtimes[rel_dir] = mtime
+        self._dir_entries[rel_dir] = listing
+        if time.time() - mtime / 1e9 < self.HOT_DIR_WINDOW:
+            self._hot_dirs.add(rel_dir)
+        else:
+            self._hot_dirs.discard(rel_dir)
+
+    def _get_ancestor_real_paths(self, rel_dir):
+        real_path_set = set()
+        parts = rel_dir.split(os.sep) if rel_dir else []
+        for idx in range(len(parts)):
+            real_path_set.add(os.path.realpath(self._abs(os.path.join("", *parts[:idx]))))
+        return frozenset(real_path_set)
+
+    def _scan_tree(self, rel_dir):
+        # like os.walk(followlinks=True) every path of a symlinked folder is indexed,
+        # a folder is only skipped when it is one of its own ancestors (symlink loop)
+        stack = [(rel_dir, self._get_ancestor_real_paths(rel_dir))]
+        while stack:
+            current, ancestor_set = stack.pop()
+            real_path = os.path.realpath(self._abs(current))
+            if real_path in ancestor_set:
+                continue
+
+            mtime = self._get_mtime(current)
+            listing = self._list_dir(current) if mtime is not None else None
+            if listing is None:
+                continue
+
+            self._record_dir(current, mtime, listing)
+            files, subdirs = listing
+            for file in files:
+                self._add_file(os.path.join(current, file) if current else file)
+            # reversed so that the traversal order matches os.walk's top-down order
+            child_ancestor_set = ancestor_set | {real_path}
+            for subdir in reversed(subdirs):
+                stack.append(
+                    (os.path.join(current, subdir) if current else subdir, child_ancestor_set)
+                )
+
+    def _rescan_dir(self, rel_dir):
+        mtime = self._get_mtime(rel_dir)
+        listing = self._list_dir(rel_dir) if mtime is not None else None
+        if listing is None:
+            self._drop_tree(rel_dir)
+            return
+
+        old_files, old_subdirs = self._dir_entries.get(rel_dir, ([], []))
+        files, subdirs = listing
+        self._record_dir(rel_dir, mtime, listing)
+
+        join = lambda name: os.path.join(rel_dir, name) if rel_dir else name
+        for file in set(old_files) - set(files):
+            self._remove_file(join(file))
+        for file in files:
+            if file not in old_files:
+                self._add_file(join(file))
+        for subdir in set(old_subdirs) - set(subdirs):
+            self._drop_tree(join(subdir))
+        for subdir in subdirs:
+            if subdir not in old_subdirs:
+                self._scan_tree(join(subdir))
+
+    def _drop_tree(self, rel_dir):
+        prefix = os.path.join(rel_dir, "") if rel_dir else ""
+        for current in [
+            d for d in self._dir_mtimes if d == rel_dir or d.startswith(prefix)
+        ]:
+            files, _ = self._dir_entries.pop(current, ([], []))
+            for file in files:
+                self._remove_file(os.path.join(current, file) if current else file)
+            del self._dir_mtimes[current]
+            self._hot_dirs.discard(current)
+
+    def _add_file(self, rel_path):
+        self._files.setdefault(os.path.basename(rel_path), {})[rel_path] = None
+
+    def _remove_file(self, rel_path):
+        filename = os.path.basename(rel_path)
+        paths = self._files.get(filename, {})
+        paths.pop(rel_path, None)
+        if not paths:
+            self._files.pop(filename, None)
+
+
+_index_list = {}
+_index_lock = threading.Lock()
+
+
+def get_model_index(directory):
+    """returns the shared index for the directory, creating it on first use"""
+    root = os.path.abspath(directory)
+    with _index_lock:
+        if root not in _index_list:
+            _index_list[root] = ModelFileIndex(root)
+
+        return _index_list[root]
+
+
+def invalidate_model_index(directory=None):
+    """
+    forces the next lookup to re-check directory mtimes of every index that
+    overlaps with the directory (all indexes if directory is None)
+    """
+    path = os.path.abspath(directory) if directory else None
+    is_related = lambda a, b: a == b or a.startswith(os.path.join(b, ""))
+    with _index_lock:
+        index_list = [
+            index
+            for root, index in _index_list.items()
+            if path is None or is_related(path, root) or is_related(root, path)
+        ]
+
+    for index in index_list:
+        index.invalidate()
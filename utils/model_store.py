@@ -0,0 +1,192 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import portalocker
+
+from ..constants import COMFY_MODELS_BASE_PATH, MODEL_STORE_PATH
+from .logger import LoggingType, app_logger
+
+
+class ModelStore:
+    """
+    content addressed storage for model files. every unique file is stored once as
+    <root>/sha256/<ab>/<sha256> and the paths ComfyUI expects are hardlinks to it
+    (symlinks if the store is on a different filesystem).
+    the url -> sha256 mapping of previous downloads is kept so that a model requested
+    again under a different filename or folder is linked instead of downloaded
+    """
+
+    def __init__(self, root=MODEL_STORE_PATH, lock_timeout=30):
+        self.root = os.path.abspath(root)
+        self.index_path = os.path.join(self.root, "index.json")
+        self.lock_timeout = lock_timeout
+        self.lock = threading.Lock()
+        self._url_index = None
+        self._index_mtime = None
+
+    # ----------- lookups -----------------
+    def get_blob_path(self, sha256):
+        return os.path.join(self.root, "sha256", sha256[:2], sha256)
+
+    def has_blob(self, sha256):
+        return bool(sha256) and os.path.exists(self.get_blob_path(sha256))
+
+    def lookup_url(self, url):
+        """returns the sha256 of the file previously downloaded from url (if it is still stored)"""
+        sha256 = self._load_index().get(url)
+        return sha256 if self.has_blob(sha256) else None
+
+    # ----------- updates -----------------
+    def link(self, sha256, target_path):
+        """materializes the stored blob at target_path"""
+        blob_path = self.get_blob_path(sha256)
+        os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+        tmp_path = target_path + ".link"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            try:
+                os.symlink(blob_path, tmp_path)
+            except OSError:
+                shutil.copy2(blob_path, tmp_path)  # e.g. windows without symlink rights
+        os.replace(tmp_path, target_path)
+        return target_path
+
+    def add_file(self, file_path, target_path, url=None):
+        """
+        moves file_path into the store (or drops it if the same content is already
+        stored) and links it at target_path. returns the sha256 of the file
+        """
+        # a url downloaded before (whose blob was removed since) isn't hashed again
+        sha256 = (url and self._load_index().get(url)) or self.hash_file(file_path)
+        blob_path = self.get_blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if os.path.exists(blob_path):
+            app_logger.log(
+                LoggingType.DEBUG, f"{os.path.basename(target_path)} is a duplicate"
+            )
+            os.remove(file_path)
+        else:
+            self._move_into_store(file_path, blob_path)
+
+        self.link(sha256, target_path)
+        if url:
+            self._update_index({url: sha256})
+
+        return sha256
+
+    def _move_into_store(self, file_path, blob_path):
+        try:
+            os.replace(file_path, blob_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        # the download dest is on another filesystem (e.g. a models folder symlinked to
+        # nfs), the file is copied next to the blob first so that the blob only ever
+        # shows up complete
+        tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(file_path, "rb") as src, open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024 * 4)
+                dst.flush()
+                os.fsync(dst.fileno())
+            shutil.copystat(file_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        os.remove(file_path)
+
+    def gc(self, model_dir_list=(COMFY_MODELS_BASE_PATH,)):
+        """
+        removes the blobs nothing links to anymore: a single hardlink (the blob itself)
+        and no symlink to it under model_dir_list. returns the bytes freed
+        """
+        blob_dir = os.path.join(self.root, "sha256")
+        if not os.path.exists(blob_dir):
+            return 0
+
+        # blobs linked through the symlink fallback (store on another filesystem)
+        symlinked_set = set()
+        for model_dir in model_dir_list:
+            for root, dirs, files in os.walk(model_dir):
+                dirs[:] = [d for d in dirs if os.path.join(root, d) != self.root]
+                for name in dirs + files:
+                    path = os.path.join(root, name)
+                    if os.path.islink(path):
+                        symlinked_set.add(os.path.realpath(path))
+
+        removed_size = 0
+        for root, _, files in os.walk(blob_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                if stat.st_nlink == 1 and os.path.realpath(path) not in symlinked_set:
+                    removed_size += stat.st_size
+                    os.remove(path)
+
+        app_logger.log(
+            LoggingType.INFO, f"Model store gc freed {removed_size / 1024 ** 2:.1f} MB"
+        )
+        return removed_size
+
+    @staticmethod
+    def hash_file(file_path, chunk_size=1024 * 1024 * 4):
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for data in iter(lambda: f.read(chunk_size), b""):
+                sha256.update(data)
+        return sha256.hexdigest()
+
+    # ----------- index -----------------
+    def _load_index(self):
+        with self.lock:
+            mtime = (
+                os.path.getmtime(self.index_path)
+                if os.path.exists(self.index_path)
+                else None
+            )
+            if self._url_index is None or mtime != self._index_mtime:
+                self._url_index = {}
+                if mtime is not None:
+                    try:
+                        with open(self.index_path, "r") as f:
+                            self._url_index = json.load(f)
+                    except (OSError, ValueError):
+                        pass
+                self._index_mtime = mtime
+
+            return self._url_index
+
+    def _update_index(self, url_map):
+        # several runners can share the store, so the index is updated under a file lock
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock:
+            try:
+                with portalocker.Lock(
+                    self.index_path + ".lock", "a", timeout=self.lock_timeout
+                ):
+                    url_index = {}
+                    if os.path.exists(self.index_path):
+                        with open(self.index_path, "r") as f:
+                            url_index = json.load(f)
+                    url_index.update(url_map)
+                    with open(self.index_path + ".tmp", "w") as f:
+                        json.dump(url_index, f)
+                    os.replace(self.index_path + ".tmp", self.index_path)
+            except portalocker.exceptions.LockException:
+                app_logger.log(
+                    LoggingType.ERROR, "Unable to lock the model store index"
+                )
+                return
+
+            self._url_index = None
@@ -6,13 +6,14 @@ import os
 import platform
 import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-import zipfile
 
-import git
-from git import RemoteProgress
-from tqdm import tqdm
+from ..constants import NODE_INSTALL_WORKERS
+from .archive import extract_archive_stream
 from .common import find_git_root
+from .git_mirror import git_mirror_cache
+from .logger import LoggingType, app_logger
 
 
 def get_node_installer():
@@ -41,8 +42,18 @@ class NodeInstaller:
             self.comfyui_manager_path, "startup-scripts"
         )
         self.download_url = file_downloader
+        self.pip_report_list = []  # report of every pip run (time, packages changed)
 
     # ----------- helper utils ----------------
+    def _install_pip_packages(self, package_list, cwd="."):
+        from .pip_installer import install_requirements
+
+        report = install_requirements(
+            [self._remap_pip_package(p) for p in package_list], cwd=cwd
+        )
+        self.pip_report_list.append(report)
+        return report
+
     def _is_valid_url(self, url):
         try:
             result = urlparse(url)
@@ -74,26 +85,18 @@ class NodeInstaller:
         requirements_path = os.path.join(repo_path, "requirements.txt")
 
         if os.path.exists(requirements_path):
-            print("Install: pip packages")
-            with open(requirements_path, "r") as requirements_file:
-                for line in requirements_file:
-                    package_name = self._remap_pip_package(line.strip())
-                    if package_name and not package_name.startswith("#"):
-                        install_cmd = [
-                            sys.executable,
-                            "-m",
-                            "pip",
-                            "install",
-                            package_name,
-                        ]
-                        if package_name.strip() != "" and not package_name.startswith(
-                            "#"
-                        ):
-                            try:
-                                self._run_script(install_cmd, cwd=repo_path)
-                            except Exception as e:
-                                print(f"error installing {url} ")
-                                return False
+            from .requirements_verifier import requirements_verifier
+
+            # the requirements that are already satisfied (name and version) are skipped,
+            # the rest is installed with a single pip run
+            unsatisfied_list = requirements_verifier.check_file(requirements_path)
+            if unsatisfied_list:
+                app_logger.log(LoggingType.INFO, "Install: pip packages")
+                report = self._install_pip_packages(unsatisfied_list, cwd=repo_path)
+                if not report["status"]:
+                    app_logger.log(LoggingType.ERROR, f"error installing {url}")
+                    return False
+                requirements_verifier.mark_installed(requirements_path, unsatisfied_list)
 
         if os.path.exists(install_script_path):
             print(f"Install: install script")
@@ -106,21 +109,36 @@ class NodeInstaller:
 
         return True
 
-    def _gitclone(self, custom_nodes_path, url, target_hash=None):
+    def _get_repo_path(self, url):
+        repo_name = os.path.splitext(os.path.basename(url))[0]
+        return os.path.join(self.custom_nodes_path, repo_name)
+
+    def _gitclone(self, custom_nodes_path, url, target_hash=None, progress=True):
         repo_name = os.path.splitext(os.path.basename(url))[0]
         repo_path = os.path.join(custom_nodes_path, repo_name)
 
         max_retries = 5
         for attempt in range(max_retries):
             try:
+                if git_mirror_cache.enabled:
+                    # only what the mirror is missing is fetched, so a retry continues
+                    # from the objects the failed attempt already downloaded
+                    commit = git_mirror_cache.checkout(url, repo_path, target_hash)
+                    app_logger.log(
+                        LoggingType.INFO, f"Successfully cloned {repo_name} [{commit}]"
+                    )
+                    return True
+
                 if os.path.exists(repo_path):
                     shutil.rmtree(repo_path)
                 
+                import git
+
                 repo = git.Repo.clone_from(
                     url,
                     repo_path,
                     recursive=True,
-                    progress=GitProgress(),
+                    progress=get_git_progress() if progress else None,
                 )
 
                 if target_hash is not None:
@@ -145,7 +163,6 @@ class NodeInstaller:
 
     def _unzip_install(self, files):
         # simply downloads the url and extracts it
-        temp_filename = "manager-temp.zip"
         for url in files:
             if url.endswith("/"):
                 url = url[:-1]
@@ -155,16 +172,8 @@ class NodeInstaller:
                 }
 
                 req = urllib.request.Request(url, headers=headers)
-                response = urllib.request.urlopen(req)
-                data = response.read()
-
-                with open(temp_filename, "wb") as f:
-                    f.write(data)
-
-                with zipfile.ZipFile(temp_filename, "r") as zip_ref:
-                    zip_ref.extractall(self.custom_nodes_path)
-
-                os.remove(temp_filename)
+                with urllib.request.urlopen(req) as response:
+                    extract_archive_stream(response, self.custom_nodes_path, "zip")
             except Exception as e:
                 print(f"Install(unzip) error: {url} / {e}")
                 return False
@@ -256,25 +265,101 @@ class NodeInstaller:
 
         # installing the dependencies
         if "pip" in json_data:
-            for pname in json_data["pip"]:
-                pkg = self._remap_pip_package(pname)
-                install_cmd = [sys.executable, "-m", "pip", "install", pkg]
-                try:
-                    self._run_script(install_cmd, cwd=".")
-                except Exception as e:
-                    print(f"error installing {json_data['files'][0]} ")
+            report = self._install_pip_packages(json_data["pip"], cwd=".")
+            if not report["status"]:
+                app_logger.log(
+                    LoggingType.ERROR, f"error installing {json_data['files'][0]}"
+                )
 
         return True if res else False
 
+    def install_nodes(self, node_list, cancel_check=None, max_workers=NODE_INSTALL_WORKERS):
+        """
+        installs git node packs, node_list: list of {"title", "url", "commit_hash", "pip"}.
+        the clones (network bound) run in parallel, then the dependencies (pip can't run
+        concurrently) are installed one pack at a time in the order of node_list.
+        returns url -> {"title", "status", "error"} of every node
+        """
+        is_cancelled = cancel_check or (lambda: False)
+        result_dict = {}
+        clone_list = []  # (url, commit hash)
+        pip_dict = {}  # url -> extra pip packages of the node
+        repo_path_dict = {}  # repo path -> url cloned there
+        for node in node_list:
+            url = node["url"].rstrip("/")
+            if url in result_dict:
+                continue
+
+            result = {"title": node.get("title", ""), "status": False, "error": None}
+            result_dict[url] = result
+            repo_path = self._get_repo_path(url)
+            if not self._is_valid_url(url):
+                result["error"] = "invalid git url"
+            elif repo_path in repo_path_dict:
+                result["error"] = f"same folder as {repo_path_dict[repo_path]}"
+            else:
+                repo_path_dict[repo_path] = url
+                clone_list.append((url, node.get("commit_hash")))
+                pip_dict[url] = node.get("pip", [])
+
+        def _clone(item):
+            url, commit_hash = item
+            if is_cancelled():
+                return "cancelled"
+            app_logger.log(LoggingType.INFO, f"Download: git clone '{url}'")
+            # the progress bars of parallel clones would overwrite each other
+            res = self._gitclone(
+                self.custom_nodes_path, url, commit_hash, progress=len(clone_list) == 1
+            )
+            return None if res else "clone failed"
+
+        if clone_list:
+            with ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(clone_list)))
+            ) as executor:
+                for (url, _), error in zip(clone_list, executor.map(_clone, clone_list)):
+                    result_dict[url]["error"] = error
+
+        for url, _ in clone_list:
+            result = result_dict[url]
+            if result["error"]:
+                continue
+            if is_cancelled():
+                result["error"] = "cancelled"
+                continue
+
+            if not self._execute_install_script(url, self._get_repo_path(url)):
+                result["error"] = "dependency install failed"
+            elif pip_dict[url] and not self._install_pip_packages(pip_dict[url])["status"]:
+                result["error"] = "pip install failed"
+            else:
+                result["status"] = True
+
+        return result_dict
+
+
+_git_progress_class = None
+
 
 # TODO: move to a separate interface
-class GitProgress(RemoteProgress):
-    def __init__(self):
-        super().__init__()
-        self.pbar = tqdm()
-
-    def update(self, op_code, cur_count, max_count=None, message=""):
-        self.pbar.total = max_count
-        self.pbar.n = cur_count
-        self.pbar.pos = 0
-        self.pbar.refresh()
+def get_git_progress():
+    # the class is created on first use, so that git / tqdm are only imported when cloning
+    global _git_progress_class
+    if _git_progress_class is None:
+        from git import RemoteProgress
+        from tqdm import tqdm
+
+        class GitProgress(RemoteProgress):
+            def __init__(self):
+                super().__init__()
+                self.pbar = tqdm()
+
+            def update(self, op_code, cur_count, max_count=None, message=""):
+                self.pbar.total = max_count
+                self.pbar.n = cur_count
+                self.pbar.pos = 0
+                self.pbar.refresh()
+
+        _git_progress_class = GitProgress
+
+    return _git_progress_class()
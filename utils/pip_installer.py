@@ -0,0 +1,81 @@
+import subprocess
+import sys
+import time
+
+from ..constants import PIP_WHEELHOUSE_PATH
+from .logger import LoggingType, app_logger
+from .requirements_verifier import requirements_verifier
+
+
+def _get_pip_args(requirement):
+    # options like "-e ./pkg" are separate args, a requirement (with markers) is a single one
+    return requirement.split(None, 1) if requirement.startswith("-") else [requirement]
+
+
+def _run_pip(arg_list, cwd):
+    cmd = [sys.executable, "-m", "pip", "install", *arg_list]
+    return subprocess.run(cmd, cwd=cwd).returncode == 0
+
+
+def install_requirements(requirement_list, cwd=".", wheelhouse=PIP_WHEELHOUSE_PATH):
+    """
+    installs the requirements that are not satisfied yet with a single pip run. if a
+    wheelhouse folder is given it is tried first without the index (offline), and if the
+    batch fails every requirement is installed on its own so that one bad pin doesn't
+    block the rest. returns a report with
+        status:     False if some requirement couldn't be installed
+        skipped:    requirements that were already satisfied
+        installed:  requirements passed to pip
+        failed:     requirements pip failed on
+        changed:    package -> (old version, new version) of the packages pip changed
+        time:       secs spent
+    """
+    start_time = time.time()
+    requirement_list = list(dict.fromkeys(r.strip() for r in requirement_list if r.strip()))
+    unsatisfied_list = requirements_verifier.get_unsatisfied(requirement_list)
+    report = {
+        "status": True,
+        "skipped": [r for r in requirement_list if r not in unsatisfied_list],
+        "installed": unsatisfied_list,
+        "failed": [],
+        "changed": {},
+        "time": 0,
+    }
+    if not unsatisfied_list:
+        report["time"] = time.time() - start_time
+        return report
+
+    installed_before = requirements_verifier.get_installed_dict()
+    arg_list = [a for r in unsatisfied_list for a in _get_pip_args(r)]
+    status = False
+    if wheelhouse:
+        status = _run_pip(["--no-index", "--find-links", wheelhouse, *arg_list], cwd)
+        if not status:
+            app_logger.log(
+                LoggingType.DEBUG, "Not everything is in the wheelhouse, using the index"
+            )
+    link_arg_list = ["--find-links", wheelhouse] if wheelhouse else []
+    if not status:
+        status = _run_pip(link_arg_list + arg_list, cwd)
+    if not status and len(unsatisfied_list) > 1:
+        for requirement in unsatisfied_list:
+            if not _run_pip(link_arg_list + _get_pip_args(requirement), cwd):
+                report["failed"].append(requirement)
+    elif not status:
+        report["failed"] = list(unsatisfied_list)
+
+    requirements_verifier.invalidate()
+    installed_after = requirements_verifier.get_installed_dict()
+    for name in set(installed_before) | set(installed_after):
+        if installed_before.get(name) != installed_after.get(name):
+            report["changed"][name] = (installed_before.get(name), installed_after.get(name))
+
+    report["status"] = not report["failed"]
+    report["time"] = time.time() - start_time
+    app_logger.log(
+        LoggingType.INFO if report["status"] else LoggingType.ERROR,
+        f"pip: {len(unsatisfied_list)} requirements installed ({len(report['skipped'])} "
+        f"already satisfied, {len(report['failed'])} failed) in {report['time']:.1f}s, "
+        f"changed: {', '.join(f'{n} {o} -> {v}' for n, (o, v) in report['changed'].items()) or 'nothing'}",
+    )
+    return report
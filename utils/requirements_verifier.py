@@ -0,0 +1,216 @@
+import hashlib
+import importlib.metadata
+import os
+import sys
+import threading
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+from .logger import LoggingType, app_logger
+
+
+def _get_environment_fingerprint():
+    # pip adds / removes / renames the dist-info folders when it changes a package,
+    # which updates the mtime of the site-packages folder it is in
+    fingerprint = []
+    for path in sys.path:
+        try:
+            fingerprint.append((path, os.stat(path or ".").st_mtime_ns))
+        except OSError:
+            continue
+    return tuple(fingerprint)
+
+
+def _scan_installed():
+    """canonical name -> version of the installed distributions"""
+    installed_dict = {}
+    for path in sys.path:
+        try:
+            entry_list = sorted(os.scandir(path or "."), key=lambda e: e.name)
+        except OSError:
+            continue
+
+        for entry in entry_list:
+            if not entry.name.endswith((".dist-info", ".egg-info")):
+                continue
+
+            # dist-info folders are named {name}-{version} (with - in the name escaped),
+            # so the metadata only has to be read for the egg-info ones without a version
+            stem = entry.name.rsplit(".", 1)[0]
+            name, _, version = stem.partition("-")
+            version = version.split("-")[0]
+            if not version:
+                try:
+                    dist = importlib.metadata.Distribution.at(entry.path)
+                    name, version = dist.metadata["Name"], dist.version
+                except Exception:
+                    continue
+
+            # the first one on sys.path is the one that gets imported
+            if name and version:
+                installed_dict.setdefault(canonicalize_name(name), version)
+
+    return installed_dict
+
+
+def _read_requirement_lines(requirements_file, seen_file_set=None):
+    """requirement lines of the file (and the files it includes with -r), comments / options removed"""
+    seen_file_set = seen_file_set or set()
+    requirements_file = os.path.abspath(requirements_file)
+    if requirements_file in seen_file_set:
+        return []
+    seen_file_set.add(requirements_file)
+
+    with open(requirements_file, "r", encoding="utf-8") as f:
+        content = f.read().replace("\\\n", "")
+
+    line_list = []
+    for line in content.splitlines():
+        # inline comments need a space before the # (a url can have a fragment)
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+
+        for option in ("-r ", "--requirement ", "--requirement="):
+            if line.startswith(option):
+                include_path = os.path.join(
+                    os.path.dirname(requirements_file), line[len(option) :].strip()
+                )
+                line_list += _read_requirement_lines(include_path, seen_file_set)
+                break
+        else:
+            # the other options (index urls, -c ...) are not requirements, -e is kept
+            # and reported as unverifiable
+            if not line.startswith("-") or line.startswith(("-e ", "--editable")):
+                line_list.append(line)
+
+    return line_list
+
+
+def is_verifiable(requirement_line):
+    """False for the lines that can't be checked against the installed packages (vcs urls, -e, local paths)"""
+    try:
+        return not Requirement(requirement_line).url
+    except InvalidRequirement:
+        return False
+
+
+def get_requirement_name(requirement_line):
+    """canonical package name of a requirement line, None if it isn't a plain requirement"""
+    try:
+        return canonicalize_name(Requirement(requirement_line).name)
+    except InvalidRequirement:
+        return None
+
+
+class RequirementsVerifier:
+    """
+    checks requirement lines (name, version specifiers, markers) against the installed
+    distributions (dist-info / egg-info folders on sys.path). the installed versions and the results of the
+    files are cached till the environment fingerprint (mtime of the sys.path folders)
+    changes, so repeated checks only cost a few stats
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._fingerprint = None
+        self._installed_dict = {}  # canonical name -> version
+        self._file_result_dict = {}  # (file path, content hash) -> unsatisfied lines
+        # (file path, content hash) -> unverifiable lines pip already installed, these are
+        # kept till the process exits as the installed packages can't tell if they changed
+        self._installed_unverifiable_dict = {}
+
+    def invalidate(self):
+        with self.lock:
+            self._fingerprint = None
+
+    def _get_installed_dict(self):
+        fingerprint = _get_environment_fingerprint()
+        with self.lock:
+            if fingerprint != self._fingerprint:
+                self._installed_dict = _scan_installed()
+                self._file_result_dict = {}
+                self._fingerprint = fingerprint
+
+            return self._installed_dict
+
+    def get_installed_dict(self):
+        """canonical name -> version of every installed distribution"""
+        return dict(self._get_installed_dict())
+
+    def get_installed_version(self, package_name):
+        return self._get_installed_dict().get(canonicalize_name(package_name))
+
+    def is_satisfied(self, requirement_line):
+        """
+        True if the installed packages satisfy the line (e.g. "numpy>=1.25,<2"). the
+        lines that can't be verified (urls, editable installs, invalid) are unsatisfied
+        """
+        try:
+            requirement = Requirement(requirement_line)
+        except InvalidRequirement:
+            return False
+
+        if requirement.url:
+            return False
+        if requirement.marker and not requirement.marker.evaluate():
+            return True  # not needed on this platform / python
+
+        version = self.get_installed_version(requirement.name)
+        if version is None:
+            return False
+
+        return requirement.specifier.contains(version, prereleases=True)
+
+    def get_unsatisfied(self, requirement_list):
+        """the lines of requirement_list that are not satisfied"""
+        self._get_installed_dict()
+        return [r for r in requirement_list if not self.is_satisfied(r)]
+
+    @staticmethod
+    def _get_file_key(requirements_file):
+        with open(requirements_file, "rb") as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        return os.path.abspath(requirements_file), content_hash
+
+    def mark_installed(self, requirements_file, requirement_list):
+        """
+        records the unverifiable lines of the file that pip installed, check_file skips
+        them from then on (instead of running pip for them on every check)
+        """
+        key = self._get_file_key(requirements_file)
+        line_list = [r for r in requirement_list if not is_verifiable(r)]
+        with self.lock:
+            installed_set = self._installed_unverifiable_dict.setdefault(key, set())
+            line_list = [r for r in line_list if r not in installed_set]
+            installed_set.update(line_list)
+
+        for line in line_list:
+            app_logger.log(
+                LoggingType.INFO,
+                f"'{line}' of {requirements_file} can't be verified, it isn't installed again till the file changes",
+            )
+
+    def check_file(self, requirements_file):
+        """the unsatisfied lines of a requirements.txt, cached by its content and the environment"""
+        key = self._get_file_key(requirements_file)
+        self._get_installed_dict()
+        with self.lock:
+            installed_set = self._installed_unverifiable_dict.get(key, set())
+            if key in self._file_result_dict:
+                return [r for r in self._file_result_dict[key] if r not in installed_set]
+
+        unsatisfied_list = self.get_unsatisfied(_read_requirement_lines(requirements_file))
+        with self.lock:
+            self._file_result_dict[key] = unsatisfied_list
+        unsatisfied_list = [r for r in unsatisfied_list if r not in installed_set]
+
+        app_logger.log(
+            LoggingType.DEBUG,
+            f"{len(unsatisfied_list)} unsatisfied requirements in {requirements_file}",
+        )
+        return list(unsatisfied_list)
+
+
+requirements_verifier = RequirementsVerifier()
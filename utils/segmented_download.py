@@ -0,0 +1,174 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+
+import requests
+
+from ..constants import SEGMENTED_DOWNLOAD_CONNECTIONS, SEGMENTED_DOWNLOAD_MIN_SIZE
+from .logger import LoggingType, app_logger
+
+
+class SegmentedDownloader:
+    """
+    downloads a file over several parallel range requests, every segment is written
+    in place (positional writes) into a preallocated file.
+    progress is kept in the download metadata as [start, end, bytes_done] per segment
+    so that an interrupted download only re-fetches what is missing
+    """
+
+    def __init__(
+        self,
+        connections=SEGMENTED_DOWNLOAD_CONNECTIONS,
+        min_size=SEGMENTED_DOWNLOAD_MIN_SIZE,
+        chunk_size=1024 * 256,
+    ):
+        self.connections = max(1, connections)
+        self.min_size = min_size
+        self.chunk_size = chunk_size
+        self.write_lock = threading.Lock()  # only needed when os.pwrite is missing
+
+    def probe(self, url):
+        """
+        returns the remote file details, None if the HEAD request failed. segmented is
+        False if the server doesn't advertise range support or the file is too small
+        """
+        try:
+            response = requests.head(url, allow_redirects=True, timeout=30)
+            response.raise_for_status()
+        except Exception as e:
+            app_logger.log(LoggingType.DEBUG, f"HEAD request failed: {str(e)}")
+            return None
+
+        total_size = int(response.headers.get("content-length", 0))
+        return {
+            "resolved_url": response.url,  # redirect target (e.g. the CDN url)
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "total_size": total_size,
+            "segmented": self.connections >= 2
+            and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            and total_size >= max(self.min_size, 1),
+        }
+
+    def split(self, total_size):
+        segment_size = -(-total_size // self.connections)
+        return [
+            [start, min(start + segment_size, total_size) - 1, 0]
+            for start in range(0, total_size, segment_size)
+        ]
+
+    def download(
+        self, part_path, meta, save_meta, cancel_check=None, max_connections=None
+    ):
+        """
+        meta:              metadata of the download, must contain resolved_url and total_size.
+                           segments are added on the first attempt and reused on the next ones
+        save_meta:         called with the metadata whenever the progress is persisted
+        max_connections:   segments fetched at a time (defaults to self.connections)
+        returns False if the download was cancelled through cancel_check
+        """
+        total_size = meta["total_size"]
+        if not meta.get("segments") or not os.path.exists(part_path):
+            meta["segments"] = self.split(total_size)
+            self._preallocate(part_path, total_size)
+        save_meta(meta)
+
+        segment_list = [s for s in meta["segments"] if s[0] + s[2] <= s[1]]
+        done_size = sum(s[2] for s in meta["segments"])
+        from tqdm import tqdm
+
+        progress_bar = tqdm(
+            total=total_size, initial=done_size, unit="B", unit_scale=True
+        )
+        stop_event = threading.Event()
+        fd = os.open(part_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            with ThreadPoolExecutor(
+                max_workers=max(1, min(max_connections or self.connections, self.connections))
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self._download_segment,
+                        meta,
+                        segment,
+                        fd,
+                        progress_bar,
+                        stop_event,
+                        cancel_check,
+                    )
+                    for segment in segment_list
+                ]
+                error, cancelled = None, False
+                for future in as_completed(futures):
+                    try:
+                        cancelled = future.result() or cancelled
+                        save_meta(meta)
+                    except Exception as e:
+                        # stopping the other segments, their progress is kept for the retry
+                        stop_event.set()
+                        error = error or e
+        finally:
+            os.close(fd)
+            progress_bar.close()
+            save_meta(meta)
+
+        if error:
+            raise error
+
+        return not cancelled
+
+    def _download_segment(
+        self, meta, segment, fd, progress_bar, stop_event, cancel_check
+    ):
+        start, end, _ = segment
+        headers = {"Range": f"bytes={start + segment[2]}-{end}"}
+        if meta.get("etag") and not meta["etag"].startswith("W/"):
+            headers["If-Range"] = meta["etag"]
+
+        with requests.get(
+            meta["resolved_url"], headers=headers, stream=True, timeout=60
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise Exception("Server ignored the range request")
+
+            for data in response.iter_content(chunk_size=self.chunk_size):
+                if stop_event.is_set():
+                    return False
+                if cancel_check and cancel_check():
+                    stop_event.set()
+                    return True
+
+                data = data[: end - (start + segment[2]) + 1]
+                self._write_at(fd, data, start + segment[2])
+                segment[2] += len(data)
+                progress_bar.update(len(data))
+
+        if start + segment[2] <= end:
+            raise Exception(f"Segment {start}-{end} ended early")
+
+        return False
+
+    def _write_at(self, fd, data, offset):
+        view = memoryview(data)
+        if hasattr(os, "pwrite"):
+            while len(view):
+                written = os.pwrite(fd, view, offset)
+                view, offset = view[written:], offset + written
+        else:
+            with self.write_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                while len(view):
+                    view = view[os.write(fd, view) :]
+
+    def _preallocate(self, part_path, total_size):
+        with open(part_path, "wb") as f:
+            f.truncate(total_size)
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total_size)
+                except OSError:
+                    pass  # not supported by every filesystem, the sparse file works too
+
+
+segmented_downloader = SegmentedDownloader()
@@ -0,0 +1,202 @@
+import bisect
+import heapq
+from collections import Counter
+
+import Levenshtein
+from fuzzywuzzy import fuzz, utils
+
+TRIGRAM_LEN = 3
+
+
+def _process(text):
+    # same processing as fuzzywuzzy's process.extract does with WRatio
+    return utils.full_process(text, force_ascii=True)
+
+
+def _get_trigram_counter(token_list):
+    # trigrams inside the tokens (the ones spanning a space are not indexed)
+    counter = Counter()
+    for token in token_list:
+        for idx in range(len(token) - TRIGRAM_LEN + 1):
+            counter[token[idx : idx + TRIGRAM_LEN]] += 1
+    return counter
+
+
+def _get_inner_trigram_count(token_set):
+    return sum(max(len(token) - TRIGRAM_LEN + 1, 0) for token in token_set)
+
+
+def _joined_len(token_set):
+    return sum(len(token) for token in token_set) + len(token_set) - 1
+
+
+class SimilarTextIndex:
+    """
+    finds the texts that fuzzywuzzy's process.extract (WRatio) scores above the cutoff,
+    without scoring the whole list. a score above 90 is only possible when the
+    processed lengths are within 1.5x (else the partial ratios, scaled by 0.9, are
+    used) and one of these is high
+        - the ratio of the texts or of their sorted tokens (checked with Levenshtein)
+        - the token set ratio, either one token set is (almost) contained in the
+          other, or the shared + remaining tokens of both are within a small edit
+          distance, so they share at least max(inner trigrams) - 3 * distance
+          trigrams (q-gram lemma)
+    only the texts passing these checks are scored with WRatio, so the results are the
+    same as of fuzzy_text_match
+    """
+
+    # lowest ratio of the texts that can still score above 90 (91 / 100)
+    MIN_RATIO = 0.9
+    # lowest ratio of the token strings that can still score above 90 (96 * 0.95 / 100)
+    MIN_TOKEN_RATIO = 0.95
+    # the token set ratio is only high enough if the tokens missing on one side are
+    # at most this share of its joined tokens (2 * shared / (shared + all) >= ratio)
+    MAX_MISSING_TOKEN_SHARE = (2 - 2 * MIN_TOKEN_RATIO) / (2 - MIN_TOKEN_RATIO)
+
+    def __init__(self, text_list):
+        self.text_list = list(text_list)
+        self.processed_list = []
+        self.token_set_list = []
+        self.sorted_token_list = []
+        self.inner_trigram_count_list = []
+        self.trigram_counter_list = []
+        self.trigram_postings = {}  # trigram -> list of text idx
+
+        for idx, text in enumerate(self.text_list):
+            processed = _process(text)
+            token_list = processed.split()
+            self.processed_list.append(processed)
+            self.token_set_list.append(set(token_list))
+            self.sorted_token_list.append(" ".join(sorted(token_list)))
+            self.inner_trigram_count_list.append(
+                _get_inner_trigram_count(set(token_list))
+            )
+            trigram_counter = _get_trigram_counter(token_list)
+            self.trigram_counter_list.append(trigram_counter)
+            for trigram in trigram_counter:
+                self.trigram_postings.setdefault(trigram, []).append(idx)
+
+        self.token_postings = {}  # token -> list of text idx
+        for idx, token_set in enumerate(self.token_set_list):
+            for token in token_set:
+                self.token_postings.setdefault(token, []).append(idx)
+
+        # a text can only contain (almost) all of its tokens in the query if the query
+        # has one of its rarest tokens
+        self.key_token_postings = {}  # token -> list of text idx
+        for idx, token_set in enumerate(self.token_set_list):
+            for token in self._get_key_token_list(token_set):
+                self.key_token_postings.setdefault(token, []).append(idx)
+
+        self.length_order = sorted(
+            range(len(self.text_list)), key=lambda i: len(self.processed_list[i])
+        )
+        self.sorted_length_list = [len(self.processed_list[i]) for i in self.length_order]
+
+    def _get_key_token_list(self, token_set):
+        # rarest tokens that are longer (with their separators) than the share that can
+        # be missing, so any token set missing all of them is too different
+        max_missing_len = self.MAX_MISSING_TOKEN_SHARE * _joined_len(token_set)
+        key_token_list = []
+        key_len = 0
+        for token in sorted(token_set, key=lambda t: len(self.token_postings.get(t, []))):
+            key_token_list.append(token)
+            key_len += len(token) + 1
+            if key_len > max_missing_len:
+                break
+        return key_token_list
+
+    def _token_set_match(self, query_token_set, token_set):
+        # ratio of the shared tokens vs the shared + remaining tokens of either side
+        shared_token_set = query_token_set & token_set
+        if not shared_token_set:
+            return False
+
+        shared_len = _joined_len(shared_token_set)
+        for diff_token_set in (query_token_set - token_set, token_set - query_token_set):
+            if not diff_token_set:
+                return True
+            combined_len = shared_len + 1 + _joined_len(diff_token_set)
+            if 2 * shared_len / (shared_len + combined_len) >= self.MIN_TOKEN_RATIO:
+                return True
+
+        return False
+
+    def _get_candidate_list(self, processed_query):
+        query_token_list = processed_query.split()
+        query_token_set = set(query_token_list)
+        query_sorted_tokens = " ".join(sorted(query_token_list))
+        query_inner_trigram_count = _get_inner_trigram_count(query_token_set)
+
+        query_len = len(processed_query)
+        start = bisect.bisect_right(self.sorted_length_list, query_len / 1.5)
+        end = bisect.bisect_left(self.sorted_length_list, query_len * 1.5)
+
+        # a text needs at least min_shared (>= the lowest one in the length window)
+        # trigrams of the query, so it has to contain one of its rarest trigrams. only
+        # the texts in their postings can pass the trigram check
+        query_trigram_counter = _get_trigram_counter(query_token_list)
+        lowest_min_shared = query_inner_trigram_count - TRIGRAM_LEN * int(
+            (1 - self.MIN_TOKEN_RATIO) * (query_len + query_len * 1.5)
+        )
+        trigram_rest_count = sum(query_trigram_counter.values())
+        trigram_idx_set = set()
+        for trigram in sorted(
+            query_trigram_counter, key=lambda t: len(self.trigram_postings.get(t, []))
+        ):
+            if trigram_rest_count < lowest_min_shared:
+                break
+            trigram_idx_set.update(self.trigram_postings.get(trigram, []))
+            trigram_rest_count -= query_trigram_counter[trigram]
+
+        token_idx_set = set()
+        for token in self._get_key_token_list(query_token_set):
+            token_idx_set.update(self.token_postings.get(token, []))
+        for token in query_token_set:
+            token_idx_set.update(self.key_token_postings.get(token, []))
+
+        candidate_list = []
+        for idx in self.length_order[start:end]:
+            processed = self.processed_list[idx]
+            if (
+                Levenshtein.ratio(processed_query, processed) >= self.MIN_RATIO
+                or Levenshtein.ratio(query_sorted_tokens, self.sorted_token_list[idx])
+                >= self.MIN_TOKEN_RATIO
+            ):
+                candidate_list.append(idx)
+                continue
+
+            max_distance = int(
+                (1 - self.MIN_TOKEN_RATIO) * (query_len + len(processed))
+            )
+            min_shared = (
+                max(query_inner_trigram_count, self.inner_trigram_count_list[idx])
+                - TRIGRAM_LEN * max_distance
+            )
+            if min_shared <= 0 or (
+                idx in trigram_idx_set
+                and sum((query_trigram_counter & self.trigram_counter_list[idx]).values())
+                >= min_shared
+            ):
+                candidate_list.append(idx)
+            elif idx in token_idx_set and self._token_set_match(
+                query_token_set, self.token_set_list[idx]
+            ):
+                candidate_list.append(idx)
+
+        # in the list order, so that ties are resolved the same way as process.extract
+        return sorted(candidate_list)
+
+    def search(self, query, limit=2, score_cutoff=90):
+        """same as fuzzy_text_match(text_list, query, limit): the best limit texts, if they score above score_cutoff"""
+        processed_query = _process(query)
+        if not processed_query:
+            return []
+
+        scored_list = []
+        for idx in self._get_candidate_list(processed_query):
+            score = fuzz.WRatio(processed_query, self.processed_list[idx], full_process=False)
+            if score > score_cutoff:
+                scored_list.append((self.text_list[idx], score))
+
+        return [text for text, _ in heapq.nlargest(limit, scored_list, key=lambda x: x[1])]
@@ -0,0 +1,555 @@
+import os
+import subprocess
+import sys
+import time
+
+# heavy dependencies that are imported at their call sites, a plain
+# `import comfy_runner.inf` (e.g. a job for an already running server) must not load them
+LAZY_MODULE_LIST = [
+    "pkg_resources",
+    "git",
+    "psutil",
+    "toml",
+    "websocket",
+    "fuzzywuzzy",
+    "Levenshtein",
+    "tqdm",
+    "aiohttp",
+]
+
+# cumulative import time of the module in ms (best of the runs), requests alone is ~100 ms
+IMPORT_TIME_BUDGET_MS = int(os.getenv("COMFY_RUNNER_IMPORT_TIME_BUDGET_MS", 250))
+
+
+def measure_import_time(module_name, cwd=None):
+    """
+    imports module_name in a fresh interpreter with -X importtime, returns
+    module -> (self ms, cumulative ms) of every module that got imported
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if res.returncode != 0:
+        raise Exception(f"Unable to import {module_name}: {res.stderr[-2000:]}")
+
+    import_time_dict = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        import_time_dict[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+
+    return import_time_dict
+
+
+def check_import_budget(module_name, cwd=None, runs=5, budget_ms=IMPORT_TIME_BUDGET_MS):
+    """returns (best cumulative ms, list of problems), the list is empty if within the budget"""
+    best_ms = None
+    problem_list = []
+    for _ in range(runs):
+        import_time_dict = measure_import_time(module_name, cwd)
+        total_ms = import_time_dict[module_name][1]
+        best_ms = total_ms if best_ms is None else min(best_ms, total_ms)
+
+    eager_list = [
+        m
+        for m in LAZY_MODULE_LIST
+        if any(name == m or name.startswith(f"{m}.") for name in import_time_dict)
+    ]
+    if eager_list:
+        problem_list.append(f"imported eagerly: {', '.join(eager_list)}")
+    if best_ms > budget_ms:
+        problem_list.append(f"import took {best_ms:.1f} ms, the budget is {budget_ms} ms")
+
+    return best_ms, problem_list
+
+
+def benchmark_import(runs=5):
+    """import time of the package vs the budget, returns False if it is exceeded"""
+    package_name = __package__.split(".")[0]
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # the package is imported from the directory it lives in
+    cwd = os.path.dirname(package_dir)
+    module_name = f"{package_name}.inf"
+
+    import_time_dict = measure_import_time(module_name, cwd)
+    top_list = sorted(
+        (
+            (name, cumulative_ms)
+            for name, (_, cumulative_ms) in import_time_dict.items()
+            if "." not in name and name != module_name
+        ),
+        key=lambda x: -x[1],
+    )[:10]
+    print(f"slowest top level imports of {module_name}:")
+    for name, cumulative_ms in top_list:
+        print(f"  {name:<24} {cumulative_ms:8.1f} ms")
+
+    best_ms, problem_list = check_import_budget(module_name, cwd, runs)
+    print(f"{module_name}: {best_ms:.1f} ms (best of {runs}), budget {IMPORT_TIME_BUDGET_MS} ms")
+    for problem in problem_list:
+        print(f"FAIL: {problem}")
+
+    return not problem_list
+
+
+def benchmark_port_lookup(iterations=20):
+    """port -> pid lookup time of the full psutil scan vs /proc/net/tcp"""
+    import socket
+
+    import psutil
+
+    from .common import _find_process_by_port_scan, find_process_by_port
+
+    server_socket = socket.socket()
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen()
+    port = server_socket.getsockname()[1]
+
+    def measure(fn):
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            assert fn() == os.getpid()
+        return (time.perf_counter() - start_time) / iterations * 1000
+
+    print(f"processes: {len(psutil.pids())}")
+    print(f"psutil scan:             {measure(lambda: _find_process_by_port_scan(port)):.3f} ms")
+    print(f"/proc (external server): {measure(lambda: find_process_by_port(port)):.3f} ms")
+    print(
+        f"/proc (tracked pid):     "
+        f"{measure(lambda: find_process_by_port(port, [os.getpid()])):.3f} ms"
+    )
+    server_socket.close()
+    return True
+
+
+def benchmark_node_matcher(pattern_count=5000):
+    """node type resolution time of the regex scan vs the matcher"""
+    import glob
+    import json
+    import random
+    import re
+
+    from .comfy.node_matcher import NodeTypeMatcher
+
+    random.seed(0)
+
+    # every node type of the example workflows is treated as unregistered
+    example_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+    node_type_set = set()
+    for path in glob.glob(os.path.join(example_dir, "**", "*.json"), recursive=True):
+        with open(path, "r") as f:
+            node_type_set.update(node["class_type"] for node in json.load(f).values())
+    node_type_list = sorted(node_type_set)
+
+    # synthetic catalog in the shape of the manager's nodename_pattern values
+    def random_word():
+        return "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+
+    pattern_list = []
+    for idx in range(pattern_count):
+        word = random_word()
+        kind = idx % 5
+        if kind == 0:
+            pattern = f" \\({word}\\)$"
+        elif kind == 1:
+            pattern = f"^{word.capitalize()}"
+        elif kind == 2:
+            pattern = f"\\[{word}\\]$|^{word.upper()}_"
+        elif kind == 3:
+            pattern = f"^{word}[0-9]+_node$"
+        else:
+            pattern = f"{word}.*(loader|sampler)"
+        pattern_list.append((pattern, f"https://github.com/x/{word}"))
+    # a few that do match the example node types
+    for node_type in node_type_list[:3]:
+        pattern_list.append((f"^{re.escape(node_type)}$", "https://github.com/x/exact"))
+    pattern_list.append((" \\(IPAdapter\\)$|^IPAdapter", "https://github.com/x/ipadapter"))
+
+    def regex_scan(regex_to_url=None):
+        # filter_missing_node used to compile the patterns on every call
+        if regex_to_url is None:
+            regex_to_url = [{"regex": re.compile(p), "url": u} for p, u in pattern_list]
+        url_set = set()
+        for node_type in node_type_list:
+            for regex_item in regex_to_url:
+                if regex_item["regex"].search(node_type):
+                    url_set.add(regex_item["url"])
+        return url_set
+
+    start_time = time.perf_counter()
+    matcher = NodeTypeMatcher(pattern_list)
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    scan_result = regex_scan()
+    scan_time = time.perf_counter() - start_time
+
+    iterations = 20
+    regex_to_url = [{"regex": re.compile(p), "url": u} for p, u in pattern_list]
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        regex_scan(regex_to_url)
+    precompiled_scan_time = (time.perf_counter() - start_time) / iterations
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        matcher_result = set()
+        for node_type in node_type_list:
+            matcher_result.update(matcher.match(node_type))
+    match_time = (time.perf_counter() - start_time) / iterations
+
+    assert matcher_result == scan_result, (matcher_result, scan_result)
+    print(f"{len(node_type_list)} node types, {len(pattern_list)} patterns")
+    print(f"regex scan:    {scan_time * 1000:.2f} ms (compiling included)")
+    print(f"regex scan:    {precompiled_scan_time * 1000:.2f} ms (precompiled)")
+    print(f"matcher build: {build_time * 1000:.2f} ms (once per catalog)")
+    print(f"matcher:       {match_time * 1000:.2f} ms")
+    return True
+
+
+def benchmark_similar_models(query_count=100):
+    """similar model lookup time of fuzzy_text_match vs the index on the bundled model lists"""
+    import glob
+    import json
+    import random
+
+    from .common import fuzzy_text_match
+    from .similarity_index import SimilarTextIndex
+
+    random.seed(0)
+
+    data_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+    model_name_list = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "models" in data:
+            model_name_list.extend(m["filename"] for m in data["models"])
+        else:
+            model_name_list.extend(data)
+    model_name_list = list(dict.fromkeys(model_name_list))
+
+    # typos / version changes of the listed models and a few unrelated names
+    def mutate(name):
+        name = list(name)
+        for _ in range(random.randint(0, 3)):
+            pos = random.randrange(len(name))
+            op = random.randint(0, 2)
+            if op == 0:
+                name[pos] = random.choice("abcdefghijklmnopqrstuvwxyz0123456789_.")
+            elif op == 1:
+                name.insert(pos, random.choice("abcdefghijklmnopqrstuvwxyz0123456789_"))
+            elif len(name) > 1:
+                del name[pos]
+        return "".join(name)
+
+    query_list = [mutate(random.choice(model_name_list)) for _ in range(query_count)]
+    query_list += ["model.safetensors", "v3_sd15_mm.ckpt", "sd_xl_base_1.0.safetensors"]
+
+    start_time = time.perf_counter()
+    index = SimilarTextIndex(model_name_list)
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    expected_list = [fuzzy_text_match(model_name_list, q) for q in query_list]
+    scan_time = (time.perf_counter() - start_time) / len(query_list)
+
+    start_time = time.perf_counter()
+    result_list = [index.search(q) for q in query_list]
+    index_time = (time.perf_counter() - start_time) / len(query_list)
+
+    mismatch_list = [
+        (q, e, r) for q, e, r in zip(query_list, expected_list, result_list) if e != r
+    ]
+    print(f"{len(model_name_list)} models, {len(query_list)} queries, {len(mismatch_list)} mismatches")
+    print(f"fuzzy_text_match: {scan_time * 1000:.2f} ms per query")
+    print(f"index build:      {build_time * 1000:.2f} ms (once per catalog)")
+    print(f"index:            {index_time * 1000:.2f} ms per query")
+    for mismatch in mismatch_list[:5]:
+        print(mismatch)
+    return True
+
+
+def benchmark_segmented_download(size_mb=64, per_connection_mbps=20):
+    """single stream vs segmented download time from a local range capable file server"""
+    import re
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import requests
+
+    from .segmented_download import SegmentedDownloader
+
+    rate_limit = per_connection_mbps * 1024 * 1024
+    work_dir = tempfile.mkdtemp()
+    source_path = os.path.join(work_dir, "model.bin")
+    with open(source_path, "wb") as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        # throttles every connection, similar to a CDN's per-connection cap
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, send_body):
+            total_size = os.path.getsize(source_path)
+            start, end, status = 0, total_size - 1, 200
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start, status = int(match[1]), 206
+                end = int(match[2]) if match[2] else end
+
+            self.send_response(status)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{total_size}")
+            self.end_headers()
+            if not send_body:
+                return
+
+            with open(source_path, "rb") as f:
+                f.seek(start)
+                remaining, chunk_size = end - start + 1, 64 * 1024
+                while remaining > 0:
+                    data = f.read(min(chunk_size, remaining))
+                    self.wfile.write(data)
+                    remaining -= len(data)
+                    time.sleep(len(data) / rate_limit)
+
+        def do_HEAD(self):
+            self._respond(False)
+
+        def do_GET(self):
+            self._respond(True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/model.bin"
+
+    start_time = time.time()
+    with requests.get(url, stream=True) as response, open(
+        os.path.join(work_dir, "single.bin"), "wb"
+    ) as f:
+        for data in response.iter_content(chunk_size=1024 * 256):
+            f.write(data)
+    single_time = time.time() - start_time
+
+    downloader = SegmentedDownloader(min_size=0)
+    start_time = time.time()
+    meta = downloader.probe(url)
+    downloader.download(os.path.join(work_dir, "segmented.bin"), meta, lambda m: None)
+    segmented_time = time.time() - start_time
+
+    with open(source_path, "rb") as a, open(
+        os.path.join(work_dir, "segmented.bin"), "rb"
+    ) as b:
+        assert a.read() == b.read(), "segmented download is corrupted"
+
+    server.shutdown()
+    print(f"single stream: {single_time:.2f}s ({size_mb / single_time:.1f} MB/s)")
+    print(
+        f"segmented ({downloader.connections} connections): {segmented_time:.2f}s "
+        f"({size_mb / segmented_time:.1f} MB/s)"
+    )
+    return True
+
+
+def benchmark_comfy_api(request_count=500):
+    """per request latency of a new connection per call vs the pooled session"""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import requests
+
+    from .comfy.api import ComfyAPI
+
+    class QueueHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the aiohttp server of comfy
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = json.dumps({"queue_running": [], "queue_pending": []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QueueHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = ComfyAPI("http://127.0.0.1", server.server_address[1])
+
+    start_time = time.perf_counter()
+    for _ in range(request_count):
+        requests.get(api.SERVER_URL + api.QUEUE_URL).json()
+    unpooled_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(request_count):
+        api.get_queue()
+    pooled_time = time.perf_counter() - start_time
+
+    server.shutdown()
+    print(f"new connection per request: {unpooled_time / request_count * 1000:.3f} ms")
+    print(f"pooled session:             {pooled_time / request_count * 1000:.3f} ms")
+    return True
+
+
+def benchmark_requirements_check(requirements_file=""):
+    """
+    requirements check time of the pkg_resources scan vs the verifier, a sample
+    requirements file is used if none is given
+    """
+    import tempfile
+
+    from .requirements_verifier import RequirementsVerifier
+
+    if not requirements_file:
+        requirements_file = os.path.join(tempfile.mkdtemp(), "requirements.txt")
+        with open(requirements_file, "w") as f:
+            f.write(
+                "torch\ntorchsde\neinops\ntransformers>=4.28.1\ntokenizers>=0.13.3\n"
+                "sentencepiece\nsafetensors>=0.4.2\naiohttp\npyyaml\nPillow\nscipy\n"
+                "tqdm\npsutil\nkornia>=0.7.1\nspandrel\nsoundfile\nrequests\n"
+            )
+
+    def pkg_resources_check():
+        # what quick_requirements_check used to do
+        import pkg_resources
+
+        with open(requirements_file, "r") as f:
+            requirements = []
+            for line in f:
+                if line.strip() and not line.startswith("#"):
+                    delimeter = "=="
+                    if ">=" in line.strip():
+                        delimeter = ">="
+                    elif "<=" in line.strip():
+                        delimeter = "<="
+                    requirements.append(line.strip().lower().split(delimeter)[0])
+
+        installed_pkg_list = sorted(
+            [dist.project_name.lower() for dist in pkg_resources.working_set]
+        )
+        return [p for p in requirements if p not in installed_pkg_list]
+
+    def measure(fn, iterations):
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            res = fn()
+        return res, (time.perf_counter() - start_time) / iterations * 1000
+
+    start_time = time.perf_counter()
+    import pkg_resources
+
+    import_time = (time.perf_counter() - start_time) * 1000
+    old_res, old_time = measure(pkg_resources_check, 20)
+
+    verifier = RequirementsVerifier()
+    new_res, first_time = measure(lambda: verifier.check_file(requirements_file), 1)
+    _, cached_time = measure(lambda: verifier.check_file(requirements_file), 200)
+
+    print(f"pkg_resources:      {old_time:.2f} ms per check (+{import_time:.0f} ms import), missing {old_res}")
+    print(f"verifier (first):   {first_time:.2f} ms, unsatisfied {new_res}")
+    print(f"verifier (cached):  {cached_time:.3f} ms")
+    return True
+
+
+def benchmark_model_catalog(iterations=100):
+    """time taken to load the model catalog from the json sources vs the compiled catalog"""
+    import tempfile
+
+    from ..constants import COMFY_MODEL_PATH_LIST, MODEL_DOWNLOAD_PATH_LIST
+    from .model_catalog import ModelCatalog
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        catalog_path = os.path.join(tmp_dir, "model_catalog.pickle")
+
+        start_time = time.perf_counter()
+        catalog = ModelCatalog(MODEL_DOWNLOAD_PATH_LIST, COMFY_MODEL_PATH_LIST, catalog_path)
+        init_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        catalog.get("")
+        compile_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        catalog = ModelCatalog(MODEL_DOWNLOAD_PATH_LIST, COMFY_MODEL_PATH_LIST, catalog_path)
+        catalog.get("")
+        load_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            catalog.refresh()
+        refresh_time = (time.perf_counter() - start_time) / iterations
+
+        name_list = list(catalog._model_dict.keys())
+        start_time = time.perf_counter()
+        for name in name_list:
+            catalog.get(name)
+        lookup_time = (time.perf_counter() - start_time) / len(name_list)
+
+        print(f"{len(catalog)} models, {os.path.getsize(catalog_path) / 1024:.0f} KB compiled")
+        print(f"init:     {init_time * 1000:.3f} ms")
+        print(f"compile:  {compile_time * 1000:.2f} ms (json sources)")
+        print(f"load:     {load_time * 1000:.2f} ms (compiled catalog)")
+        print(f"refresh:  {refresh_time * 1000:.3f} ms (unchanged sources)")
+        print(f"lookup:   {lookup_time * 1000000:.2f} us")
+    return True
+
+
+def benchmark_workflow_validation(object_info_path, workflow_path, iterations=1000):
+    """time taken to validate the workflow (api format) against a saved /object_info"""
+    import json
+
+    from .comfy.workflow_validator import validate_workflow
+
+    with open(object_info_path, "r") as f:
+        object_info = json.load(f)
+    with open(workflow_path, "r") as f:
+        workflow = json.load(f)
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        error_list = validate_workflow(workflow, object_info)
+    validation_time = (time.perf_counter() - start_time) / iterations * 1000
+    print(f"{len(error_list)} errors, {validation_time:.3f} ms")
+    for error in error_list:
+        print(error)
+    return True
+
+
+# name -> (benchmark, default arguments), it passes if the benchmark returns True
+BENCHMARK_DICT = {
+    "import": (benchmark_import, [5]),
+    "port": (benchmark_port_lookup, [20]),
+    "node_matcher": (benchmark_node_matcher, [5000]),
+    "similarity": (benchmark_similar_models, [100]),
+    "segmented_download": (benchmark_segmented_download, [64, 20]),
+    "comfy_api": (benchmark_comfy_api, [500]),
+    "requirements": (benchmark_requirements_check, [""]),
+    "model_catalog": (benchmark_model_catalog, [100]),
+    "workflow_validation": (benchmark_workflow_validation, ["", ""]),
+}
+
+
+# run with python -m comfy_runner.utils.startup_benchmark [benchmark] [arguments], the
+# import time budget is checked by default (exits with 1 if it is exceeded)
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "import"
+    if name not in BENCHMARK_DICT:
+        sys.exit(f"unknown benchmark {name}, available: {', '.join(BENCHMARK_DICT)}")
+
+    benchmark, default_list = BENCHMARK_DICT[name]
+    arg_list = [type(d)(arg) for d, arg in zip(default_list, sys.argv[2:])]
+    sys.exit(0 if benchmark(*arg_list, *default_list[len(arg_list) :]) else 1)